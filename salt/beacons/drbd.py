@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+'''
+Beacon to fire events on DRBD state changes
+
+.. versionadded:: pending
+
+:maintainer:    Nick Wang <nwang@suse.com>
+:maturity:      alpha
+:depends:       ``drbdsetup`` drbd utils
+:platform:      Linux
+
+One ``drbdsetup events2`` reader is kept running per minion, events are
+only fired on transitions: role change, disk state change, connection
+loss or recovery, resync start and finish. The lines are parsed by
+``salt.utils.drbd.EventsState``, like ``drbd.wait_sync_events`` does.
+
+.. code-block:: yaml
+
+    beacons:
+      drbd:
+        - resources:
+          - beijing
+          - tianjin
+        - interval: 5
+
+``resources`` is optional, all resources are watched by default.
+'''
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import os
+import select
+import subprocess
+
+import salt.utils.drbd
+import salt.utils.path
+import salt.utils.stringutils
+
+LOGGER = logging.getLogger(__name__)
+
+__virtualname__ = 'drbd'
+
+DRBDSETUP_COMMAND = 'drbdsetup'
+
+
+def __virtual__():  # pragma: no cover
+    '''
+    Only load this beacon if drbdsetup(drbd-utils) is installed
+    '''
+    if bool(salt.utils.path.which(DRBDSETUP_COMMAND)):
+        return __virtualname__
+    return (
+        False,
+        'The drbd beacon failed to load: the drbdsetup'
+        ' binary is not available.')
+
+
+def validate(config):
+    '''
+    Validate the beacon configuration
+    '''
+    if not isinstance(config, list):
+        return False, 'Configuration for drbd beacon must be a list.'
+
+    _config = {}
+    list(map(_config.update, config))
+
+    if not isinstance(_config.get('resources', []), list):
+        return False, 'Resources for drbd beacon must be a list.'
+
+    return True, 'Valid beacon configuration'
+
+
+def _transitions(kind, res, old, new):
+    '''
+    Get the events of the changes of one object.
+    Naming is the same as ``drbd.status``.
+    '''
+    ret = []
+
+    if kind == 'resource':
+        if old.get('role') != new.get('role'):
+            ret.append({'tag': '{}/role'.format(res), 'resource name': res,
+                        'old': old.get('role'), 'new': new.get('role')})
+
+    elif kind == 'connection':
+        peer = new.get('conn-name', old.get('conn-name'))
+        if old.get('role') != new.get('role') and new.get('role'):
+            ret.append({'tag': '{}/peer-role'.format(res), 'resource name': res,
+                        'peernode name': peer,
+                        'old': old.get('role'), 'new': new.get('role')})
+
+        was_connected = old.get('connection') == 'Connected'
+        connected = new.get('connection') == 'Connected'
+        if was_connected != connected:
+            ret.append({'tag': '{}/connection'.format(res), 'resource name': res,
+                        'peernode name': peer,
+                        'old': old.get('connection'), 'new': new.get('connection')})
+
+    elif kind == 'device':
+        if old.get('disk') != new.get('disk'):
+            ret.append({'tag': '{}/disk'.format(res), 'resource name': res,
+                        'volume': new.get('volume', old.get('volume')),
+                        'old': old.get('disk'), 'new': new.get('disk')})
+
+    elif kind == 'peer-device':
+        peer = new.get('conn-name', old.get('conn-name'))
+        volume = new.get('volume', old.get('volume'))
+        if old.get('peer-disk') != new.get('peer-disk'):
+            ret.append({'tag': '{}/peer-disk'.format(res), 'resource name': res,
+                        'peernode name': peer, 'volume': volume,
+                        'old': old.get('peer-disk'), 'new': new.get('peer-disk')})
+
+        was_syncing = old.get('replication') in salt.utils.drbd.SYNC_STATES
+        syncing = new.get('replication') in salt.utils.drbd.SYNC_STATES
+        if was_syncing != syncing:
+            ret.append({'tag': '{}/resync'.format(res), 'resource name': res,
+                        'peernode name': peer, 'volume': volume,
+                        'resync': 'started' if syncing else 'finished',
+                        'old': old.get('replication'), 'new': new.get('replication')})
+
+    return ret
+
+
+def _process_line(line, state, resources=None):
+    '''
+    Apply one line to the events2 state, return the events of it.
+    Lines reporting the initial state (``exists``) fire no event.
+    '''
+    # Before ``exists -``, the lines are the initial state
+    complete = state.complete
+    changed = state.feed(line)
+
+    if changed is None or not complete:
+        return []
+
+    kind, name, _, old, new = changed
+    if resources and name not in resources:
+        return []
+
+    return _transitions(kind, name, old, new)
+
+
+def _start_reader():
+    '''
+    Start the long running ``drbdsetup events2`` reader
+    '''
+    with open(os.devnull, 'wb') as devnull:
+        proc = subprocess.Popen([DRBDSETUP_COMMAND, 'events2', 'all'],
+                                stdout=subprocess.PIPE, stderr=devnull, close_fds=True)
+
+    return {'proc': proc, 'buffer': b'', 'state': salt.utils.drbd.EventsState(),
+            'exited': False}
+
+
+def _stop_reader(reader):
+    proc = reader['proc']
+    if proc.poll() is None:
+        proc.terminate()
+    proc.wait()
+    proc.stdout.close()
+
+
+def _read_lines(reader):
+    '''
+    Read the lines available now without blocking.
+    Mark the reader as exited at EOF.
+    '''
+    proc = reader['proc']
+    lines = []
+
+    while select.select([proc.stdout], [], [], 0)[0]:
+        data = os.read(proc.stdout.fileno(), 65536)
+        if not data:
+            reader['exited'] = True
+            break
+
+        reader['buffer'] += data
+        while b'\n' in reader['buffer']:
+            line, reader['buffer'] = reader['buffer'].split(b'\n', 1)
+            lines.append(salt.utils.stringutils.to_unicode(line))
+
+    return lines
+
+
+def beacon(config):
+    '''
+    Fire events on DRBD state changes, all from one ``drbdsetup events2``.
+
+    Tags are ``<resource>/role``, ``<resource>/peer-role``,
+    ``<resource>/connection``, ``<resource>/disk``, ``<resource>/peer-disk``
+    and ``<resource>/resync``, the old and new state are in the event data.
+
+    .. code-block:: yaml
+
+        beacons:
+          drbd:
+            - resources:
+              - beijing
+            - interval: 5
+    '''
+    _config = {}
+    list(map(_config.update, config))
+    resources = _config.get('resources')
+
+    if 'drbd.events2' not in __context__:
+        __context__['drbd.events2'] = _start_reader()
+    reader = __context__['drbd.events2']
+
+    ret = []
+    for line in _read_lines(reader):
+        ret.extend(_process_line(line, reader['state'], resources))
+
+    if reader['exited']:
+        # Restart at the next interval, the initial state is read again
+        LOGGER.warning('drbdsetup events2 exited, will be restarted.')
+        _stop_reader(reader)
+        __context__.pop('drbd.events2')
+
+    return ret
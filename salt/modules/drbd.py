@@ -16,13 +16,35 @@ Module to provide DRBD functionality to Salt
 '''
 from __future__ import absolute_import, print_function, unicode_literals
 
+import fnmatch
 import logging
+import os
+import platform
+import select
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import timeit
+from xml.etree import ElementTree
+
+try:
+    import contextvars
+except ImportError:  # pragma: no cover
+    # python2, the salt loader has no context to copy
+    contextvars = None
 
 from salt.exceptions import CommandExecutionError
 from salt.ext import six
+from salt.ext.six.moves import queue
 
+import salt.utils.atomicfile
+import salt.utils.drbd
+import salt.utils.files
 import salt.utils.json
 import salt.utils.path
+import salt.utils.stringutils
 
 LOGGER = logging.getLogger(__name__)
 
@@ -30,6 +52,52 @@ LOGGER = logging.getLogger(__name__)
 __virtualname__ = 'drbd'
 
 DRBD_COMMAND = 'drbdadm'
+DRBDSETUP_COMMAND = 'drbdsetup'
+OVERVIEW_COMMAND = 'drbd-overview'
+
+# Fields of drbd-overview for mounted UpToDate devices
+OVERVIEW_USAGE_FIELDS = ('mountpoint', 'fs', 'total size', 'used', 'remains', 'percent')
+
+# drbd-utils version that provides ``drbdsetup status --json``
+JSON_STATUS_VERSION_CODE = 0x090600
+
+# Seconds a cached status stays valid
+SNAPSHOT_TTL = 10
+
+# Configuration read by drbdadm, the config index is rebuilt when it changes
+DRBD_CONFIG = '/etc/drbd.conf'
+DRBD_CONFIG_DIR = '/etc/drbd.d'
+
+# Internal meta-data: the superblock is the last 4KiB aligned block of
+# the backing disk, with the magic at byte 60 and the current UUID at byte 8
+MD_BLOCK_SIZE = 4096
+MD_MAGICS = {
+    0x8374026b: 'v08',
+    0x8374026d: 'v09',
+}
+
+# Fields of ``drbdsetup status --statistics --json`` labelling a record,
+# all other numeric fields are statistics
+STATISTICS_LABELS = ('volume', 'minor', 'node-id', 'peer-node-id')
+# Statistics only growing, reported as rate with since_last
+STATISTICS_COUNTERS = ('read', 'written', 'al-writes', 'bm-writes', 'sent', 'received')
+
+# Replication states of a congested peer with on-congestion pull-ahead
+CONGESTION_STATES = ('Ahead', 'Behind')
+
+# Replication states shown with ``done:`` in ``drbdadm status``
+SYNC_STATES = salt.utils.drbd.SYNC_STATES
+
+# drbdsetup commands of ``drbdadm -d adjust`` naming a peer node id
+# after the resource name
+PEER_COMMANDS = ('new-peer', 'del-peer', 'connect', 'disconnect', 'net-options',
+                 'new-path', 'del-path', 'peer-device-options')
+
+# Latest commands kept by perf_stats
+PERF_HISTORY = 50
+
+# Commands are recorded from the createmd_many workers too
+_PERF_LOCK = threading.Lock()
 
 
 def __virtual__():  # pragma: no cover
@@ -50,530 +118,2145 @@ def _analyse_overview_field(content):
     '''
     if "(" in content:
         # Output like "Connected(2*)" or "UpToDate(2*)"
-        return content.split("(")[0], content.split("(")[0]
+        value = content.partition("(")[0]
+        return value, value
     elif "/" in content:
         # Output like "Primar/Second" or "UpToDa/UpToDa"
-        return content.split("/")[0], content.split("/")[1]
+        local, _, partner = content.partition("/")
+        return local, partner
 
     return content, ""
 
 
-def _count_spaces_startswith(line):
+def _parse_overview_line(line):
     '''
-    Count the number of spaces before the first character
+    Parse one device line of drbd-overview, None for other lines
     '''
-    if line.split('#')[0].strip() == "":
+    fields = line.split()
+    if len(fields) < 4 or ':' not in fields[0]:
         return None
 
-    spaces = 0
-    for i in line:
-        if i.isspace():
-            spaces += 1
-        else:
-            return spaces
+    minnum, _, device = fields[0].partition(':')
+    connstate, _ = _analyse_overview_field(fields[1])
+    localrole, partnerrole = _analyse_overview_field(fields[2])
+    localdiskstate, partnerdiskstate = _analyse_overview_field(fields[3])
+
+    ret = {
+        'minor number': minnum,
+        'device': device,
+        'connection state': connstate,
+        'local role': localrole,
+        'partner role': partnerrole,
+        'local disk state': localdiskstate,
+        'partner disk state': partnerdiskstate,
+    }
 
+    if localdiskstate.startswith("UpTo") and partnerdiskstate.startswith("UpTo"):
+        # Output like "/mnt ext4 2.0G 6.1M 1.9G 1%" when mounted
+        ret.update(zip(OVERVIEW_USAGE_FIELDS, fields[4:10]))
+    elif len(fields) > 4:
+        # Output like "[==>.....] sync'ed: 15.2% (1738/2044)M"
+        ret['synchronisation: '] = fields[4]
+        ret['synched'] = ''.join(fields[6:8])
 
-def _analyse_status_type(line):
-    '''
-    Figure out the sections in drbdadm status
-    '''
-    spaces = _count_spaces_startswith(line)
+    return ret
 
-    if spaces is None:
-        return ''
 
-    switch = {
-        0: 'RESOURCE',
-        2: {' disk:': 'LOCALDISK', ' role:': 'PEERNODE', ' connection:': 'PEERNODE'},
-        4: {' peer-disk:': 'PEERDISK'}
-    }
+def _parse_overview_progress(line):
+    '''
+    Parse the continuation lines of drbd-overview holding the sync
+    progress of the device above, like
+    ``[==>.................] sync'ed: 15.2% (1738/2044)M`` and
+    ``finish: 0:00:41 speed: 42,064 (41,240) K/sec``.
+    None for other lines.
+    '''
+    fields = line.split()
+    if not line[:1].isspace() or not fields:
+        return None
 
-    ret = switch.get(spaces, 'UNKNOWN')
+    if fields[0].startswith('['):
+        ret = {'synchronisation: ': fields[0]}
+        if "sync'ed:" in fields:
+            index = fields.index("sync'ed:")
+            ret['synched'] = ''.join(fields[index + 1:index + 3])
+        return ret
 
-    # isinstance(ret, str) only works when run directly, calling need unicode(six)
-    if isinstance(ret, six.text_type):
+    if fields[0] == 'finish:':
+        ret = {'finish': fields[1] if len(fields) > 1 else ''}
+        if 'speed:' in fields:
+            ret['speed'] = ' '.join(fields[fields.index('speed:') + 1:])
         return ret
 
-    for x in ret:
-        if x in line:
-            return ret[x]
+    return None
 
 
-def _add_res(line):
+def _overview_from_status(resources):
     '''
-    Analyse the line of local resource of ``drbdadm status``
+    Emulate drbd-overview from the status, with the first peer as partner
     '''
-    fields = line.strip().split()
+    ret = []
 
-    if __context__['drbd.resource']:
-        __context__['drbd.statusret'].append(__context__['drbd.resource'])
-        __context__['drbd.resource'] = {}
+    for res in resources:
+        peer = res['peer nodes'][0] if res['peer nodes'] else {}
+        peer_volumes = dict((vol['volume'], vol) for vol in peer.get('peer volumes', []))
 
-    resource = {}
-    resource["resource name"] = fields[0]
-    resource["local role"] = fields[1].split(":")[1]
-    resource["local volumes"] = []
-    resource["peer nodes"] = []
+        for vol in res['local volumes']:
+            peer_vol = peer_volumes.get(vol['volume'], {})
+            if not peer:
+                connstate = 'StandAlone'
+            else:
+                connstate = peer_vol.get('replication') or peer.get('connection', 'Connected')
 
-    __context__['drbd.resource'] = resource
+            device = {
+                'minor number': six.text_type(vol.get('minor', '')),
+                'device': '{}/{}'.format(res['resource name'], vol['volume']),
+                'connection state': connstate,
+                'local role': res['local role'],
+                'partner role': peer.get('role', 'Unknown'),
+                'local disk state': vol['disk'],
+                'partner disk state': peer_vol.get('peer-disk', 'DUnknown'),
+            }
 
+            if peer_vol.get('done') is not None:
+                done = min(int(float(peer_vol['done']) / 5), 19)
+                device['synchronisation: '] = '[{}>{}]'.format('=' * done, '.' * (19 - done))
+                device['synched'] = '{}%'.format(peer_vol['done'])
 
-def _add_volume(line):
-    '''
-    Analyse the line of volumes of ``drbdadm status``
-    '''
-    section = _analyse_status_type(line)
-    fields = line.strip().split()
+            ret.append(device)
 
-    volume = {}
-    for field in fields:
-        volume[field.split(':')[0]] = field.split(':')[1]
+    return ret
 
-    if section == 'LOCALDISK':
-        if 'drbd.resource' not in __context__:  # pragma: no cover
-            # Should always be called after _add_res
-            __context__['drbd.resource'] = {}
-            __context__['drbd.resource']['local volumes'] = []
 
-        __context__['drbd.resource']['local volumes'].append(volume)
-    else:
-        # 'PEERDISK'
-        if 'drbd.lastpnodevolumes' not in __context__:  # pragma: no cover
-            # Insurance refer to:
-            # https://docs.saltstack.com/en/latest/topics/development/modules/developing.html#context
-            # Should always be called after _add_peernode
-            __context__['drbd.lastpnodevolumes'] = []
+class _StatusParser(object):
+    '''
+    Single pass parser of ``drbdadm status`` output.
 
-        __context__['drbd.lastpnodevolumes'].append(volume)
+    Every line is tokenized once and classified by its indentation.
+    The resource being built is kept in the parser itself, so nothing
+    is stored in ``__context__``.
+    '''
 
+    def __init__(self):
+        self.resources = []
+        self.unknown = None
+        self._resource = None
+        self._peer_volumes = None
+
+    def feed(self, line):
+        '''
+        Parse one line, return False once an unsupported line is found
+        '''
+        content = line.lstrip()
+        if not content or content[0] == '#':
+            return True
+
+        fields = content.split()
+        spaces = len(line) - len(content)
+
+        if spaces == 0:
+            self._add_res(fields)
+            return True
+
+        keys = [field.partition(':')[0] for field in fields]
+
+        if spaces == 2:
+            if 'disk' in keys:
+                self._add_volume(fields, local=True)
+                return True
+            if 'role' in keys or 'connection' in keys:
+                self._add_peernode(fields)
+                return True
+        elif spaces == 4 and 'peer-disk' in keys:
+            self._add_volume(fields, local=False)
+            return True
+
+        self.unknown = line
+        return False
 
-def _add_peernode(line):
-    '''
-    Analyse the line of peer nodes of ``drbdadm status``
-    '''
-    fields = line.strip().split()
+    def parse(self, lines):
+        '''
+        Parse all lines, the return value is the same as ``status``
+        '''
+        for line in lines:
+            if not self.feed(line):
+                return {"Unknown parser": self.unknown}
+
+        self._flush()
+        return self.resources
+
+    def drain(self, final=False):
+        '''
+        Take the resources parsed so far, the last one is only complete
+        once the next one starts or with final
+        '''
+        if final:
+            self._flush()
+
+        resources, self.resources = self.resources, []
+        return resources
+
+    def _flush(self):
+        if self._resource:
+            self.resources.append(self._resource)
+        self._resource = None
+        self._peer_volumes = None
+
+    def _add_res(self, fields):
+        self._flush()
+
+        self._resource = {
+            "resource name": fields[0],
+            "local role": fields[1].partition(":")[2],
+            "local volumes": [],
+            "peer nodes": [],
+        }
+
+    def _add_volume(self, fields, local):
+        volume = {}
+        for field in fields:
+            key, _, value = field.partition(':')
+            volume[key] = value
+
+        if local:
+            if self._resource is None:  # pragma: no cover
+                # Should always be called after _add_res
+                self._resource = {"local volumes": [], "peer nodes": []}
+            self._resource["local volumes"].append(volume)
+        else:
+            if self._peer_volumes is None:  # pragma: no cover
+                # Should always be called after _add_peernode
+                self._peer_volumes = []
+            self._peer_volumes.append(volume)
 
-    peernode = {}
-    peernode["peernode name"] = fields[0]
-    #Could be role or connection:
-    peernode[fields[1].split(":")[0]] = fields[1].split(":")[1]
-    peernode["peer volumes"] = []
+    def _add_peernode(self, fields):
+        key, _, value = fields[1].partition(":")
 
-    if 'drbd.resource' not in __context__:  # pragma: no cover
-        # Should always be called after _add_res
-        __context__['drbd.resource'] = {}
-        __context__['drbd.resource']['peer nodes'] = []
+        peernode = {}
+        peernode["peernode name"] = fields[0]
+        # Could be role or connection
+        peernode[key] = value
+        peernode["peer volumes"] = []
 
-    __context__['drbd.resource']["peer nodes"].append(peernode)
+        if self._resource is None:  # pragma: no cover
+            # Should always be called after _add_res
+            self._resource = {"local volumes": [], "peer nodes": []}
 
-    __context__['drbd.lastpnodevolumes'] = peernode["peer volumes"]
+        self._resource["peer nodes"].append(peernode)
+        self._peer_volumes = peernode["peer volumes"]
 
 
-def _empty(dummy):
+def _command_key(cmd):
     '''
-    Action of empty line of ``drbdadm status``
+    Aggregation key of a command: the tool and its sub command with the
+    options before it, eg. ``drbdadm -d adjust`` for the dry run
+    ``drbdadm -d adjust res``, or its first option without sub command,
+    eg. ``drbdadm --version``
     '''
+    args = cmd.split() if isinstance(cmd, six.string_types) else list(cmd)
+    words = args[1:2]
+    for index, arg in enumerate(args[1:], 2):
+        if not arg.startswith('-'):
+            words = args[1:index]
+            break
+    return ' '.join([os.path.basename(args[0])] + words)
 
 
-def _unknown_parser(line):
+def _record_command(cmd, seconds, retcode, size):
+    '''
+    Record a command in ``__context__``, aggregated per _command_key
+    and in the history of the latest commands
+    '''
+    with _PERF_LOCK:
+        perf = __context__.setdefault('drbd.perf', {'commands': {}, 'history': []})
+
+        stats = perf['commands'].setdefault(_command_key(cmd), {
+            'calls': 0, 'failures': 0, 'seconds': 0.0, 'max seconds': 0.0,
+            'output bytes': 0})
+        stats['calls'] += 1
+        if retcode:
+            stats['failures'] += 1
+        stats['seconds'] += seconds
+        stats['max seconds'] = max(stats['max seconds'], seconds)
+        stats['output bytes'] += size
+
+        perf['history'].append({
+            'command': cmd if isinstance(cmd, six.string_types) else ' '.join(cmd),
+            'seconds': seconds,
+            'retcode': retcode,
+            'output bytes': size,
+        })
+        del perf['history'][:-PERF_HISTORY]
+
+
+def _run(function, cmd):
     '''
-    Action of unsupported line of ``drbdadm status``
+    Run a command with cmd.run, cmd.run_all or cmd.retcode, record its
+    duration, exit code and output size for perf_stats
     '''
-    __context__['drbd.statusret'] = {"Unknown parser": line}
+    start = timeit.default_timer()
+    result = __salt__['cmd.{}'.format(function)](cmd)
+    seconds = timeit.default_timer() - start
+
+    if isinstance(result, dict):
+        retcode = result.get('retcode')
+        size = len(result.get('stdout') or '') + len(result.get('stderr') or '')
+    elif isinstance(result, six.string_types):
+        retcode, size = None, len(result)
+    else:
+        retcode, size = result, 0
+    _record_command(cmd, seconds, retcode, size)
+
+    return result
 
 
-def _line_parser(line):
+def _stream_lines(args, timeout=None):
     '''
-    Call action for different lines
+    Yield the lines printed by a long running command.
+    Stop at EOF or when timeout is reached, the command is killed
+    when the generator is closed. A non zero exit code at EOF raises
+    CommandExecutionError with the error output of the command.
     '''
-    # Should always be called via status()
-    section = _analyse_status_type(line)
+    # A file rather than a pipe, stderr can't block the command this way
+    stderr = tempfile.TemporaryFile()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=stderr,
+                            close_fds=True)
 
-    switch = {
-        '': _empty,
-        'RESOURCE': _add_res,
-        'PEERNODE': _add_peernode,
-        'LOCALDISK': _add_volume,
-        'PEERDISK': _add_volume,
-    }
+    deadline = None if timeout is None else time.time() + timeout
+    start = timeit.default_timer()
+    buf = b''
+    size = 0
+
+    try:
+        while True:
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    return
+
+            readable, _, _ = select.select([proc.stdout], [], [], wait)
+            if not readable:
+                return
+
+            data = os.read(proc.stdout.fileno(), 65536)
+            if not data:
+                break
+
+            size += len(data)
+            buf += data
+            while b'\n' in buf:
+                line, buf = buf.split(b'\n', 1)
+                yield salt.utils.stringutils.to_unicode(line)
+
+        # The last line is not always terminated
+        if buf:
+            yield salt.utils.stringutils.to_unicode(buf)
+
+        retcode = proc.wait()
+        if retcode:
+            stderr.seek(0)
+            raise CommandExecutionError(
+                '{0} exited with code {1}: {2}'.format(
+                    ' '.join(args), retcode,
+                    salt.utils.stringutils.to_unicode(stderr.read()).strip()))
+    finally:
+        # Not a failure when killed here, the exit code is unknown
+        retcode = proc.poll()
+        if retcode is None:
+            proc.terminate()
+        proc.wait()
+        proc.stdout.close()
+        stderr.close()
+        _record_command(args, timeit.default_timer() - start, retcode, size)
+
+
+def _watch_sync_events(names, timeout=600, peernode='all'):
+    '''
+    Follow ``drbdsetup events2`` until all resources are fully synced.
+    Return the last verdict per resource, with the seconds taken to be
+    synced.
+    '''
+    if not salt.utils.path.which(DRBDSETUP_COMMAND):
+        raise CommandExecutionError('The drbdsetup binary is not available.')
+
+    starttime = time.time()
+    state = salt.utils.drbd.EventsState()
+    pending = set(names)
 
-    func = switch.get(section, _unknown_parser)
+    ret = {}
+    for name in names:
+        ret[name] = _evaluate_sync(name, None, peernode=peernode)
+        ret[name]['seconds'] = None
 
-    func(line)
+    target = names[0] if len(names) == 1 else 'all'
+    lines = _stream_lines([DRBDSETUP_COMMAND, 'events2', target], timeout=timeout)
+    try:
+        for line in lines:
+            changed = state.feed(line)
+            if not state.complete:
+                continue
+
+            # All resources once the initial state is complete
+            for name in [changed[1]] if changed else list(pending):
+                if name not in pending:
+                    continue
+
+                verdict = _evaluate_sync(name, state.to_status(name), peernode=peernode)
+                verdict['seconds'] = None
+                if verdict['synced']:
+                    verdict['seconds'] = time.time() - starttime
+                    pending.discard(name)
+                ret[name] = verdict
+
+            if not pending:
+                return ret
+    finally:
+        lines.close()
+
+    if time.time() < starttime + timeout:
+        raise CommandExecutionError(
+            'drbdsetup events2 {} exited before the resource is synced.'.format(target))
+
+    return ret
 
 
-def _is_local_all_uptodated(name):
+def _utils_version_code():
     '''
-    Check whether all local volumes are UpToDate.
+    Get the version code of drbd-utils, cached in ``__context__``
     '''
+    if 'drbd.version_code' not in __context__:
+        code = 0
+        result = _run('run_all', 'drbdadm --version')
 
-    res = status(name)
-    if not res:
-        return False
+        if result['retcode'] == 0:
+            for line in result['stdout'].splitlines():
+                key, _, value = line.partition('=')
+                if key.strip() == 'DRBDADM_VERSION_CODE':
+                    try:
+                        code = int(value.strip(), 16)
+                    except ValueError:
+                        LOGGER.debug('Unknown drbd-utils version code: %s', value)
+                    break
 
-    # Since name is not all, res only have one element
-    for vol in res[0]['local volumes']:
-        if vol['disk'] != 'UpToDate':
-            return False
+        __context__['drbd.version_code'] = code
 
-    return True
+    return __context__['drbd.version_code']
 
 
-def _is_peers_uptodated(name, peernode='all'):
+def _json_extra(item, known):
     '''
-    Check whether all volumes of peer node are UpToDate.
+    Copy the fields of a json item which are not translated
+    '''
+    return dict((key, value) for key, value in item.items() if key not in known)
 
-    .. note::
 
-        If peernode is not match, will return None, same as False.
+def _json_to_status(resource):
     '''
-    ret = None
+    Translate one resource of ``drbdsetup status --json`` to the
+    format returned by ``status``.
+    Fields unknown to ``drbdadm status`` are kept with their json name.
+    Like ``drbdadm status``, a peer not connected has no peer volumes.
+    '''
+    ret = _json_extra(resource, ('name', 'role', 'devices', 'connections'))
+    ret["resource name"] = resource['name']
+    ret["local role"] = resource['role']
+    ret["local volumes"] = []
+    ret["peer nodes"] = []
+
+    for device in resource.get('devices', []):
+        volume = _json_extra(device, ('volume', 'disk-state'))
+        volume['volume'] = six.text_type(device['volume'])
+        volume['disk'] = device['disk-state']
+        ret["local volumes"].append(volume)
+
+    for connection in resource.get('connections', []):
+        peernode = _json_extra(connection, ('name', 'peer-role', 'peer_devices'))
+        peernode["peernode name"] = connection['name']
+        peer_devices = connection.get('peer_devices', [])
+        if connection.get('connection-state') == 'Connected':
+            peernode['role'] = connection['peer-role']
+        else:
+            peernode['connection'] = connection.get('connection-state')
+            # Only DUnknown, the verdicts must not differ from drbdadm status
+            peer_devices = []
+        peernode["peer volumes"] = []
 
-    res = status(name)
-    if not res:
-        return ret
+        for peer_device in peer_devices:
+            volume = _json_extra(peer_device, ('volume', 'peer-disk-state',
+                                               'replication-state', 'resync-suspended'))
+            volume['volume'] = six.text_type(peer_device['volume'])
+            volume['peer-disk'] = peer_device['peer-disk-state']
 
-    # Since name is not all, res only have one element
-    for node in res[0]['peer nodes']:
-        if peernode != 'all' and node['peernode name'] != peernode:
-            continue
+            replication = peer_device.get('replication-state', 'Established')
+            if replication != 'Established':
+                volume['replication'] = replication
+            if replication in SYNC_STATES and 'percent-in-sync' in peer_device:
+                volume['done'] = '{:.2f}'.format(peer_device['percent-in-sync'])
 
-        for vol in node['peer volumes']:
-            if vol['peer-disk'] != 'UpToDate':
-                return False
-            else:
-                # At lease one volume is 'UpToDate'
-                ret = True
+            suspended = peer_device.get('resync-suspended', 'no')
+            if suspended != 'no':
+                volume['resync-suspended'] = suspended
+
+            peernode["peer volumes"].append(volume)
+
+        ret["peer nodes"].append(peernode)
 
     return ret
 
 
-def overview():
+def _json_status(name):
     '''
-    Show status of the DRBD devices, support two nodes only.
-    drbd-overview is removed since drbd-utils-9.6.0,
-    use status instead.
-
-    CLI Example:
+    Get the status via ``drbdsetup status --json``.
+    Return None when drbdsetup fails, like when the resource is not
+    running, the same as ``drbdadm status``. Return False when the
+    output could not be used, to fall back to ``drbdadm status``.
+    '''
+    cmd = 'drbdsetup status --json {}'.format(name)
 
-    .. code-block:: bash
+    result = _run('run_all', cmd)
+    if result['retcode'] != 0:
+        LOGGER.info('No status due to %s (%s).', result['stderr'], result['retcode'])
+        return None
 
-        salt '*' drbd.overview
-    '''
-    cmd = 'drbd-overview'
-    for line in __salt__['cmd.run'](cmd).splitlines():
-        ret = {}
-        fields = line.strip().split()
-        minnum = fields[0].split(':')[0]
-        device = fields[0].split(':')[1]
-        connstate, _ = _analyse_overview_field(fields[1])
-        localrole, partnerrole = _analyse_overview_field(fields[2])
-        localdiskstate, partnerdiskstate = _analyse_overview_field(fields[3])
-        if localdiskstate.startswith("UpTo"):
-            if partnerdiskstate.startswith("UpTo"):
-                if len(fields) >= 5:
-                    mountpoint = fields[4]
-                    fs_mounted = fields[5]
-                    totalsize = fields[6]
-                    usedsize = fields[7]
-                    remainsize = fields[8]
-                    perc = fields[9]
-                    ret = {
-                        'minor number': minnum,
-                        'device': device,
-                        'connection state': connstate,
-                        'local role': localrole,
-                        'partner role': partnerrole,
-                        'local disk state': localdiskstate,
-                        'partner disk state': partnerdiskstate,
-                        'mountpoint': mountpoint,
-                        'fs': fs_mounted,
-                        'total size': totalsize,
-                        'used': usedsize,
-                        'remains': remainsize,
-                        'percent': perc,
-                    }
-                else:
-                    ret = {
-                        'minor number': minnum,
-                        'device': device,
-                        'connection state': connstate,
-                        'local role': localrole,
-                        'partner role': partnerrole,
-                        'local disk state': localdiskstate,
-                        'partner disk state': partnerdiskstate,
-                    }
-            else:
-                syncbar = fields[4]
-                synced = fields[6]
-                syncedbytes = fields[7]
-                sync = synced+syncedbytes
-                ret = {
-                    'minor number': minnum,
-                    'device': device,
-                    'connection state': connstate,
-                    'local role': localrole,
-                    'partner role': partnerrole,
-                    'local disk state': localdiskstate,
-                    'partner disk state': partnerdiskstate,
-                    'synchronisation: ': syncbar,
-                    'synched': sync,
-                }
-    return ret
+    try:
+        resources = salt.utils.json.loads(result['stdout'], strict=False)
+        return [_json_to_status(res) for res in resources]
+    except (ValueError, KeyError, TypeError, AttributeError) as err:
+        LOGGER.warning('Fall back to drbdadm status, json output not usable: %s', err)
+        return False
 
 
-def status(name='all'):
+def _snapshot():
     '''
-    Using drbdadm to show status of the DRBD devices,
-    available in the latest DRBD9.
-    Support multiple nodes, multiple volumes.
+    Get the status/config snapshot shared by all calls of one run
+    '''
+    if 'drbd.snapshot' not in __context__:
+        __context__['drbd.snapshot'] = {
+            # resource name: (timestamp, status of the resource or None)
+            'status': {},
+            # timestamp of the last 'drbdadm status all'
+            'status all': None,
+            # resources changed since the last 'drbdadm status all'
+            'stale': set(),
+        }
 
-    :type name: str
-    :param name:
-        Resource name.
+    return __context__['drbd.snapshot']
 
-    :return: DRBD status of resource.
-    :rtype: list(dict(res))
 
-    CLI Example:
+def _is_fresh(timestamp):
+    return timestamp is not None and time.time() - timestamp < SNAPSHOT_TTL
 
-    .. code-block:: bash
 
-        salt '*' drbd.status
-        salt '*' drbd.status name=<resource name>
+def _invalidate(name):
     '''
+    Drop the cached status of a resource changed by a drbdadm command
+    '''
+    snapshot = _snapshot()
+    metadata = __context__.get('drbd.metadata', {})
 
-    # Initialize for multiple times test cases
-    __context__['drbd.statusret'] = []
-    __context__['drbd.resource'] = {}
+    if name == 'all':
+        metadata.clear()
+        snapshot['status'] = {}
+        snapshot['status all'] = None
+        snapshot['stale'] = set()
+        return
 
-    cmd = 'drbdadm status {}'.format(name)
+    metadata.pop(name, None)
+    snapshot['status'].pop(name, None)
+    snapshot['stale'].add(name)
 
-    #One possible output: (number of resource/node/vol are flexible)
-    #resource role:Secondary
-    #  volume:0 disk:Inconsistent
-    #  volume:1 disk:Inconsistent
-    #  drbd-node1 role:Primary
-    #    volume:0 replication:SyncTarget peer-disk:UpToDate done:10.17
-    #    volume:1 replication:SyncTarget peer-disk:UpToDate done:74.08
-    #  drbd-node2 role:Secondary
-    #    volume:0 peer-disk:Inconsistent resync-suspended:peer
-    #    volume:1 peer-disk:Inconsistent resync-suspended:peer
 
-    result = __salt__['cmd.run_all'](cmd)
-    if result['retcode'] != 0:
-        LOGGER.info('No status due to %s (%s).', result['stderr'], result['retcode'])
-        return None
+def _cached_status(name):
+    '''
+    Get the status from the snapshot, refresh it via one
+    ``drbdadm status all`` when expired.
+    '''
+    snapshot = _snapshot()
 
-    for line in result['stdout'].splitlines():
-        _line_parser(line)
+    entry = snapshot['status'].get(name)
+    if entry and _is_fresh(entry[0]):
+        return [entry[1]] if entry[1] else None
 
-    if __context__['drbd.resource']:
-        __context__['drbd.statusret'].append(__context__['drbd.resource'])
+    if not _is_fresh(snapshot['status all']) or (name == 'all' and snapshot['stale']):
+        now = time.time()
+        # None when no resource is up, cached as well
+        result = status() or []
 
-    return __context__['drbd.statusret']
+        snapshot['status'] = dict((res['resource name'], (now, res)) for res in result)
+        snapshot['status all'] = now
+        snapshot['stale'] = set()
 
+    if name == 'all':
+        return [entry[1] for entry in snapshot['status'].values() if entry[1]]
 
-def createmd(name='all', force=True):
-    '''
-    Create the metadata of DRBD resource.
+    if name in snapshot['stale']:
+        now = time.time()
+        result = status(name) or []
 
-    :type name: str
-    :param name:
-        Resource name.
+        snapshot['status'][name] = (now, result[0] if result else None)
+        snapshot['stale'].discard(name)
 
-    :type force: bool
-    :param force:
-        Force create metadata.
+    entry = snapshot['status'].get(name)
+    if entry and entry[1]:
+        return [entry[1]]
 
-    :return: result of creating metadata.
-    :rtype: bool
+    return None
 
-    CLI Example:
 
-    .. code-block:: bash
+def _config_mtimes(paths):
+    mtimes = {}
 
-        salt '*' drbd.create
-        salt '*' drbd.create name=<resource name>
-    '''
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            mtimes[path] = None
 
-    cmd = 'drbdadm create-md {}'.format(name)
+    return mtimes
 
-    if force:
-        cmd += ' --force'
 
-    return __salt__['cmd.retcode'](cmd)
+def _xml_text(element):
+    return (element.text or '').strip() if element is not None else None
 
 
-def up(name='all'):
+def _xml_volume(element, defaults=None):
     '''
-    Start of drbd resource.
+    Parse the device/disk/meta-disk of a ``<volume>`` element, or of a
+    ``<host>`` element of a configuration without volumes.
+    '''
+    vol = dict(defaults or {})
 
-    :type name: str
-    :param name:
-        Resource name.
+    device = element.find('device')
+    if device is not None:
+        minor = device.get('minor')
+        if minor is not None:
+            vol['minor'] = int(minor)
+        vol['device'] = _xml_text(device) or '/dev/drbd{}'.format(minor)
 
-    :return: result of start resource.
-    :rtype: bool
+    for key in ('disk', 'meta-disk'):
+        if element.find(key) is not None:
+            vol[key] = _xml_text(element.find(key))
 
-    CLI Example:
+    return vol
 
-    .. code-block:: bash
 
-        salt '*' drbd.up
-        salt '*' drbd.up name=<resource name>
+def _parse_config_index(xml, nodename):
     '''
+    Parse the output of ``drbdadm dump-xml all`` into the config index.
 
-    cmd = 'drbdadm up {}'.format(name)
+    Volumes of the host section matching ``nodename`` are the local ones,
+    their minor, device and backing disk are indexed for lookups.
+    '''
+    root = ElementTree.fromstring(salt.utils.stringutils.to_str(xml))
+
+    index = {
+        # resource name: {'file', 'local host', 'volumes', 'hosts'}
+        'resources': {},
+        # host name: resource names
+        'hosts': {},
+        # minor/device/backing disk: (resource name, volume number)
+        'minors': {},
+        'devices': {},
+        'disks': {},
+        # config file: mtime
+        'mtimes': {},
+    }
+    files = set([root.get('file', DRBD_CONFIG)])
+
+    for resource in root.findall('resource'):
+        name = resource.get('name')
+        conf_file = resource.get('conf-file-line', '').rsplit(':', 1)[0]
+        if conf_file:
+            files.add(conf_file)
+
+        defaults = {}
+        for volume in resource.findall('volume'):
+            defaults[int(volume.get('vnr', 0))] = _xml_volume(volume)
+
+        hosts = {}
+        local = None
+        for host in resource.findall('host'):
+            hostname = host.get('name')
+            volumes = dict((vnr, dict(vol)) for vnr, vol in six.iteritems(defaults))
+
+            if host.findall('volume'):
+                for volume in host.findall('volume'):
+                    vnr = int(volume.get('vnr', 0))
+                    volumes[vnr] = _xml_volume(volume, defaults.get(vnr))
+            elif host.find('device') is not None:
+                volumes[0] = _xml_volume(host, defaults.get(0))
+
+            address = host.find('address')
+            hosts[hostname] = {
+                'node-id': _xml_text(host.find('node-id')),
+                'address': _xml_text(address),
+                'port': address.get('port') if address is not None else None,
+                'volumes': volumes,
+            }
+            index['hosts'].setdefault(hostname, []).append(name)
+
+            if hostname in (nodename, nodename.split('.')[0]):
+                local = hostname
+
+        volumes = hosts[local]['volumes'] if local else {}
+        for vnr, vol in six.iteritems(volumes):
+            if vol.get('minor') is not None:
+                index['minors'][vol['minor']] = (name, vnr)
+            if vol.get('device'):
+                index['devices'][vol['device']] = (name, vnr)
+            if vol.get('disk') and vol['disk'] != 'none':
+                index['disks'][vol['disk']] = (name, vnr)
+
+        index['resources'][name] = {
+            'file': conf_file or None,
+            'local host': local,
+            'volumes': volumes,
+            'hosts': hosts,
+        }
+
+    files.update([os.path.dirname(path) for path in files])
+    index['mtimes'] = _config_mtimes(files)
+
+    return index
+
+
+def _config_index():
+    '''
+    Get the config index from ``__context__``, rebuild it via one
+    ``drbdadm dump-xml all`` when a config file changed.
 
-    return __salt__['cmd.retcode'](cmd)
+    Return None when drbdadm can't dump the configuration.
+    '''
+    index = __context__.get('drbd.config')
+    if index is not None and _config_mtimes(index['mtimes']) == index['mtimes']:
+        return index
 
+    # Taken before the dump, so a change made meanwhile triggers a rebuild
+    mtimes = _config_mtimes([DRBD_CONFIG, DRBD_CONFIG_DIR])
 
-def down(name='all'):
-    '''
-    Stop of DRBD resource.
+    cmd = '{} dump-xml all'.format(DRBD_COMMAND)
+    result = _run('run_all', cmd)
+    if result['retcode'] != 0:
+        LOGGER.warning('Failed to dump the drbd configuration: %s', result['stderr'])
+        return None
 
-    :type name: str
-    :param name:
-        Resource name.
+    try:
+        index = _parse_config_index(result['stdout'], platform.node())
+    except (ElementTree.ParseError, ValueError) as err:
+        LOGGER.warning('Failed to parse the drbd configuration: %s', err)
+        return None
 
-    :return: result of stop resource.
-    :rtype: bool
+    index['mtimes'].update(mtimes)
+    __context__['drbd.config'] = index
 
-    CLI Example:
+    return index
 
-    .. code-block:: bash
 
-        salt '*' drbd.down
-        salt '*' drbd.down name=<resource name>
+def _parse_adjust_plan(lines, index):
+    '''
+    Parse the commands printed by ``drbdadm -d adjust``, return the
+    planned commands per resource.
+
+    The resource of commands naming a minor, like ``attach`` and
+    ``drbdmeta``, or the addresses of a connection (drbd 8.4), is found
+    in the config index. The peer node id of connection commands is
+    translated to the peer host name. Commands for a target not found in
+    the config index are skipped.
     '''
+    resources = index['resources'] if index else {}
+    minors = index['minors'] if index else {}
+    addresses = {}
+    for res, conf in six.iteritems(resources):
+        for host, value in six.iteritems(conf['hosts']):
+            addresses['{}:{}'.format(value['address'], value['port'])] = (res, host)
+    plan = {}
+
+    for line in lines:
+        words = line.split()
+        if not words:
+            continue
 
-    cmd = 'drbdadm down {}'.format(name)
+        args = [word for word in words[1:] if not word.startswith('-')]
+        options = {}
+        for word in words[1:]:
+            if word.startswith('--'):
+                key, sep, value = word[2:].partition('=')
+                options[key] = value if sep else True
 
-    return __salt__['cmd.retcode'](cmd)
+        if os.path.basename(words[0]) == 'drbdmeta':
+            command = 'drbdmeta {}'.format(args[-1]) if args else None
+        else:
+            command = args.pop(0) if args else None
 
+        if not args:
+            LOGGER.debug('Unknown planned command: %s', line)
+            continue
 
-def primary(name='all', force=False):
+        target = args[0]
+        name, vnr, peer = target, None, None
+        if target not in resources:
+            minor = target[len('minor-'):] if target.startswith('minor-') else target
+            if minor.isdigit() and int(minor) in minors:
+                name, vnr = minors[int(minor)]
+            elif target.split(':', 1)[-1] in addresses:
+                name = addresses[target.split(':', 1)[-1]][0]
+                if len(args) > 1:
+                    peer = addresses.get(args[1].split(':', 1)[-1], (None, args[1]))[1]
+            elif index or minor.isdigit():
+                # Not a resource of the config, like the minor of a device
+                # configured outside of the files
+                LOGGER.warning('Planned command for unknown %s: %s', target, line)
+                continue
+
+        if command in PEER_COMMANDS and len(args) > 1 and peer is None:
+            peer = args[1]
+            for host, value in six.iteritems(resources.get(name, {}).get('hosts', {})):
+                if value.get('node-id') == args[1]:
+                    peer = host
+
+        plan.setdefault(name, []).append({
+            'command': command,
+            'args': args,
+            'peer': peer,
+            'volume': vnr,
+            'options': options,
+        })
+
+    return plan
+
+
+def _read_superblock(disk):
     '''
-    Promote the DRBD resource.
+    Read the internal meta-data superblock of a backing disk.
 
-    :type name: str
-    :param name:
-        Resource name.
+    Return (version, current UUID), or None if there is no DRBD meta-data.
+    '''
+    with salt.utils.files.fopen(disk, 'rb') as dev:
+        dev.seek(0, os.SEEK_END)
+        size = dev.tell()
+        if size < MD_BLOCK_SIZE * 2:
+            return None
 
-    :type force: bool
-    :param force:
-        Force to promote the resource.
-        Needed in the initial sync.
+        dev.seek((size & ~(MD_BLOCK_SIZE - 1)) - MD_BLOCK_SIZE)
+        block = dev.read(64)
 
-    :return: result of promote resource.
-    :rtype: bool
+    if len(block) < 64:
+        return None
 
-    CLI Example:
+    version = MD_MAGICS.get(struct.unpack('>I', block[60:64])[0])
+    if version is None:
+        return None
 
-    .. code-block:: bash
+    return version, '{:016X}'.format(struct.unpack('>Q', block[8:16])[0])
 
-        salt '*' drbd.primary
-        salt '*' drbd.primary name=<resource name>
+
+def _probe_metadata(name, vnr, vol):
     '''
+    Check the meta-data of one volume, from the superblock when it is
+    internal, otherwise or when unreadable via ``drbdadm get-gi``.
+    '''
+    ret = {
+        'volume': vnr,
+        'disk': vol.get('disk'),
+        'meta-disk': vol.get('meta-disk'),
+        'present': False,
+        'version': None,
+        'current uuid': None,
+    }
 
-    cmd = 'drbdadm primary {}'.format(name)
+    if vol.get('disk') in (None, 'none'):
+        # Diskless, no meta-data needed
+        ret['present'] = None
+        return ret
 
-    if force:
-        cmd += ' --force'
+    if vol.get('meta-disk', 'internal') == 'internal':
+        try:
+            superblock = _read_superblock(vol['disk'])
+        except (IOError, OSError) as err:
+            LOGGER.debug('Failed to read the superblock of %s: %s', vol['disk'], err)
+        else:
+            if superblock is not None:
+                ret['present'] = True
+                ret['version'], ret['current uuid'] = superblock
+                return ret
+
+    cmd = '{} get-gi {}/{}'.format(DRBD_COMMAND, name, vnr)
+    result = _run('run_all', cmd)
+    if result['retcode'] == 0 and result['stdout'].strip():
+        ret['present'] = True
+        ret['current uuid'] = result['stdout'].strip().split(':')[0]
 
-    return __salt__['cmd.retcode'](cmd)
+    return ret
 
 
-def secondary(name='all'):
+def _backing_device(disk):
     '''
-    Demote the DRBD resource.
+    Get the whole device of a backing disk, partitions of one disk share it
+    '''
+    path = os.path.realpath(disk)
+    sysfs = os.path.join('/sys/class/block', os.path.basename(path))
 
-    :type name: str
-    :param name:
-        Resource name.
+    if os.path.exists(os.path.join(sysfs, 'partition')):
+        return os.path.join('/dev', os.path.basename(os.path.dirname(os.path.realpath(sysfs))))
 
-    :return: result of demote resource.
-    :rtype: bool
+    return path
 
-    CLI Example:
 
-    .. code-block:: bash
+def _createmd_volumes(jobs, force, results):
+    '''
+    Run create-md for the volumes of one backing device, one after another.
+    Every volume gets an outcome, a job raising any error is failed.
+    '''
+    for job in jobs:
+        start = time.time()
+        try:
+            cmd = '{} create-md {}/{}'.format(
+                DRBD_COMMAND, job['resource name'], job['volume'])
+            if force:
+                cmd += ' --force'
+            result = _run('run_all', cmd)
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.error('create-md of %s/%s failed: %s',
+                         job['resource name'], job['volume'], err)
+            result = {'retcode': None, 'stderr': six.text_type(err)}
+
+        job['seconds'] = time.time() - start
+        job['retcode'] = result['retcode']
+        if result['retcode'] == 0:
+            job['outcome'] = 'created'
+        else:
+            job['outcome'] = 'failed'
+            job['comment'] = result['stderr']
+        results.append(job)
 
-        salt '*' drbd.secondary
-        salt '*' drbd.secondary name=<resource name>
+
+def _start_thread(target):
     '''
+    Start a thread running target in a copy of the current context, so
+    that the dunders of the salt loader (salt>=3003) are set in it
+    '''
+    if contextvars is None:  # pragma: no cover
+        thread = threading.Thread(target=target)
+    else:
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(target,))
+    thread.start()
+    return thread
 
-    cmd = 'drbdadm secondary {}'.format(name)
 
-    return __salt__['cmd.retcode'](cmd)
+def _numeric_fields(item):
+    return dict((key, value) for key, value in six.iteritems(item)
+                if isinstance(value, (six.integer_types, float)) and
+                not isinstance(value, bool) and key not in STATISTICS_LABELS)
 
 
-def adjust(name='all'):
+def _statistics_json(name):
     '''
-    Adjust the DRBD resource while running.
+    Get ``drbdsetup status --statistics --json``
+    '''
+    cmd = 'drbdsetup status --statistics --json {}'.format(name)
 
-    :type name: str
-    :param name:
-        Resource name.
+    results = _run('run_all', cmd)
 
-    :return: result of adjust resource.
-    :rtype: bool
+    if results['retcode'] != 0:
+        raise CommandExecutionError(
+            'Error({}) happened when get statistics via drbdsetup.'.format(results['retcode']),
+            info=results)
 
-    CLI Example:
+    try:
+        resources = salt.utils.json.loads(results['stdout'], strict=False)
+        if not isinstance(resources, list):
+            raise ValueError('Not a list of resources')
+    except ValueError:
+        raise CommandExecutionError('Error happens when try to load the json output.',
+                                    info=results)
 
-    .. code-block:: bash
+    return resources
 
-        salt '*' drbd.adjust
-        salt '*' drbd.adjust name=<resource name>
+
+def _statistics_records(resources):
+    '''
+    Flatten ``drbdsetup status --statistics --json`` into one record per
+    device, connection and peer device
     '''
+    records = []
 
-    cmd = 'drbdadm adjust {}'.format(name)
+    for resource in resources:
+        for device in resource.get('devices', []):
+            record = {'type': 'device', 'resource name': resource['name'],
+                      'peernode name': None, 'volume': device['volume'],
+                      'minor': device.get('minor')}
+            record.update(_numeric_fields(device))
+            records.append(record)
 
-    return __salt__['cmd.retcode'](cmd)
+        for connection in resource.get('connections', []):
+            record = {'type': 'connection', 'resource name': resource['name'],
+                      'peernode name': connection['name'], 'volume': None,
+                      'minor': None}
+            record.update(_numeric_fields(connection))
+            records.append(record)
 
+            for peer_device in connection.get('peer_devices', []):
+                record = {'type': 'peer-device', 'resource name': resource['name'],
+                          'peernode name': connection['name'],
+                          'volume': peer_device['volume'], 'minor': None}
+                record.update(_numeric_fields(peer_device))
+                records.append(record)
 
-def setup_show(name='all'):
-    '''
-    Show the DRBD resource via drbdsetup directly.
-    Only support the json format so far.
+    return records
 
-    :type name: str
-    :param name:
-        Resource name.
 
-    :return: The resource configuration.
-    :rtype: dict
+def _record_key(record):
+    return '{type}/{resource name}/{peernode name}/{volume}'.format(**record)
 
-    CLI Example:
 
-    .. code-block:: bash
+def _statistics_cache():
+    return os.path.join(__opts__['cachedir'], 'drbd', 'statistics.json')
 
-        salt '*' drbd.setup_show
-        salt '*' drbd.setup_show name=<resource name>
-    '''
 
-    ret = {'name': name,
-           'result': False,
-           'comment': ''}
+def _load_statistics_sample(name):
+    try:
+        with salt.utils.files.fopen(_statistics_cache(), 'r') as cache:
+            return salt.utils.json.load(cache).get(name)
+    except (IOError, OSError, ValueError):
+        return None
 
-    # Only support json format
-    cmd = 'drbdsetup show --json {}'.format(name)
 
-    results = __salt__['cmd.run_all'](cmd)
+def _save_statistics_sample(name, sample):
+    path = _statistics_cache()
 
-    if 'retcode' not in results or results['retcode'] != 0:
-        ret['comment'] = 'Error({}) happend when show resource via drbdsetup.'.format(
-            results['retcode'])
-        return ret
+    try:
+        with salt.utils.files.fopen(path, 'r') as cache:
+            samples = salt.utils.json.load(cache)
+    except (IOError, OSError, ValueError):
+        samples = {}
+    samples[name] = sample
 
     try:
-        ret = salt.utils.json.loads(results['stdout'], strict=False)
-    except ValueError:
-        raise CommandExecutionError('Error happens when try to load the json output.',
-                                    info=results)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with salt.utils.atomicfile.atomic_open(path, 'w') as cache:
+            salt.utils.json.dump(samples, cache)
+    except (IOError, OSError) as err:
+        LOGGER.warning('Failed to save the drbd statistics sample: %s', err)
 
-    return ret
+
+def _prometheus_labels(labels):
+    return ','.join('{}="{}"'.format(key, six.text_type(value).replace('\\', '\\\\')
+                                     .replace('"', '\\"').replace('\n', '\\n'))
+                    for key, value in labels if value is not None)
+
+
+def _prometheus_lines(resources):
+    '''
+    Render ``drbdsetup status --statistics --json`` in the Prometheus
+    exposition format
+    '''
+    metrics = {}
+
+    def _add(name, labels, value):
+        metrics.setdefault(name, []).append('{}{{{}}} {}'.format(
+            name, _prometheus_labels(labels), value))
+
+    def _add_numbers(prefix, labels, item):
+        for key, value in sorted(six.iteritems(_numeric_fields(item))):
+            name = '{}_{}'.format(prefix, key.replace('-', '_'))
+            if key in STATISTICS_COUNTERS:
+                name += '_total'
+            _add(name, labels, value)
+
+    for resource in resources:
+        res = [('resource', resource['name'])]
+        _add('drbd_resource_role', res + [('role', resource.get('role'))], 1)
+
+        for device in resource.get('devices', []):
+            labels = res + [('volume', device['volume']), ('minor', device.get('minor'))]
+            _add('drbd_device_disk_state', labels + [('state', device.get('disk-state'))], 1)
+            _add_numbers('drbd_device', labels, device)
+
+        for connection in resource.get('connections', []):
+            labels = res + [('peer', connection['name'])]
+            _add('drbd_connection_state',
+                 labels + [('state', connection.get('connection-state'))], 1)
+            _add('drbd_connection_peer_role', labels + [('role', connection.get('peer-role'))], 1)
+            _add_numbers('drbd_connection', labels, connection)
+
+            for peer_device in connection.get('peer_devices', []):
+                vol_labels = labels + [('volume', peer_device['volume'])]
+                _add('drbd_peer_device_replication_state',
+                     vol_labels + [('state', peer_device.get('replication-state'))], 1)
+                _add('drbd_peer_device_peer_disk_state',
+                     vol_labels + [('state', peer_device.get('peer-disk-state'))], 1)
+                _add_numbers('drbd_peer_device', vol_labels, peer_device)
+
+    lines = []
+    for name in sorted(metrics):
+        kind = 'counter' if name.endswith('_total') else 'gauge'
+        lines.append('# HELP {} DRBD {} from drbdsetup status --statistics.'.format(
+            name, name[len('drbd_'):].replace('_', ' ')))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        lines.extend(metrics[name])
+
+    return lines
+
+
+def _spread(values):
+    if not values:
+        return {'max': None, 'avg': None}
+    return {'max': max(values), 'avg': float(sum(values)) / len(values)}
+
+
+def _connection_health(samples):
+    '''
+    Summarize the samples of one connection, as (timestamp, connection)
+    '''
+    last = samples[-1][1]
+    ret = {
+        'connection': last.get('connection-state'),
+        'congested': any(conn.get('congested') for _, conn in samples),
+        'ahead/behind': None,
+        'ap-in-flight': _spread([conn.get('ap-in-flight', 0) for _, conn in samples]),
+        'rs-in-flight': _spread([conn.get('rs-in-flight', 0) for _, conn in samples]),
+    }
+
+    sent = []
+    for key in ('pending', 'unacked'):
+        ret[key] = _spread([sum(vol.get(key, 0) for vol in conn.get('peer_devices', []))
+                            for _, conn in samples])
+    for timestamp, conn in samples:
+        sent.append((timestamp, sum(vol.get('sent', 0) for vol in conn.get('peer_devices', []))))
+        for vol in conn.get('peer_devices', []):
+            if vol.get('replication-state') in CONGESTION_STATES:
+                ret['ahead/behind'] = vol['replication-state']
+    ret['out-of-sync'] = sum(vol.get('out-of-sync', 0) for vol in last.get('peer_devices', []))
+
+    # KiB/s sent over the window, the in-flight data takes that long to drain
+    ret['send rate'] = None
+    if len(sent) > 1 and sent[-1][0] > sent[0][0] and sent[-1][1] >= sent[0][1]:
+        ret['send rate'] = float(sent[-1][1] - sent[0][1]) / (sent[-1][0] - sent[0][0])
+
+    in_flight = ret['ap-in-flight']['avg']
+    if not in_flight:
+        ret['lag'] = 0.0
+    elif ret['send rate']:
+        ret['lag'] = in_flight / ret['send rate']
+    else:
+        ret['lag'] = None
+
+    return ret
+
+
+def _index_status(resources):
+    '''
+    Key the status by resource name, peer node name and volume number.
+    The volume dicts are shared with the list format, not copied.
+    '''
+    ret = {}
+
+    for res in resources:
+        indexed = dict((key, value) for key, value in six.iteritems(res)
+                       if key not in ('resource name', 'local role',
+                                      'local volumes', 'peer nodes'))
+        indexed['role'] = res.get('local role')
+        # A single volume is shown without its number by drbdadm status
+        indexed['volumes'] = dict((vol.get('volume', '0'), vol)
+                                  for vol in res.get('local volumes', []))
+        indexed['peers'] = {}
+
+        for node in res.get('peer nodes', []):
+            peer = dict((key, value) for key, value in six.iteritems(node)
+                        if key not in ('peernode name', 'peer volumes'))
+            peer['volumes'] = dict((vol.get('volume', '0'), vol)
+                                   for vol in node.get('peer volumes', []))
+            indexed['peers'][node['peernode name']] = peer
+
+        ret[res['resource name']] = indexed
+
+    return ret
+
+
+def _evaluate_sync(name, res, peernode='all'):
+    '''
+    Evaluate the sync state of one status sample of a resource.
+
+    The resource is synced when all local volumes are UpToDate, and
+    all volumes of the (matching) peer nodes are UpToDate. At least one
+    volume of peer node is needed.
+    '''
+    ret = {
+        'resource name': name,
+        'synced': False,
+        'lagging local volumes': [],
+        'lagging peer volumes': {},
+    }
+
+    if not res:
+        return ret
+
+    # Progress of local volumes is shown on the peer being SyncSource
+    target_done = {}
+    for node in res.get('peer nodes', []):
+        for vol in node.get('peer volumes', []):
+            if vol.get('replication') in ('SyncTarget', 'PausedSyncT') and 'done' in vol:
+                target_done[vol.get('volume')] = float(vol['done'])
+
+    for vol in res.get('local volumes', []):
+        if vol.get('disk') != 'UpToDate':
+            lagging = dict(vol)
+            lagging['done'] = target_done.get(vol.get('volume'))
+            ret['lagging local volumes'].append(lagging)
+
+    peer_volumes = 0
+    for node in res.get('peer nodes', []):
+        if peernode != 'all' and node['peernode name'] != peernode:
+            continue
+
+        for vol in node.get('peer volumes', []):
+            peer_volumes += 1
+            if vol.get('peer-disk') == 'UpToDate':
+                continue
+
+            lagging = dict(vol)
+            lagging['done'] = float(vol['done']) if 'done' in vol else None
+            ret['lagging peer volumes'].setdefault(node['peernode name'], []).append(lagging)
+
+    ret['synced'] = bool(peer_volumes and not ret['lagging local volumes'] and
+                         not ret['lagging peer volumes'])
+
+    return ret
+
+
+def _sync_sample(res):
+    '''
+    Get the ``done`` percentage of all syncing peer volumes
+    '''
+    sample = {}
+    if not res:
+        return sample
+
+    for node in res.get('peer nodes', []):
+        for vol in node.get('peer volumes', []):
+            if 'done' in vol:
+                sample[(node['peernode name'], vol.get('volume'))] = float(vol['done'])
+
+    return sample
+
+
+def _sync_rates(previous, current):
+    '''
+    Get the sync rate (percent per second) and ETA (seconds) of the
+    volumes syncing in both samples
+    '''
+    rates = {}
+    if not previous or current[0] <= previous[0]:
+        return rates
+
+    elapsed = current[0] - previous[0]
+    for key, done in current[1].items():
+        if key not in previous[1]:
+            continue
+
+        rate = (done - previous[1][key]) / elapsed
+        # Resync restarted or not progressing
+        eta = (100.0 - done) / rate if rate > 0 else None
+        rates[key] = (rate, eta)
+
+    return rates
+
+
+def _reached(command, res):
+    '''
+    Whether the status of a resource, None when it is down, shows that
+    the drbdadm command was applied. Not used for adjust, see _run_many.
+    '''
+    if command == 'up':
+        return res is not None
+    if command == 'down':
+        return res is None
+    if command in ('primary', 'secondary'):
+        return res is not None and res.get('local role') == command.capitalize()
+    return False
+
+
+def _run_many(command, names, options=''):
+    '''
+    Run a drbdadm command on several resources with one drbdadm process,
+    return the return code of each resource.
+
+    When it fails, the resources not yet in the state reached by the
+    command are run again one by one, to find the failing ones. For
+    adjust, these are the resources still having planned commands in
+    the dry run.
+    '''
+    names = [name for index, name in enumerate(names) if name not in names[:index]]
+    ret = dict.fromkeys(names, 0)
+    if not names:
+        return ret
+
+    result = _run('retcode', 'drbdadm {} {}{}'.format(command, ' '.join(names), options))
+    for name in names:
+        _invalidate(name)
+
+    if not result:
+        return ret
+
+    LOGGER.info('drbdadm %s failed (%s) on %s, retry one by one.',
+                command, result, ', '.join(names))
+    if command == 'adjust':
+        try:
+            plan = adjust_plan(names)
+        except CommandExecutionError as err:
+            LOGGER.info('No adjust plan: %s', six.text_type(err))
+            plan = dict.fromkeys(names, [None])
+        failed = [name for name in names if plan.get(name)]
+    else:
+        current = status()
+        statuses = dict((res['resource name'], res) for res in current or [])
+        failed = [name for name in names
+                  if current is None or not _reached(command, statuses.get(name))]
+
+    for name in failed:
+        ret[name] = _run('retcode', 'drbdadm {} {}{}'.format(command, name, options))
+        _invalidate(name)
+
+    return ret
+
+
+def overview():
+    '''
+    Show status of the DRBD devices, support two nodes only.
+    drbd-overview is removed since drbd-utils-9.6.0, the output is then
+    emulated from one ``drbdsetup status --json``, with the first peer
+    as partner and without the mountpoint and usage fields.
+
+    The sync progress printed below a syncing device is added to it.
+
+    :return: One dict per device.
+    :rtype: list(dict)
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.overview
+    '''
+    if not salt.utils.path.which(OVERVIEW_COMMAND):
+        return _overview_from_status(_json_status('all') or [])
+
+    ret = []
+    for line in _run('run', OVERVIEW_COMMAND).splitlines():
+        progress = _parse_overview_progress(line)
+        if progress is not None:
+            # Sync progress of the previous device
+            if ret:
+                ret[-1].update(progress)
+            continue
+
+        device = _parse_overview_line(line)
+        if device:
+            ret.append(device)
+        elif line.strip():
+            LOGGER.debug('Unknown drbd-overview line: %s', line)
+
+    return ret
+
+
+def status(name='all', cached=False, index=False):
+    '''
+    Using drbdadm to show status of the DRBD devices,
+    available in the latest DRBD9.
+    Support multiple nodes, multiple volumes.
+
+    When drbd-utils is new enough, the status is read from
+    ``drbdsetup status --json`` which also contains the fields
+    dropped by ``drbdadm status``, like ``minor`` or ``out-of-sync``.
+    Falls back to parse ``drbdadm status`` otherwise.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :type cached: bool
+    :param cached:
+        Use the snapshot shared by all calls of the same run.
+        The snapshot is taken by one ``status all`` and expires after
+        SNAPSHOT_TTL seconds. Default: False
+
+    :type index: bool
+    :param index:
+        Key the status by resource name, instead of a list. Each resource
+        is ``{'role', 'volumes': {volume: ...}, 'peers': {peernode name:
+        {'role' or 'connection', 'volumes': {volume: ...}}}}``, so one
+        volume of one peer is a dict lookup. Default: False
+
+    :return: DRBD status of resource.
+    :rtype: list(dict(res)), or dict(res) with index
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.status
+        salt '*' drbd.status name=<resource name>
+        salt '*' drbd.status index=True
+    '''
+    if index:
+        ret = status(name=name, cached=cached)
+        return _index_status(ret) if isinstance(ret, list) else ret
+
+    if cached:
+        return _cached_status(name)
+
+    if _utils_version_code() >= JSON_STATUS_VERSION_CODE:
+        ret = _json_status(name)
+        if ret is not False:
+            return ret
+
+    cmd = 'drbdadm status {}'.format(name)
+
+    #One possible output: (number of resource/node/vol are flexible)
+    #resource role:Secondary
+    #  volume:0 disk:Inconsistent
+    #  volume:1 disk:Inconsistent
+    #  drbd-node1 role:Primary
+    #    volume:0 replication:SyncTarget peer-disk:UpToDate done:10.17
+    #    volume:1 replication:SyncTarget peer-disk:UpToDate done:74.08
+    #  drbd-node2 role:Secondary
+    #    volume:0 peer-disk:Inconsistent resync-suspended:peer
+    #    volume:1 peer-disk:Inconsistent resync-suspended:peer
+
+    result = _run('run_all', cmd)
+    if result['retcode'] != 0:
+        LOGGER.info('No status due to %s (%s).', result['stderr'], result['retcode'])
+        return None
+
+    return _StatusParser().parse(result['stdout'].splitlines())
+
+
+def iter_status(names='all'):
+    '''
+    Stream the status of the DRBD resources, one resource at a time, as
+    ``drbdadm status`` prints them.
+
+    Unlike ``status``, nothing is collected: each resource is yielded as
+    soon as it is parsed, and drbdadm is stopped once all requested
+    resources are seen. CommandExecutionError is raised with the error
+    output when drbdadm fails.
+
+    :type names: list
+    :param names:
+        Resource names. Default: all
+
+    :return: DRBD status of each resource, same as ``status``.
+    :rtype: generator(dict(res))
+
+    .. note::
+
+        Meant for other modules and states. The salt minion merges the
+        dicts yielded by a generator, use ``status`` to show multiple
+        resources from the CLI.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.iter_status <resource name>
+    '''
+    if isinstance(names, six.string_types):
+        names = [] if names == 'all' else [names]
+    pending = set(names)
+
+    if not salt.utils.path.which(DRBD_COMMAND):
+        raise CommandExecutionError('The drbdadm binary is not available.')
+
+    parser = _StatusParser()
+    target = names[0] if len(names) == 1 else 'all'
+    lines = _stream_lines([DRBD_COMMAND, 'status', target])
+    try:
+        for line in lines:
+            if not parser.feed(line):
+                raise CommandExecutionError(
+                    'Unknown line in drbdadm status: {}'.format(parser.unknown))
+
+            for res in parser.drain():
+                if not names:
+                    yield res
+                elif res['resource name'] in pending:
+                    pending.discard(res['resource name'])
+                    yield res
+                    if not pending:
+                        return
+
+        for res in parser.drain(final=True):
+            if not names or res['resource name'] in pending:
+                yield res
+    finally:
+        lines.close()
+
+
+def createmd(name='all', force=True):
+    '''
+    Create the metadata of DRBD resource.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :type force: bool
+    :param force:
+        Force create metadata.
+
+    :return: result of creating metadata.
+    :rtype: bool
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.create
+        salt '*' drbd.create name=<resource name>
+    '''
+
+    cmd = 'drbdadm create-md {}'.format(name)
+
+    if force:
+        cmd += ' --force'
+
+    result = _run('retcode', cmd)
+    _invalidate(name)
+
+    return result
+
+
+def createmd_many(resources='*', force=True, workers=4, test=False):
+    '''
+    Create the metadata of multiple DRBD resources in parallel.
+
+    Only volumes without metadata, see ``metadata_status``, are created.
+    Volumes on the same backing device are created one after another, at
+    most ``workers`` devices at a time.
+
+    :type resources: list
+    :param resources:
+        Resource names or glob patterns. Default: *
+        Patterns only match resources with volumes on this host.
+
+    :type force: bool
+    :param force:
+        Force create metadata.
+
+    :type workers: int
+    :param workers:
+        Maximum number of create-md running together. Default: 4
+
+    :type test: bool
+    :param test:
+        Only report the volumes missing metadata. Default: False
+
+    :return: resource name, volume, disk, outcome, seconds, retcode and
+        comment of each volume. The outcome is one of present, diskless, created, failed
+        or missing (test only).
+    :rtype: list
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.createmd_many '[res1, res2]' workers=8
+    '''
+    if isinstance(resources, six.string_types):
+        resources = [resources]
+
+    names = []
+    for pattern in resources:
+        if any(char in pattern for char in '*?['):
+            matched = [res for res in fnmatch.filter(list_resources(), pattern)
+                       if config_index(res)['volumes']]
+        else:
+            matched = [pattern]
+        names.extend(name for name in matched if name not in names)
+
+    results = []
+    devices = {}
+    for name in names:
+        for vol in metadata_status(name, cached=True)['volumes']:
+            job = {
+                'resource name': name,
+                'volume': vol['volume'],
+                'disk': vol['disk'],
+                'outcome': 'missing',
+                'seconds': 0,
+                'retcode': None,
+                'comment': '',
+            }
+            if vol['present'] is None:
+                job['outcome'] = 'diskless'
+            elif vol['present']:
+                job['outcome'] = 'present'
+            elif not test:
+                devices.setdefault(_backing_device(vol['disk']), []).append(job)
+                continue
+            results.append(job)
+
+    # Each worker takes all volumes of one backing device at a time
+    pending = queue.Queue()
+    for device in sorted(devices):
+        pending.put(devices[device])
+
+    def _worker():
+        while True:
+            try:
+                jobs = pending.get_nowait()
+            except queue.Empty:
+                return
+            _createmd_volumes(jobs, force, results)
+
+    threads = [_start_thread(_worker)
+               for _ in range(min(max(int(workers), 1), len(devices)))]
+    for thread in threads:
+        thread.join()
+
+    # Never drop a volume, even when its worker died
+    for jobs in six.itervalues(devices):
+        for job in jobs:
+            if job['outcome'] == 'missing':
+                job.update({'outcome': 'failed', 'comment': 'create-md was not run'})
+                results.append(job)
+
+    for name in set(job['resource name'] for job in results
+                    if job['outcome'] in ('created', 'failed')):
+        _invalidate(name)
+
+    return sorted(results, key=lambda job: (names.index(job['resource name']), job['volume']))
+
+
+def new_current_uuid(name='all', clear_bitmap=False):
+    '''
+    Generate a new current UUID of the DRBD resource.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :type clear_bitmap: bool
+    :param clear_bitmap:
+        Clear the sync bitmap as well, which declares the connected peers
+        in sync without the initial sync. Only for freshly created
+        resources, whose disks are all Inconsistent. Default: False
+
+    :return: result of new-current-uuid command.
+    :rtype: bool
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.new_current_uuid <resource name> clear_bitmap=True
+    '''
+    cmd = 'drbdadm new-current-uuid {}'.format(name)
+
+    if clear_bitmap:
+        cmd = 'drbdadm new-current-uuid --clear-bitmap {}'.format(name)
+
+    result = _run('retcode', cmd)
+    _invalidate(name)
+
+    return result
+
+
+def up(name='all'):
+    '''
+    Start of drbd resource.
+
+    :type name: str or list
+    :param name:
+        Resource name, or a list of resource names run by one drbdadm.
+
+    :return: result of start resource, per resource name with a list.
+    :rtype: int or dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.up
+        salt '*' drbd.up name=<resource name>
+        salt '*' drbd.up name='[res1, res2]'
+    '''
+
+    if isinstance(name, (list, tuple)):
+        return _run_many('up', name)
+
+    cmd = 'drbdadm up {}'.format(name)
+
+    result = _run('retcode', cmd)
+    _invalidate(name)
+
+    return result
+
+
+def down(name='all'):
+    '''
+    Stop of DRBD resource.
+
+    :type name: str or list
+    :param name:
+        Resource name, or a list of resource names run by one drbdadm.
+
+    :return: result of stop resource, per resource name with a list.
+    :rtype: int or dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.down
+        salt '*' drbd.down name=<resource name>
+        salt '*' drbd.down name='[res1, res2]'
+    '''
+
+    if isinstance(name, (list, tuple)):
+        return _run_many('down', name)
+
+    cmd = 'drbdadm down {}'.format(name)
+
+    result = _run('retcode', cmd)
+    _invalidate(name)
+
+    return result
+
+
+def primary(name='all', force=False):
+    '''
+    Promote the DRBD resource.
+
+    :type name: str or list
+    :param name:
+        Resource name, or a list of resource names run by one drbdadm.
+
+    :type force: bool
+    :param force:
+        Force to promote the resource.
+        Needed in the initial sync.
+
+    :return: result of promote resource, per resource name with a list.
+    :rtype: int or dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.primary
+        salt '*' drbd.primary name=<resource name>
+        salt '*' drbd.primary name='[res1, res2]'
+    '''
+
+    if isinstance(name, (list, tuple)):
+        return _run_many('primary', name, ' --force' if force else '')
+
+    cmd = 'drbdadm primary {}'.format(name)
+
+    if force:
+        cmd += ' --force'
+
+    result = _run('retcode', cmd)
+    _invalidate(name)
+
+    return result
+
+
+def secondary(name='all'):
+    '''
+    Demote the DRBD resource.
+
+    :type name: str or list
+    :param name:
+        Resource name, or a list of resource names run by one drbdadm.
+
+    :return: result of demote resource, per resource name with a list.
+    :rtype: int or dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.secondary
+        salt '*' drbd.secondary name=<resource name>
+        salt '*' drbd.secondary name='[res1, res2]'
+    '''
+
+    if isinstance(name, (list, tuple)):
+        return _run_many('secondary', name)
+
+    cmd = 'drbdadm secondary {}'.format(name)
+
+    result = _run('retcode', cmd)
+    _invalidate(name)
+
+    return result
+
+
+def adjust(name='all'):
+    '''
+    Adjust the DRBD resource while running.
+
+    :type name: str or list
+    :param name:
+        Resource name, or a list of resource names run by one drbdadm.
+
+    :return: result of adjust resource, per resource name with a list.
+    :rtype: int or dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.adjust
+        salt '*' drbd.adjust name=<resource name>
+        salt '*' drbd.adjust name='[res1, res2]'
+    '''
+
+    if isinstance(name, (list, tuple)):
+        return _run_many('adjust', name)
+
+    cmd = 'drbdadm adjust {}'.format(name)
+
+    result = _run('retcode', cmd)
+    _invalidate(name)
+
+    return result
+
+
+def adjust_plan(name='all'):
+    '''
+    Get what ``drbdadm adjust`` would change, from the commands planned
+    by the dry run ``drbdadm -d adjust``.
+
+    Every planned command has:
+
+    - command: the drbdsetup command, eg. net-options, or drbdmeta and
+      its command
+    - args: the positional arguments, resource name or minor first
+    - peer: the peer host name of connection commands, otherwise None
+    - volume: the volume number of commands naming a minor, otherwise None
+    - options: the options to set, True for flags
+
+    :type name: str or list
+    :param name:
+        Resource name, or a list of resource names. Default: all
+
+    :return: planned commands per resource, empty when nothing changes.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.adjust_plan
+        salt '*' drbd.adjust_plan name=<resource name>
+    '''
+    names = list(name) if isinstance(name, (list, tuple)) else [name]
+    if not names:
+        return {}
+
+    cmd = 'drbdadm -d adjust {}'.format(' '.join(names))
+    result = _run('run_all', cmd)
+    if result['retcode'] != 0:
+        raise CommandExecutionError(
+            'Error({}) happened when adjust resource {} in dry run: {}'.format(
+                result['retcode'], ', '.join(names), result['stderr']))
+
+    index = _config_index()
+    plan = _parse_adjust_plan(result['stdout'].splitlines(), index)
+
+    if names == ['all']:
+        names = [res for res, conf in six.iteritems(index['resources'] if index else {})
+                 if conf['local host']]
+
+    ret = dict((res, []) for res in names)
+    ret.update(plan)
+
+    return ret
+
+
+def adjust_changed(name='all', test=False):
+    '''
+    Adjust only the DRBD resources whose running configuration differs
+    from the configuration files, so that resources already adjusted are
+    not reconfigured.
+
+    The dry run ``drbdadm -d adjust`` is run first, then one ``drbdadm
+    adjust`` for all the resources with planned commands.
+
+    :type name: str or list
+    :param name:
+        Resource name, or a list of resource names. Default: all
+
+    :type test: bool
+    :param test:
+        Only run the dry run. Default: False
+
+    :return: per adjusted resource, the planned commands and the return
+        code of drbdadm adjust, None with test.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.adjust_changed
+        salt '*' drbd.adjust_changed name='[res1, res2]' test=True
+    '''
+    plan = adjust_plan(name)
+    pending = sorted(res for res, commands in six.iteritems(plan) if commands)
+
+    ret = dict((res, {'plan': plan[res], 'retcode': None}) for res in pending)
+    if test or not pending:
+        return ret
+
+    for res, retcode in six.iteritems(adjust(pending)):
+        ret[res]['retcode'] = retcode
+
+    return ret
+
+
+def resource_exists(name, cached=False):
+    '''
+    Check whether the DRBD resource is defined in the configuration of
+    this host.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :type cached: bool
+    :param cached:
+        Look up the resource in the config index built from one
+        ``drbdadm dump-xml all``, see ``config_index``. Like ``drbdadm
+        dump``, a resource without a section for this host is not defined.
+        Falls back to ``drbdadm dump`` when the index is not available.
+        Default: False
+
+    :return: whether the resource is defined.
+    :rtype: bool
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.resource_exists <resource name>
+    '''
+    if cached:
+        index = _config_index()
+        if index is not None:
+            return bool(index['resources'].get(name, {}).get('local host'))
+
+    cmd = 'drbdadm dump {}'.format(name)
+
+    return _run('retcode', cmd) == 0
+
+
+def config_index(name='all'):
+    '''
+    Show the configuration of DRBD resources, parsed from one
+    ``drbdadm dump-xml all``.
+
+    The index is kept for the whole run and rebuilt only when the mtime
+    of ``/etc/drbd.conf``, ``/etc/drbd.d`` or an included file changes.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :return: The configuration of the resource, or a dict of all resources
+        keyed by name. The volumes of the local host are under ``volumes``,
+        the ones of every host under ``hosts``.
+        None if the resource or the configuration is not available.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.config_index
+    '''
+    index = _config_index()
+    if index is None:
+        return None
+
+    if name == 'all':
+        return index['resources']
+
+    return index['resources'].get(name)
+
+
+def list_resources(host=None):
+    '''
+    List the DRBD resources defined in the configuration.
+
+    :type host: str
+    :param host:
+        Only list resources with a section for this host.
+
+    :return: sorted resource names.
+    :rtype: list
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.list_resources
+    '''
+    index = _config_index()
+    if index is None:
+        return []
+
+    if host is not None:
+        return sorted(index['hosts'].get(host, []))
+
+    return sorted(index['resources'])
+
+
+def find_volume(minor=None, device=None, disk=None):
+    '''
+    Find the local DRBD volume with the given minor, device or backing disk.
+
+    :type minor: int
+    :param minor:
+        DRBD minor number, e.g. 0 for /dev/drbd0.
+
+    :type device: str
+    :param device:
+        DRBD device, e.g. /dev/drbd0.
+
+    :type disk: str
+    :param disk:
+        Backing disk, e.g. /dev/vdb1.
+
+    :return: resource name, volume number, minor, device, disk and
+        meta-disk of the volume. None if not configured on this host.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.find_volume device=/dev/drbd0
+    '''
+    index = _config_index()
+    if index is None:
+        return None
+
+    if minor is not None:
+        found = index['minors'].get(int(minor))
+    elif device is not None:
+        found = index['devices'].get(device)
+    elif disk is not None:
+        found = index['disks'].get(disk)
+    else:
+        raise CommandExecutionError('One of minor, device or disk is required.')
+
+    if found is None:
+        return None
+
+    name, vnr = found
+    ret = {'resource name': name, 'volume': vnr}
+    ret.update(index['resources'][name]['volumes'][vnr])
+
+    return ret
+
+
+def metadata_status(name, cached=False):
+    '''
+    Check whether the meta-data of each local volume of a DRBD resource
+    is created, without running ``drbdadm create-md``.
+
+    Internal meta-data is detected by the magic of the on-disk superblock,
+    other volumes fall back to ``drbdadm get-gi``.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :type cached: bool
+    :param cached:
+        Reuse the result of a previous call of the same run. Dropped when
+        the meta-data is changed via this module, e.g. ``createmd``.
+        Default: False
+
+    :return: initialized flag and per volume status: present, meta-data
+        version ('v08'/'v09', unknown via get-gi) and current UUID.
+        'present' is None for diskless volumes.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.metadata_status <resource name>
+    '''
+    metadata = __context__.setdefault('drbd.metadata', {})
+    if cached and name in metadata:
+        return metadata[name]
+
+    resource = config_index(name)
+    if not resource or not resource['volumes']:
+        raise CommandExecutionError(
+            'No volume of resource {} configured on this host.'.format(name))
+
+    volumes = [_probe_metadata(name, vnr, vol)
+               for vnr, vol in sorted(six.iteritems(resource['volumes']))]
+
+    ret = {
+        'resource name': name,
+        'initialized': all(vol['present'] is not False for vol in volumes),
+        'volumes': volumes,
+    }
+    metadata[name] = ret
+
+    return ret
+
+
+def setup_show(name='all'):
+    '''
+    Show the DRBD resource via drbdsetup directly.
+    Only support the json format so far.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :return: The resource configuration.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.setup_show
+        salt '*' drbd.setup_show name=<resource name>
+    '''
+
+    ret = {'name': name,
+           'result': False,
+           'comment': ''}
+
+    # Only support json format
+    cmd = 'drbdsetup show --json {}'.format(name)
+
+    results = _run('run_all', cmd)
+
+    if 'retcode' not in results or results['retcode'] != 0:
+        ret['comment'] = 'Error({}) happend when show resource via drbdsetup.'.format(
+            results['retcode'])
+        return ret
+
+    try:
+        ret = salt.utils.json.loads(results['stdout'], strict=False)
+    except ValueError:
+        raise CommandExecutionError('Error happens when try to load the json output.',
+                                    info=results)
+
+    return ret
 
 
 def setup_status(name='all'):
@@ -602,7 +2285,7 @@ def setup_status(name='all'):
 
     cmd = 'drbdsetup status --json {}'.format(name)
 
-    results = __salt__['cmd.run_all'](cmd)
+    results = _run('run_all', cmd)
 
     if 'retcode' not in results or results['retcode'] != 0:
         ret['comment'] = 'Error({}) happend when show resource via drbdsetup.'.format(
@@ -618,6 +2301,445 @@ def setup_status(name='all'):
     return ret
 
 
+def statistics(name='all', since_last=False):
+    '''
+    Get the performance statistics of the DRBD resource from
+    ``drbdsetup status --statistics --json``, as flat records.
+
+    There is one record per device (e.g. read, written, al-writes,
+    bm-writes, upper-pending, lower-pending), per connection (ap-in-flight,
+    rs-in-flight) and per peer device (sent, received, out-of-sync,
+    pending, unacked). Records are labelled by type, resource name,
+    peernode name, volume and minor, all other fields are numbers.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :type since_last: bool
+    :param since_last:
+        Report the growing counters (read, written, al-writes, bm-writes,
+        sent, received) per second since the previous call with
+        since_last, kept in the minion cachedir. The counters are None
+        without previous sample or after they were reset.
+        The seconds since the previous call are in each record.
+        Default: False
+
+    :return: statistics records.
+    :rtype: list(dict)
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.statistics
+        salt '*' drbd.statistics name=<resource name> since_last=True
+    '''
+    now = time.time()
+    resources = _statistics_json(name)
+    try:
+        records = _statistics_records(resources)
+    except (KeyError, TypeError, AttributeError):
+        raise CommandExecutionError('Error happens when try to load the json output.',
+                                    info=resources)
+
+    if not since_last:
+        return records
+
+    previous = _load_statistics_sample(name)
+    _save_statistics_sample(name, {
+        'time': now,
+        'records': dict((_record_key(record), record) for record in records),
+    })
+
+    for record in records:
+        last = previous['records'].get(_record_key(record)) if previous else None
+        seconds = now - previous['time'] if previous else None
+        record['seconds'] = seconds
+
+        for key in STATISTICS_COUNTERS:
+            if key not in record:
+                continue
+            if last is None or key not in last or record[key] < last[key] or not seconds:
+                record[key] = None
+            else:
+                record[key] = (record[key] - last[key]) / seconds
+
+    return records
+
+
+def prometheus_metrics(name='all', textfile_dir=None, filename='drbd.prom'):
+    '''
+    Render the DRBD metrics in the Prometheus exposition format, from one
+    ``drbdsetup status --statistics --json``.
+
+    The states (role, disk, connection, replication, peer disk) are
+    gauges set to 1 with the state as label. Sync progress
+    (percent_in_sync) and the other statistics are the plain values,
+    the growing ones (read, written, al-writes, bm-writes, sent,
+    received) are counters with the ``_total`` suffix.
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :type textfile_dir: str
+    :param textfile_dir:
+        Write the metrics atomically to this directory, e.g. the textfile
+        collector directory of node-exporter.
+
+    :type filename: str
+    :param filename:
+        File name in textfile_dir. Default: drbd.prom
+
+    :return: The metrics, or the path written when textfile_dir is set.
+    :rtype: str
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.prometheus_metrics
+        salt '*' drbd.prometheus_metrics textfile_dir=/var/lib/node_exporter/textfile_collector
+    '''
+    try:
+        text = '\n'.join(_prometheus_lines(_statistics_json(name))) + '\n'
+    except (KeyError, TypeError, AttributeError):
+        raise CommandExecutionError('Error happens when try to load the json output.')
+
+    if textfile_dir is None:
+        return text
+
+    path = os.path.join(textfile_dir, filename)
+    with salt.utils.atomicfile.atomic_open(path, 'w') as prom:
+        prom.write(text)
+
+    return path
+
+
+def replication_health(name, samples=3, interval=1, peernode='all'):
+    '''
+    Sample the in-flight and pending counters of the DRBD resource over a
+    short window, to show how replication keeps up with the writes.
+
+    Per peer node it reports, from ``drbdsetup status --statistics --json``:
+
+    - connection: the last connection state
+    - congested: whether the connection was congested in any sample
+    - ahead/behind: Ahead or Behind when a volume switched to it due to
+      ``on-congestion``, otherwise None
+    - ap-in-flight, rs-in-flight (KiB), pending, unacked (requests,
+      summed over volumes): max and avg over the samples
+    - out-of-sync: KiB out of sync in the last sample
+    - send rate: KiB/s sent over the window, None with a single sample
+    - lag: estimated seconds to replicate the application data in
+      flight, None when nothing was sent meanwhile
+
+    :type name: str
+    :param name:
+        Resource name.
+
+    :type samples: int
+    :param samples:
+        Number of samples. Default: 3
+
+    :type interval: int
+    :param interval:
+        Seconds between samples. Default: 1
+
+    :type peernode: str
+    :param peernode:
+        Peer node name. Default: all
+
+    :return: resource name and the health of each peer node.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.replication_health <resource name>
+        salt '*' drbd.replication_health <resource name> samples=10 interval=0.5
+    '''
+    connections = {}
+
+    for count in range(max(int(samples), 1)):
+        if count:
+            time.sleep(interval)
+
+        now = time.time()
+        for resource in _statistics_json(name):
+            if resource.get('name') != name:
+                continue
+            for conn in resource.get('connections', []):
+                if peernode in ('all', conn.get('name')):
+                    connections.setdefault(conn['name'], []).append((now, conn))
+
+    try:
+        peers = dict((peer, _connection_health(conn_samples))
+                     for peer, conn_samples in six.iteritems(connections))
+    except (TypeError, AttributeError):
+        raise CommandExecutionError('Error happens when try to load the json output.')
+
+    return {
+        'resource name': name,
+        'peer nodes': peers,
+    }
+
+
+def perf_stats(reset=False):
+    '''
+    Show the drbdadm, drbdsetup and drbd-overview commands run by this
+    module, to find which functions or states spawn most of them.
+
+    Commands are aggregated by tool and sub command, eg. ``drbdadm
+    status``, with the number of calls and failures, the total, max and
+    avg seconds and the output size. The latest commands are listed in
+    the history with their exit code, None when unknown.
+
+    The records live in ``__context__``, so only the commands of the
+    current salt run are shown.
+
+    :type reset: bool
+    :param reset:
+        Clear the records once returned. Default: False
+
+    :return: totals, per command aggregates and history.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.perf_stats
+        salt '*' drbd.perf_stats reset=True
+    '''
+    with _PERF_LOCK:
+        perf = __context__.get('drbd.perf', {'commands': {}, 'history': []})
+        if reset:
+            __context__.pop('drbd.perf', None)
+
+        commands = {}
+        for key, stats in six.iteritems(perf['commands']):
+            commands[key] = dict(stats)
+            commands[key]['avg seconds'] = stats['seconds'] / stats['calls']
+
+        return {
+            'calls': sum(stats['calls'] for stats in commands.values()),
+            'failures': sum(stats['failures'] for stats in commands.values()),
+            'seconds': sum(stats['seconds'] for stats in commands.values()),
+            'commands': commands,
+            'history': [dict(record) for record in perf['history']],
+        }
+
+
+def sync_status(name, peernode='all'):
+    '''
+    Evaluate the sync state of a drbd resource from one status sample.
+
+    :type name: str
+    :param name:
+        Resource name. Not support all.
+
+    :type peernode: str
+    :param peernode:
+        Peer node name. Default: all
+
+    :return: Whether synced, and the volumes not UpToDate yet.
+        The ``done`` percentage of lagging volumes is a float,
+        None if not syncing.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.sync_status <resource name> <peernode name>
+    '''
+    res = status(name)
+
+    return _evaluate_sync(name, res[0] if res else None, peernode=peernode)
+
+
+def sync_progress(name, peernode='all', interval=1):
+    '''
+    Evaluate the sync state of a drbd resource like ``sync_status``,
+    with the sync rate and ETA of each lagging volume.
+
+    The rate is calculated against the previous sample of the resource
+    kept in ``__context__``. Without a previous sample, the resource is
+    sampled twice, ``interval`` seconds apart.
+
+    :type name: str
+    :param name:
+        Resource name. Not support all.
+
+    :type peernode: str
+    :param peernode:
+        Peer node name. Default: all
+
+    :type interval: int
+    :param interval:
+        Seconds between two samples when no previous sample.
+        0 to only take one sample. Default: 1
+
+    :return: Same as ``sync_status``, lagging volumes have ``rate`` in
+        percent per second and ``eta`` in seconds, None if unknown.
+        ``eta`` of the resource is the one of the slowest volume.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.sync_progress <resource name>
+    '''
+    progress = __context__.setdefault('drbd.progress', {})
+    previous = progress.get(name)
+
+    res = status(name)
+    current = (time.time(), _sync_sample(res[0] if res else None))
+
+    if previous is None and interval and current[1]:
+        previous = current
+        time.sleep(interval)
+        res = status(name)
+        current = (time.time(), _sync_sample(res[0] if res else None))
+
+    progress[name] = current
+    rates = _sync_rates(previous, current)
+
+    res = res[0] if res else None
+    ret = _evaluate_sync(name, res, peernode=peernode)
+
+    # Progress of local volumes is shown on the peer being SyncSource
+    targets = {}
+    for node in res.get('peer nodes', []) if res else []:
+        for vol in node.get('peer volumes', []):
+            if vol.get('replication') in ('SyncTarget', 'PausedSyncT'):
+                targets[vol.get('volume')] = (node['peernode name'], vol.get('volume'))
+
+    lagging = []
+    for vol in ret['lagging local volumes']:
+        vol['rate'], vol['eta'] = rates.get(targets.get(vol.get('volume')), (None, None))
+        lagging.append(vol)
+
+    for peer, vols in ret['lagging peer volumes'].items():
+        for vol in vols:
+            vol['rate'], vol['eta'] = rates.get((peer, vol.get('volume')), (None, None))
+            lagging.append(vol)
+
+    etas = [vol['eta'] for vol in lagging]
+    ret['eta'] = max(etas) if etas and None not in etas else None
+
+    return ret
+
+
+def wait_sync_events(name, timeout=600, peernode='all'):
+    '''
+    Follow ``drbdsetup events2`` of a drbd resource until all volumes
+    are fully synced, return as soon as the last one is UpToDate.
+
+    :type name: str
+    :param name:
+        Resource name. Not support all.
+
+    :type timeout: int
+    :param timeout:
+        Seconds to wait for. Default: 600
+
+    :type peernode: str
+    :param peernode:
+        Peer node name. Default: all
+
+    :return: Same as ``sync_status``, of the last state seen.
+        ``seconds`` is the time taken to be synced, None if not synced.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.wait_sync_events <resource name> timeout=60
+    '''
+    return _watch_sync_events([name], timeout=timeout, peernode=peernode)[name]
+
+
+def wait_sync_events_all(names, timeout=600, peernode='all'):
+    '''
+    Follow one ``drbdsetup events2 all`` until all given drbd resources
+    are fully synced.
+
+    :type names: list
+    :param names:
+        Resource names.
+
+    :type timeout: int
+    :param timeout:
+        Seconds to wait for. Default: 600
+
+    :type peernode: str
+    :param peernode:
+        Peer node name. Default: all
+
+    :return: Same as ``sync_status`` of the last state seen, per
+        resource. ``seconds`` is the time the resource took to be synced,
+        None if not synced.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.wait_sync_events_all '[beijing, tianjin]' timeout=60
+    '''
+    return _watch_sync_events(names, timeout=timeout, peernode=peernode)
+
+
+def sync_status_all(resources='*', peernode='all'):
+    '''
+    Evaluate the sync state of multiple drbd resources from one
+    ``status all`` sample.
+
+    :type resources: list
+    :param resources:
+        Resource names or glob patterns. Default: *
+        Patterns only match running resources.
+
+    :type peernode: str
+    :param peernode:
+        Peer node name. Default: all
+
+    :return: Same as ``sync_status``, per resource.
+    :rtype: dict
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' drbd.sync_status_all 'res-*'
+    '''
+    if isinstance(resources, six.string_types):
+        resources = [resources]
+
+    result = status()
+    if isinstance(result, list):
+        running = dict((res['resource name'], res) for res in result)
+    else:
+        running = {}
+
+    names = []
+    for pattern in resources:
+        if any(char in pattern for char in '*?['):
+            matched = sorted(fnmatch.filter(running, pattern))
+        else:
+            matched = [pattern]
+        names.extend(name for name in matched if name not in names)
+
+    return dict((name, _evaluate_sync(name, running.get(name), peernode=peernode))
+                for name in names)
+
+
 def check_sync_status(name, peernode='all'):
     '''
     Query a drbd resource until fully synced for all volumes.
@@ -636,8 +2758,4 @@ def check_sync_status(name, peernode='all'):
 
         salt '*' drbd.check_sync_status <resource name> <peernode name>
     '''
-    if _is_local_all_uptodated(name) and _is_peers_uptodated(
-            name, peernode=peernode):
-        return True
-
-    return False
+    return sync_status(name, peernode=peernode)['synced']
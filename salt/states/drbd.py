@@ -35,6 +35,9 @@ State module to provide DRBD functionality to Salt
 
 .. code-block:: yaml
 
+    # Minion option: add the drbd commands run by each state to its comment
+    drbd.perf_stats: True
+
 '''
 from __future__ import absolute_import, print_function, unicode_literals
 import logging
@@ -47,6 +50,12 @@ LOGGER = logging.getLogger(__name__)
 
 __virtualname__ = 'drbd'
 
+# First sleep of the sync wait loop, doubled until the sync rate is known
+MIN_POLL_INTERVAL = 1
+
+# Disk states of a disk holding data, never skip the initial sync over them
+DATA_DISK_STATES = ('UpToDate', 'Consistent', 'Outdated')
+
 
 def __virtual__():  # pragma: no cover
     '''
@@ -55,16 +64,54 @@ def __virtual__():  # pragma: no cover
     return 'drbd.status' in __salt__
 
 
-def _resource_not_exist(name):
-    cmd = 'drbdadm dump {}'.format(name)
-    result = __salt__['cmd.retcode'](cmd)
+def _perf_summary(before, after):
+    '''
+    Summarize the drbd commands run between two drbd.perf_stats
+    '''
+    commands = []
+    for key, stats in sorted(six.iteritems(after['commands'])):
+        previous = before['commands'].get(key, {'calls': 0, 'seconds': 0.0})
+        calls = stats['calls'] - previous['calls']
+        if calls:
+            commands.append('{} x{} {:.3f}s'.format(
+                key, calls, stats['seconds'] - previous['seconds']))
+
+    return 'drbd commands: {} in {:.3f}s{}'.format(
+        after['calls'] - before['calls'], after['seconds'] - before['seconds'],
+        ' ({})'.format(', '.join(commands)) if commands else '')
+
+
+def _perf_begin():
+    '''
+    Get drbd.perf_stats at the start of a state, when the ``drbd.perf_stats``
+    minion option is True, otherwise None
+    '''
+    if not __opts__.get('drbd.perf_stats', False):
+        return None
+    return __salt__['drbd.perf_stats']()
 
-    return bool(result)
+
+def _perf_ret(ret, before):
+    '''
+    Add the summary of the drbd commands run by the state since _perf_begin
+    to its comment, return the state result
+    '''
+    if before is None:
+        return ret
+
+    summary = _perf_summary(before, __salt__['drbd.perf_stats']())
+    ret['comment'] = '{}\n{}'.format(ret['comment'], summary) if ret['comment'] else summary
+    return ret
+
+
+def _resource_not_exist(name):
+    # Use the config index shared by all drbd states of the run
+    return not __salt__['drbd.resource_exists'](name=name, cached=True)
 
 
 def _get_res_status(name):
     try:
-        result = __salt__['drbd.status'](name=name)
+        result = __salt__['drbd.status'](name=name, cached=True)
     except CommandExecutionError as err:
         LOGGER.error(six.text_type(err))
         return None
@@ -81,16 +128,229 @@ def _get_res_status(name):
 
 
 def _get_resource_list():
-    ret = []
-    cmd = 'drbdadm dump all'
+    return __salt__['drbd.list_resources']()
+
+
+def _manage_resources(name, resources, function, done, running, action, error, **kwargs):
+    '''
+    Apply the drbd execution function with one drbdadm to the resources
+    not done yet, for the states managing a list of resources.
+
+    done tells from the status of a resource, None when it is down,
+    whether it is already done. running requires the resources to be
+    started. action and error are the words of the comments.
+    '''
+    ret = {
+        'name': name,
+        'result': False,
+        'changes': {},
+        'comment': '',
+    }
+
+    if isinstance(resources, six.string_types):
+        resources = [resources]
+
+    # Check resources exist
+    missing = [res for res in resources if _resource_not_exist(res)]
+    if missing:
+        ret['comment'] = 'Resources {} not defined in your config.'.format(', '.join(missing))
+        return ret
+
+    try:
+        statuses = dict((res['resource name'], res) for res in
+                        __salt__['drbd.status'](name='all', cached=True) or [])
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return ret
+
+    if running:
+        stopped_res = [res for res in resources if res not in statuses]
+        if stopped_res:
+            ret['comment'] = 'Resources {} are currently stop.'.format(', '.join(stopped_res))
+            return ret
+
+    # Check already finished
+    pending = [res for res in resources if not done(statuses.get(res))]
+    if not pending:
+        ret['result'] = True
+        ret['comment'] = 'Resources {} are already {}.'.format(', '.join(resources), action)
+        return ret
+
+    # Do nothing for test=True
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Resources {} would be {}.'.format(', '.join(pending), action)
+        for res in pending:
+            ret['changes'][res] = {action: None}
+        return ret
+
+    try:
+        # Do real job
+        results = __salt__['drbd.{}'.format(function)](name=pending, **kwargs)
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return ret
 
-    for line in __salt__['cmd.run'](cmd).splitlines():
-        if line.startswith('resource'):
-            ret.append(line.split()[1])
+    failed = [res for res in pending if results.get(res)]
+    for res in pending:
+        if res not in failed:
+            ret['changes'][res] = {action: True}
 
+    if failed:
+        ret['comment'] = 'Error in {} {}.'.format(error, ', '.join(failed))
+        return ret
+
+    ret['comment'] = 'Resources {} are {}.'.format(', '.join(pending), action)
+    ret['result'] = True
     return ret
 
 
+def _disk_states(res):
+    '''
+    Get the local and peer disk states, None for a peer not connected
+    '''
+    local = [vol.get('disk') for vol in res['local volumes']]
+    peers = []
+
+    for node in res['peer nodes']:
+        if 'connection' in node:
+            peers.append(None)
+        else:
+            peers.extend(vol.get('peer-disk') for vol in node['peer volumes'])
+
+    return local, peers
+
+
+def _poll_disk_states(name):
+    result = __salt__['drbd.status'](name=name)
+    if not isinstance(result, list) or not result:
+        # Not up yet, same as no peer connected
+        return [], [None]
+
+    return _disk_states(result[0])
+
+
+def _next_poll(previous, verdict, interval, remaining):
+    '''
+    Seconds to sleep before the next poll of the sync status: the ETA once
+    the sync rate is known, otherwise double the previous sleep, starting
+    from MIN_POLL_INTERVAL. Capped by interval and the remaining time.
+    '''
+    eta = verdict.get('eta') if verdict else None
+
+    if eta is not None:
+        sleep = eta
+    elif previous:
+        sleep = previous * 2
+    else:
+        sleep = MIN_POLL_INTERVAL
+
+    return min(max(sleep, MIN_POLL_INTERVAL), interval, remaining)
+
+
+def _progress_comment(vol):
+    progress = []
+
+    if vol.get('done') is not None:
+        progress.append('{}% done'.format(vol['done']))
+    if vol.get('rate') is not None:
+        progress.append('{:.2f}%/s'.format(vol['rate']))
+    if vol.get('eta') is not None:
+        progress.append('ETA {:.0f}s'.format(vol['eta']))
+
+    return ' ({})'.format(', '.join(progress)) if progress else ''
+
+
+def _lagging_comment(verdict):
+    lagging = []
+
+    for vol in verdict.get('lagging local volumes', []):
+        lagging.append('local volume {} is {}{}'.format(
+            vol.get('volume', '0'), vol.get('disk'), _progress_comment(vol)))
+
+    for peer, vols in sorted(verdict.get('lagging peer volumes', {}).items()):
+        for vol in vols:
+            lagging.append('volume {} of {} is {}{}'.format(
+                vol.get('volume', '0'), peer, vol.get('peer-disk'), _progress_comment(vol)))
+
+    return ', '.join(lagging)
+
+
+def _stalled_volumes(tracker, verdict, now, stall_timeout):
+    '''
+    Track the progress of lagging volumes between polls, return the
+    description of volumes not progressing within stall_timeout.
+    '''
+    lagging = {}
+
+    for vol in verdict.get('lagging local volumes', []):
+        lagging[(None, vol.get('volume', '0'))] = vol
+
+    for peer, vols in verdict.get('lagging peer volumes', {}).items():
+        for vol in vols:
+            lagging[(peer, vol.get('volume', '0'))] = vol
+
+    # Forget volumes synced in the meantime
+    for key in list(tracker):
+        if key not in lagging:
+            tracker.pop(key)
+
+    stalled = []
+    for key in sorted(lagging, key=six.text_type):
+        vol = lagging[key]
+        done, since = tracker.get(key, (None, None))
+
+        if since is None or vol.get('done') != done:
+            tracker[key] = (vol.get('done'), now)
+            continue
+
+        if now - since < stall_timeout:
+            continue
+
+        if key[0] is None:
+            msg = 'local volume {} is {}'.format(key[1], vol.get('disk'))
+        else:
+            msg = 'volume {} of {} is {}'.format(key[1], key[0], vol.get('peer-disk'))
+
+        reasons = []
+        if vol.get('replication'):
+            reasons.append('replication: {}'.format(vol['replication']))
+        if vol.get('resync-suspended', 'no') != 'no':
+            reasons.append('resync-suspended: {}'.format(vol['resync-suspended']))
+        if done is not None:
+            reasons.append('{}% done'.format(done))
+        if reasons:
+            msg += ' ({})'.format(', '.join(reasons))
+
+        stalled.append(msg)
+
+    return stalled
+
+
+def _initialize_errors(expected, volumes):
+    '''
+    Check that every volume of expected, as (resource name, volume), has
+    metadata in the outcomes of drbd.createmd_many. A volume without
+    outcome is an error too, like when its worker died.
+    Return the errors as ``<resource>/<volume>: <reason>``.
+    '''
+    outcomes = dict(((vol['resource name'], vol['volume']), vol) for vol in volumes)
+    keys = list(expected) + [key for key, vol in six.iteritems(outcomes)
+                             if vol['outcome'] == 'failed' and key not in expected]
+
+    errors = []
+    for res, vnr in keys:
+        vol = outcomes.get((res, vnr))
+        if vol is None:
+            errors.append('{}/{}: no outcome'.format(res, vnr))
+        elif vol['outcome'] == 'failed':
+            errors.append('{}/{}: {}'.format(res, vnr, vol['comment']))
+        elif vol['outcome'] not in ('created', 'present'):
+            errors.append('{}/{}: {}'.format(res, vnr, vol['outcome']))
+
+    return errors
+
+
 def initialized(name, force=True):
     '''
     Make sure the DRBD resource is initialized.
@@ -100,8 +360,11 @@ def initialized(name, force=True):
 
     force
         Force to recreate the metadata.
+        Only volumes without metadata are created, the metadata of the
+        other volumes is never overwritten.
 
     '''
+    perf = _perf_begin()
 
     ret = {
         'name': name,
@@ -113,55 +376,290 @@ def initialized(name, force=True):
     # Check resource exist
     if _resource_not_exist(name):
         ret['comment'] = 'Resource {} not defined in your config.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Check already finished
-    msg = 'There appears to be a v09| is configured!'
-    cmd = 'echo no|drbdadm create-md {} 2>&1 |grep -E "{}" >/dev/null'.format(
-        name, msg)
-    result = __salt__['cmd.retcode'](cmd, python_shell=True)
+    try:
+        metadata = __salt__['drbd.metadata_status'](name=name, cached=True)
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return _perf_ret(ret, perf)
 
-    if result == 0:
+    if metadata['initialized']:
         ret['result'] = True
         ret['comment'] = 'Resource {} has already initialized.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Do nothing for test=True
     if __opts__['test']:
         ret['result'] = None
         ret['comment'] = 'Resource {} would be initialized.'.format(name)
         ret['changes']['name'] = name
-        return ret
+        ret['changes']['volumes'] = [vol['volume'] for vol in metadata.get('volumes', [])
+                                     if vol['present'] is False]
+        return _perf_ret(ret, perf)
 
     try:
-        # Do real job
-        result = __salt__['drbd.createmd'](
-            name=name,
+        # Do real job, only for the volumes without metadata
+        volumes = __salt__['drbd.createmd_many'](
+            resources=[name],
             force=force)
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return _perf_ret(ret, perf)
 
-        if result:
-            ret['comment'] = 'Error in initialize {}.'.format(name)
-            ret['result'] = False
-            return ret
+    created = [vol['volume'] for vol in volumes if vol['outcome'] == 'created']
+    if created:
+        ret['changes']['name'] = name
+        ret['changes']['volumes'] = created
+
+    errors = _initialize_errors(
+        [(name, vol['volume']) for vol in metadata.get('volumes', [])
+         if vol['present'] is False], volumes)
+    if errors:
+        ret['comment'] = 'Error in initialize {}.'.format(', '.join(errors))
+        return _perf_ret(ret, perf)
+
+    ret['comment'] = 'Resource {} metadata initialized.'.format(name)
+    ret['result'] = True
+    return _perf_ret(ret, perf)
+
+
+def all_initialized(name, resources='*', force=True, workers=4):
+    '''
+    Make sure multiple DRBD resources are initialized, creating the
+    missing metadata in parallel.
+
+    name:
+        Name of the state, not used as resource name.
+
+    resources:
+        List of resource names or glob patterns. Default: *
+        Patterns only match resources with volumes on this host.
+
+    force:
+        Force to recreate the metadata.
+
+    workers:
+        Maximum number of create-md running together, volumes on the same
+        backing device are never created together. Default: 4
+
+    The seconds each volume took to be initialized are in the changes.
+    '''
+    perf = _perf_begin()
+
+    ret = {
+        'name': name,
+        'result': False,
+        'changes': {},
+        'comment': '',
+    }
+
+    try:
+        # The volumes of the resources, and whether the metadata is missing
+        plan = __salt__['drbd.createmd_many'](
+            resources=resources,
+            force=force,
+            workers=workers,
+            test=True)
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return _perf_ret(ret, perf)
+
+    if not plan:
+        ret['comment'] = 'No resource matches {}.'.format(resources)
+        return _perf_ret(ret, perf)
+
+    names = []
+    for vol in plan:
+        if vol['resource name'] not in names:
+            names.append(vol['resource name'])
 
+    missing = [vol for vol in plan if vol['outcome'] == 'missing']
+    if not missing:
+        ret['result'] = True
+        ret['comment'] = 'Resources {} have already initialized.'.format(', '.join(names))
+        return _perf_ret(ret, perf)
+
+    pending = []
+    for vol in missing:
+        if vol['resource name'] not in pending:
+            pending.append(vol['resource name'])
+
+    # Do nothing for test=True
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Resources {} would be initialized.'.format(', '.join(sorted(pending)))
+        for vol in missing:
+            ret['changes'].setdefault(vol['resource name'], {})[vol['volume']] = {
+                'initialized': None}
+        return _perf_ret(ret, perf)
+
+    try:
+        # Do real job, only for the resources missing metadata
+        volumes = __salt__['drbd.createmd_many'](
+            resources=pending,
+            force=force,
+            workers=workers)
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return _perf_ret(ret, perf)
+
+    for vol in volumes:
+        if vol['outcome'] == 'created':
+            ret['changes'].setdefault(vol['resource name'], {})[vol['volume']] = {
+                'initialized': True, 'seconds': vol['seconds']}
+
+    errors = _initialize_errors(
+        [(vol['resource name'], vol['volume']) for vol in missing], volumes)
+    if errors:
+        ret['comment'] = 'Error in initialize {}.'.format(', '.join(errors))
+        return _perf_ret(ret, perf)
+
+    ret['comment'] = 'Resources {} metadata initialized.'.format(', '.join(names))
+    ret['result'] = True
+    return _perf_ret(ret, perf)
+
+
+def initialized_synced(name, force=True, interval=5, timeout=300):
+    '''
+    Make sure a freshly created DRBD resource is synced with its peers,
+    skipping the initial sync: the peers are declared identical via
+    ``new-current-uuid --clear-bitmap``, no data is copied.
+
+    Only for blank or thin provisioned backing devices, which don't hold
+    data yet. Apply it on one node, the others only need the resource
+    initialized and started.
+
+    name
+        Name of the DRBD resource.
+
+    force
+        Force to create the metadata when missing. Default: True
+
+    interval
+        Interval to check the peers. Default: 5
+
+    timeout
+        Timeout to wait the peers connected and the disks UpToDate. Default: 300
+
+    '''
+    perf = _perf_begin()
+
+    ret = {
+        'name': name,
+        'result': False,
+        'changes': {},
+        'comment': '',
+    }
+
+    # Check resource exist
+    if _resource_not_exist(name):
+        ret['comment'] = 'Resource {} not defined in your config.'.format(name)
+        return _perf_ret(ret, perf)
+
+    res = _get_res_status(name)
+    if res:
+        local, peers = _disk_states(res)
+        # Disconnected peers will resync the usual way
+        if all(disk == 'UpToDate' for disk in local) and \
+                all(disk in ('UpToDate', None) for disk in peers):
+            ret['result'] = True
+            ret['comment'] = 'Resource {} has already been synced.'.format(name)
+            return _perf_ret(ret, perf)
+
+        if any(disk in DATA_DISK_STATES for disk in local + peers):
+            ret['comment'] = ('Resource {} already holds data, '
+                              'would not skip the initial sync.'.format(name))
+            return _perf_ret(ret, perf)
+
+    # Do nothing for test=True
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Resource {} would be synced without initial sync.'.format(name)
         ret['changes']['name'] = name
-        ret['comment'] = 'Resource {} metadata initialized.'.format(name)
+        return _perf_ret(ret, perf)
+
+    try:
+        # Do real job
+        if not res:
+            # Only the volumes without metadata
+            metadata = __salt__['drbd.metadata_status'](name=name, cached=True)
+            volumes = __salt__['drbd.createmd_many'](resources=[name], force=force)
+            errors = _initialize_errors(
+                [(name, vol['volume']) for vol in metadata.get('volumes', [])
+                 if vol['present'] is False], volumes)
+            if errors:
+                ret['comment'] = 'Error in initialize {}.'.format(', '.join(errors))
+                return _perf_ret(ret, perf)
+
+            if __salt__['drbd.up'](name=name):
+                ret['comment'] = 'Error in starting {}.'.format(name)
+                return _perf_ret(ret, perf)
+
+        # All peers connected, and none of them holds data
+        starttime = time.time()
+        while True:
+            local, peers = _poll_disk_states(name)
+
+            if any(disk in DATA_DISK_STATES for disk in local + peers):
+                ret['comment'] = ('Resource {} already holds data, '
+                                  'would not skip the initial sync.'.format(name))
+                return _perf_ret(ret, perf)
+            if None not in peers and all(disk == 'Inconsistent' for disk in local + peers):
+                break
+
+            if time.time() > starttime + timeout:
+                ret['comment'] = 'Peers of resource {} are not connected within {}s.'.format(
+                    name, timeout)
+                return _perf_ret(ret, perf)
+            time.sleep(interval)
+
+        if __salt__['drbd.new_current_uuid'](name=name, clear_bitmap=True):
+            ret['comment'] = 'Error in clearing the bitmap of {}.'.format(name)
+            return _perf_ret(ret, perf)
+
+        ret['changes']['name'] = name
+
+        # Verify all disks became UpToDate
+        while True:
+            local, peers = _poll_disk_states(name)
+
+            if all(disk == 'UpToDate' for disk in local + peers):
+                break
+
+            if time.time() > starttime + timeout:
+                ret['comment'] = ('Resource {} is not UpToDate within {}s '
+                                  'after clearing the bitmap.'.format(name, timeout))
+                return _perf_ret(ret, perf)
+            time.sleep(interval)
+
+        ret['comment'] = 'Resource {} is synced without initial sync.'.format(name)
         ret['result'] = True
-        return ret
+        return _perf_ret(ret, perf)
 
     except CommandExecutionError as err:
         ret['comment'] = six.text_type(err)
-        return ret
+        return _perf_ret(ret, perf)
 
 
-def started(name):
+def started(name, resources=None):
     '''
     Make sure the DRBD resource is started.
 
     name
         Name of the DRBD resource.
 
+    resources
+        List of DRBD resources started together by one drbdadm, name is
+        then only the name of the state. Default: None
+
     '''
+    perf = _perf_begin()
+
+    if resources is not None:
+        return _perf_ret(_manage_resources(name, resources, 'up', lambda res: res is not None,
+                                           False, 'started', 'start'), perf)
 
     ret = {
         'name': name,
@@ -173,21 +671,21 @@ def started(name):
     # Check resource exist
     if _resource_not_exist(name):
         ret['comment'] = 'Resource {} not defined in your config.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Check already finished
     res = _get_res_status(name)
     if res:
         ret['result'] = True
         ret['comment'] = 'Resource {} is already started.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Do nothing for test=True
     if __opts__['test']:
         ret['result'] = None
         ret['comment'] = 'Resource {} would be started.'.format(name)
         ret['changes']['name'] = name
-        return ret
+        return _perf_ret(ret, perf)
 
     try:
         # Do real job
@@ -196,26 +694,36 @@ def started(name):
         if result:
             ret['comment'] = 'Error in start {}.'.format(name)
             ret['result'] = False
-            return ret
+            return _perf_ret(ret, perf)
 
         ret['changes']['name'] = name
         ret['comment'] = 'Resource {} is started.'.format(name)
         ret['result'] = True
-        return ret
+        return _perf_ret(ret, perf)
 
     except CommandExecutionError as err:
         ret['comment'] = six.text_type(err)
-        return ret
+        return _perf_ret(ret, perf)
 
 
-def stopped(name):
+def stopped(name, resources=None):
     '''
     Make sure the DRBD resource is stopped.
 
     name
         Name of the DRBD resource.
 
+    resources
+        List of DRBD resources stopped together by one drbdadm, name is
+        then only the name of the state. Default: None
+
     '''
+    perf = _perf_begin()
+
+    if resources is not None:
+        return _perf_ret(_manage_resources(name, resources, 'down', lambda res: res is None,
+                                           False, 'stopped', 'stop'), perf)
+
     ret = {
         'name': name,
         'result': False,
@@ -226,21 +734,21 @@ def stopped(name):
     # Check resource exist
     if _resource_not_exist(name):
         ret['comment'] = 'Resource {} not defined in your config.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Check already finished
     res = _get_res_status(name)
     if not res:
         ret['result'] = True
         ret['comment'] = 'Resource {} is already stopped.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Do nothing for test=True
     if __opts__['test']:
         ret['result'] = None
         ret['comment'] = 'Resource {} would be stopped.'.format(name)
         ret['changes']['name'] = name
-        return ret
+        return _perf_ret(ret, perf)
 
     try:
         # Do real job
@@ -249,19 +757,19 @@ def stopped(name):
         if result:
             ret['comment'] = 'Error in stop {}.'.format(name)
             ret['result'] = False
-            return ret
+            return _perf_ret(ret, perf)
 
         ret['changes']['name'] = name
         ret['comment'] = 'Resource {} is stopped.'.format(name)
         ret['result'] = True
-        return ret
+        return _perf_ret(ret, perf)
 
     except CommandExecutionError as err:
         ret['comment'] = six.text_type(err)
-        return ret
+        return _perf_ret(ret, perf)
 
 
-def promoted(name, force=False):
+def promoted(name, force=False, resources=None):
     '''
     Make sure the DRBD resource is being primary.
 
@@ -271,7 +779,17 @@ def promoted(name, force=False):
     force
         Force to initial sync. Default: False
 
+    resources
+        List of DRBD resources promoted together by one drbdadm, name is
+        then only the name of the state. Default: None
+
     '''
+    perf = _perf_begin()
+
+    if resources is not None:
+        return _perf_ret(_manage_resources(name, resources, 'primary',
+                                           lambda res: res['local role'] == 'Primary',
+                                           True, 'promoted', 'promoting', force=force), perf)
 
     ret = {
         'name': name,
@@ -283,7 +801,7 @@ def promoted(name, force=False):
     # Check resource exist
     if _resource_not_exist(name):
         ret['comment'] = 'Resource {} not defined in your config.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Check resource is running
     res = _get_res_status(name)
@@ -291,17 +809,17 @@ def promoted(name, force=False):
         if res['local role'] == 'Primary':
             ret['result'] = True
             ret['comment'] = 'Resource {} has already been promoted.'.format(name)
-            return ret
+            return _perf_ret(ret, perf)
     else:
         ret['comment'] = 'Resource {} is currently stop.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Do nothing for test=True
     if __opts__['test']:
         ret['result'] = None
         ret['comment'] = 'Resource {} would be promoted.'.format(name)
         ret['changes']['name'] = name
-        return ret
+        return _perf_ret(ret, perf)
 
     try:
         # Do real job
@@ -312,26 +830,36 @@ def promoted(name, force=False):
         if result:
             ret['comment'] = 'Error in promoting {}.'.format(name)
             ret['result'] = False
-            return ret
+            return _perf_ret(ret, perf)
 
         ret['changes']['name'] = name
         ret['comment'] = 'Resource {} is promoted.'.format(name)
         ret['result'] = True
-        return ret
+        return _perf_ret(ret, perf)
 
     except CommandExecutionError as err:
         ret['comment'] = six.text_type(err)
-        return ret
+        return _perf_ret(ret, perf)
 
 
-def demoted(name):
+def demoted(name, resources=None):
     '''
     Make sure the DRBD resource is being secondary.
 
     name
         Name of the DRBD resource.
 
+    resources
+        List of DRBD resources demoted together by one drbdadm, name is
+        then only the name of the state. Default: None
+
     '''
+    perf = _perf_begin()
+
+    if resources is not None:
+        return _perf_ret(_manage_resources(name, resources, 'secondary',
+                                           lambda res: res['local role'] == 'Secondary',
+                                           True, 'demoted', 'demoting'), perf)
 
     ret = {
         'name': name,
@@ -343,7 +871,7 @@ def demoted(name):
     # Check resource exist
     if _resource_not_exist(name):
         ret['comment'] = 'Resource {} not defined in your config.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Check resource is running
     res = _get_res_status(name)
@@ -351,17 +879,17 @@ def demoted(name):
         if res['local role'] == 'Secondary':
             ret['result'] = True
             ret['comment'] = 'Resource {} has already been demoted.'.format(name)
-            return ret
+            return _perf_ret(ret, perf)
     else:
         ret['comment'] = 'Resource {} is currently stop.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Do nothing for test=True
     if __opts__['test']:
         ret['result'] = None
         ret['comment'] = 'Resource {} would be demoted.'.format(name)
         ret['changes']['name'] = name
-        return ret
+        return _perf_ret(ret, perf)
 
     try:
         # Do real job
@@ -370,19 +898,97 @@ def demoted(name):
         if result:
             ret['comment'] = 'Error in demoting {}.'.format(name)
             ret['result'] = False
-            return ret
+            return _perf_ret(ret, perf)
 
         ret['changes']['name'] = name
         ret['comment'] = 'Resource {} is demoted.'.format(name)
         ret['result'] = True
-        return ret
+        return _perf_ret(ret, perf)
 
     except CommandExecutionError as err:
         ret['comment'] = six.text_type(err)
-        return ret
+        return _perf_ret(ret, perf)
+
+
+def adjusted(name, resources=None):
+    '''
+    Make sure the running DRBD resource matches its configuration. It is
+    only adjusted when the dry run of drbdadm adjust plans commands, so
+    an unchanged resource is not reconfigured.
+
+    name
+        Name of the DRBD resource.
+
+    resources
+        List of DRBD resources adjusted together by one drbdadm, name is
+        then only the name of the state. Default: None
+
+    The planned commands of each adjusted resource are in the changes.
+    '''
+    perf = _perf_begin()
+
+    ret = {
+        'name': name,
+        'result': False,
+        'changes': {},
+        'comment': '',
+    }
+
+    if resources is None:
+        names = [name]
+        label = 'Resource {}'.format(name)
+    else:
+        names = [resources] if isinstance(resources, six.string_types) else list(resources)
+        label = 'Resources {}'.format(', '.join(names))
+
+    # Check resources exist
+    missing = [res for res in names if _resource_not_exist(res)]
+    if missing:
+        ret['comment'] = '{} not defined in your config.'.format(
+            'Resource {}'.format(name) if resources is None else
+            'Resources {}'.format(', '.join(missing)))
+        return _perf_ret(ret, perf)
+
+    try:
+        # Dry run only for test=True
+        results = __salt__['drbd.adjust_changed'](name=names, test=__opts__['test'])
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return _perf_ret(ret, perf)
+
+    # Check already finished
+    if not results:
+        ret['result'] = True
+        ret['comment'] = '{} {} already adjusted.'.format(
+            label, 'is' if resources is None else 'are')
+        return _perf_ret(ret, perf)
 
+    pending = sorted(results)
 
-def wait_for_successful_synced(name, interval=30, timeout=600, **kwargs):
+    # Do nothing for test=True
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Resources {} would be adjusted.'.format(', '.join(pending))
+        for res in pending:
+            ret['changes'][res] = {'plan': results[res]['plan']}
+        return _perf_ret(ret, perf)
+
+    failed = [res for res in pending if results[res]['retcode']]
+    for res in pending:
+        if res not in failed:
+            ret['changes'][res] = {'plan': results[res]['plan']}
+
+    if failed:
+        ret['comment'] = 'Error in adjust {}.'.format(', '.join(failed))
+        return _perf_ret(ret, perf)
+
+    ret['comment'] = 'Resources {} are adjusted.'.format(', '.join(pending))
+    ret['result'] = True
+    return _perf_ret(ret, perf)
+
+
+def wait_for_successful_synced(name, interval=30, timeout=600, events=False,
+                               eta_margin=0, stall_timeout=0, **kwargs):
     '''
     Query a drbd resource until fully synced for all volumes.
     If not synced, will fail after timeout.
@@ -391,15 +997,37 @@ def wait_for_successful_synced(name, interval=30, timeout=600, **kwargs):
         Resource name. Not support all.
 
     interval:
-        Interval to check the sync status. Default: 30
+        Maximum interval to check the sync status. The first check is
+        after 1s, the interval doubles until the sync rate is known, then
+        follows the estimated time to finish. Default: 30
 
     timeout:
         Timeout to wait progress. Default: 600
 
+    events:
+        Follow ``drbdsetup events2`` and return once synced, instead of
+        checking every interval. Falls back to polling when events2 is
+        not usable. Default: False
+
+    eta_margin:
+        Fail before the timeout once the estimated time to finish the
+        sync is more than eta_margin times the remaining time, eg. 1.5.
+        The rate comes from the first polls while the resync still ramps
+        up, so only enable it for syncs with a steady rate.
+        0 to always wait until timeout. Default: 0
+
+    stall_timeout:
+        Fail once the done percentage of a lagging volume has not moved
+        for stall_timeout seconds, like when the resync is suspended or
+        the peer is unreachable. 0 to disable. Default: 0
+
     .. note::
 
-        All other arguements are passed to the module drbd.check_sync_status.
+        All other arguements are passed to the module drbd.sync_status
+        and drbd.sync_progress.
     '''
+    perf = _perf_begin()
+
     ret = {
         'name': name,
         'result': False,
@@ -410,53 +1038,336 @@ def wait_for_successful_synced(name, interval=30, timeout=600, **kwargs):
     # Check resource exist
     if _resource_not_exist(name):
         ret['comment'] = 'Resource {} not defined in your config.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Check resource is running
     res = _get_res_status(name)
     if res:
-        if __salt__['drbd.check_sync_status'](
+        if __salt__['drbd.sync_status'](
                 name=name,
-                **kwargs):
+                **kwargs)['synced']:
             ret['result'] = True
             ret['comment'] = 'Resource {} has already been synced.'.format(name)
-            return ret
+            return _perf_ret(ret, perf)
     else:
         ret['comment'] = 'Resource {} is currently stop.'.format(name)
-        return ret
+        return _perf_ret(ret, perf)
 
     # Do nothing for test=True
     if __opts__['test']:
         ret['result'] = None
         ret['comment'] = 'Check {} whether be synced within {}.'.format(name, timeout)
         ret['changes']['name'] = name
-        return ret
+        return _perf_ret(ret, perf)
 
     try:
         # Do real job
         starttime = time.time()
+        verdict = {}
+        tracker = {}
+        sleep = 0
+
+        if events:
+            try:
+                verdict = __salt__['drbd.wait_sync_events'](
+                    name=name,
+                    timeout=timeout,
+                    **kwargs)
+            except CommandExecutionError as err:
+                LOGGER.warning('Fall back to poll the sync status: %s', six.text_type(err))
+            else:
+                if verdict['synced']:
+                    ret['changes']['name'] = name
+                    ret['comment'] = 'Resource {} is synced.'.format(name)
+                    ret['result'] = True
+                    return _perf_ret(ret, perf)
 
         while True:
 
-            if time.time() > starttime + timeout:
+            now = time.time()
+            if now > starttime + timeout:
                 ret['comment'] = 'Resource {} is not synced within {}s.'.format(
                     name, timeout)
+                lagging = _lagging_comment(verdict)
+                if lagging:
+                    ret['comment'] += ' Lagging: {}.'.format(lagging)
                 break
 
-            time.sleep(interval)
+            # Never sleep past the timeout
+            sleep = _next_poll(sleep, verdict, interval, starttime + timeout - now)
+            time.sleep(sleep)
 
-            result = __salt__['drbd.check_sync_status'](
+            # One status sample per poll, rate against the previous poll
+            verdict = __salt__['drbd.sync_progress'](
                 name=name,
+                interval=0,
                 **kwargs)
 
-            if result:
+            if verdict['synced']:
                 ret['changes']['name'] = name
                 ret['comment'] = 'Resource {} is synced.'.format(name)
                 ret['result'] = True
-                return ret
+                return _perf_ret(ret, perf)
+
+            if stall_timeout:
+                stalled = _stalled_volumes(tracker, verdict, now + sleep, stall_timeout)
+                if stalled:
+                    ret['comment'] = 'Resource {} sync stalled for {}s: {}.'.format(
+                        name, stall_timeout, ', '.join(stalled))
+                    break
+
+            remaining = starttime + timeout - now - sleep
+            eta = verdict.get('eta')
+            if eta_margin and eta is not None and 0 < remaining < eta / eta_margin:
+                ret['comment'] = 'Resource {} will not be synced within {}s, ETA {:.0f}s.'.format(
+                    name, timeout, eta)
+                ret['comment'] += ' Lagging: {}.'.format(_lagging_comment(verdict))
+                break
 
-        return ret
+        return _perf_ret(ret, perf)
 
     except CommandExecutionError as err:
         ret['comment'] = six.text_type(err)
-        return ret
+        return _perf_ret(ret, perf)
+
+
+def replication_healthy(name, max_lag=None, max_ap_in_flight=None, max_pending=None,
+                        max_unacked=None, allow_congested=True, allow_ahead=False,
+                        samples=3, interval=1, **kwargs):
+    '''
+    Check the replication of the DRBD resource keeps up with the writes,
+    sampled over a short window via drbd.replication_health.
+    Every peer node must be connected and within the thresholds.
+
+    name
+        Name of the DRBD resource.
+
+    max_lag
+        Maximum estimated seconds to replicate the data in flight.
+
+    max_ap_in_flight
+        Maximum KiB of application data in flight.
+
+    max_pending
+        Maximum pending requests.
+
+    max_unacked
+        Maximum requests not acknowledged by the peer.
+
+    allow_congested
+        Whether a congested connection is fine. Default: True
+
+    allow_ahead
+        Whether Ahead/Behind mode, entered due to ``on-congestion``,
+        is fine. Default: False
+
+    samples
+        Number of samples. Default: 3
+
+    interval
+        Seconds between samples. Default: 1
+
+    .. note::
+
+        All other arguements are passed to the module drbd.replication_health.
+
+    The thresholds are compared with the max of the samples.
+    '''
+    perf = _perf_begin()
+
+    ret = {
+        'name': name,
+        'result': False,
+        'changes': {},
+        'comment': '',
+    }
+
+    # Check resource exist
+    if _resource_not_exist(name):
+        ret['comment'] = 'Resource {} not defined in your config.'.format(name)
+        return _perf_ret(ret, perf)
+
+    try:
+        health = __salt__['drbd.replication_health'](
+            name=name,
+            samples=samples,
+            interval=interval,
+            **kwargs)
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return _perf_ret(ret, perf)
+
+    if not health['peer nodes']:
+        ret['comment'] = 'Resource {} has no peer node to replicate.'.format(name)
+        return _perf_ret(ret, perf)
+
+    problems = []
+    for peer, peer_health in sorted(health['peer nodes'].items()):
+        if peer_health['connection'] != 'Connected':
+            problems.append('{} is {}'.format(peer, peer_health['connection']))
+            continue
+
+        if peer_health['ahead/behind'] and not allow_ahead:
+            problems.append('{} went {}'.format(peer, peer_health['ahead/behind']))
+        if peer_health['congested'] and not allow_congested:
+            problems.append('{} congested'.format(peer))
+
+        for key, limit in (('ap-in-flight', max_ap_in_flight),
+                           ('pending', max_pending),
+                           ('unacked', max_unacked)):
+            if limit is not None and peer_health[key]['max'] > limit:
+                problems.append('{} {} {} > {}'.format(peer, key, peer_health[key]['max'], limit))
+
+        if max_lag is not None:
+            if peer_health['lag'] is None:
+                problems.append('{} lag unknown, nothing sent'.format(peer))
+            elif peer_health['lag'] > max_lag:
+                problems.append('{} lag {:.2f}s > {}s'.format(peer, peer_health['lag'], max_lag))
+
+    if problems:
+        ret['comment'] = 'Resource {} replication is unhealthy: {}.'.format(
+            name, ', '.join(problems))
+        return _perf_ret(ret, perf)
+
+    ret['result'] = True
+    ret['comment'] = 'Resource {} replication is healthy.'.format(name)
+    return _perf_ret(ret, perf)
+
+
+def all_synced(name, resources='*', interval=30, timeout=600, events=False, **kwargs):
+    '''
+    Query multiple drbd resources together until all of them are fully
+    synced. If not synced, will fail after timeout.
+
+    name:
+        Name of the state, not used as resource name.
+
+    resources:
+        List of resource names or glob patterns. Default: *
+        Patterns only match running resources, the resources named
+        must be defined and running.
+
+    interval:
+        Maximum interval to check the sync status. The first check is
+        after 1s, the interval doubles up to this value. Default: 30
+
+    timeout:
+        Timeout to wait progress. Default: 600
+
+    events:
+        Follow one ``drbdsetup events2`` for all resources instead of
+        checking every interval. Falls back to polling when events2 is
+        not usable. Default: False
+
+    .. note::
+
+        All other arguements are passed to the module drbd.sync_status_all.
+
+    The seconds each resource took to be synced are in the changes.
+    '''
+    perf = _perf_begin()
+
+    ret = {
+        'name': name,
+        'result': False,
+        'changes': {},
+        'comment': '',
+    }
+
+    if isinstance(resources, six.string_types):
+        resources = [resources]
+
+    named = [res for res in resources if not any(char in res for char in '*?[')]
+
+    # Check named resources exist
+    missing = [res for res in named if _resource_not_exist(res)]
+    if missing:
+        ret['comment'] = 'Resources {} not defined in your config.'.format(', '.join(missing))
+        return _perf_ret(ret, perf)
+
+    try:
+        # Check named resources are running
+        if named:
+            running = [res['resource name'] for res in
+                       __salt__['drbd.status'](name='all', cached=True) or []]
+            stopped_res = [res for res in named if res not in running]
+            if stopped_res:
+                ret['comment'] = 'Resources {} are currently stop.'.format(
+                    ', '.join(stopped_res))
+                return _perf_ret(ret, perf)
+
+        verdicts = __salt__['drbd.sync_status_all'](resources=resources, **kwargs)
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return _perf_ret(ret, perf)
+
+    if not verdicts:
+        ret['comment'] = 'No resource matches {}.'.format(', '.join(resources))
+        return _perf_ret(ret, perf)
+
+    names = sorted(verdicts)
+    pending = [res for res in names if not verdicts[res]['synced']]
+    if not pending:
+        ret['result'] = True
+        ret['comment'] = 'Resources {} have already been synced.'.format(', '.join(names))
+        return _perf_ret(ret, perf)
+
+    # Do nothing for test=True
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Check {} whether be synced within {}.'.format(
+            ', '.join(pending), timeout)
+        ret['changes'] = dict((res, {'synced': None}) for res in pending)
+        return _perf_ret(ret, perf)
+
+    try:
+        # Do real job
+        starttime = time.time()
+
+        if events:
+            try:
+                verdicts = __salt__['drbd.wait_sync_events_all'](
+                    names=list(pending),
+                    timeout=timeout,
+                    **kwargs)
+            except CommandExecutionError as err:
+                LOGGER.warning('Fall back to poll the sync status: %s', six.text_type(err))
+            else:
+                for res, verdict in verdicts.items():
+                    if res in pending and verdict['synced']:
+                        ret['changes'][res] = {'synced': True, 'seconds': verdict['seconds']}
+                        pending.remove(res)
+
+        sleep = 0
+        while pending:
+
+            now = time.time()
+            if now > starttime + timeout:
+                break
+
+            # Never sleep past the timeout, no single ETA for all resources
+            sleep = _next_poll(sleep, None, interval, starttime + timeout - now)
+            time.sleep(sleep)
+
+            # One status sample per poll for all resources
+            verdicts = __salt__['drbd.sync_status_all'](resources=list(pending), **kwargs)
+            checked = time.time()
+
+            for res, verdict in verdicts.items():
+                if res in pending and verdict['synced']:
+                    ret['changes'][res] = {'synced': True,
+                                           'seconds': checked - starttime}
+                    pending.remove(res)
+
+        if pending:
+            ret['comment'] = 'Resources {} are not synced within {}s.'.format(
+                ', '.join(pending), timeout)
+            return _perf_ret(ret, perf)
+
+        ret['comment'] = 'Resources {} are synced.'.format(', '.join(names))
+        ret['result'] = True
+        return _perf_ret(ret, perf)
+
+    except CommandExecutionError as err:
+        ret['comment'] = six.text_type(err)
+        return _perf_ret(ret, perf)
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+'''
+Some of the utils used by salt
+
+PLEASE DO NOT ADD ANY NEW FUNCTIONS TO THIS FILE.
+
+New functions should be organized in other files under salt/utils/. Please
+consult the dev team if you are unsure where a new function should go.
+'''
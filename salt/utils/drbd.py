@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+'''
+Utility functions shared by the drbd execution module and beacon
+
+.. versionadded:: pending
+
+:maintainer:    Nick Wang <nwang@suse.com>
+:maturity:      alpha
+:platform:      Linux
+'''
+from __future__ import absolute_import, print_function, unicode_literals
+
+from salt.ext import six
+
+# Replication states shown with ``done:`` in ``drbdadm status``
+SYNC_STATES = ('SyncSource', 'SyncTarget', 'PausedSyncS', 'PausedSyncT',
+               'VerifyS', 'VerifyT')
+
+
+class EventsState(object):
+    '''
+    Resource state rebuilt from the lines of ``drbdsetup events2``.
+
+    The initial state is reported by ``exists`` lines, terminated by
+    ``exists -``. Later ``create``, ``change`` and ``destroy`` lines
+    only carry the changed fields.
+    '''
+
+    def __init__(self):
+        self.resources = {}
+        self.complete = False
+
+    def feed(self, line):
+        '''
+        Apply one line.
+        Return (kind, resource name, key, old fields, new fields) of the
+        changed object, None for lines not changing any object.
+        '''
+        fields = line.split()
+        if len(fields) < 2:
+            return None
+
+        action, kind = fields[0], fields[1]
+        if kind == '-':
+            self.complete = True
+            return None
+
+        if kind not in ('resource', 'connection', 'device', 'peer-device'):
+            # Like 'call helper' or 'response helper'
+            return None
+
+        attrs = {}
+        for field in fields[2:]:
+            key, _, value = field.partition(':')
+            attrs[key] = value
+
+        name = attrs.get('name')
+        if name is None:
+            return None
+
+        if kind == 'resource':
+            key = None
+        elif kind == 'connection':
+            key = attrs.get('peer-node-id')
+        elif kind == 'device':
+            key = attrs.get('volume')
+        else:
+            key = (attrs.get('peer-node-id'), attrs.get('volume'))
+
+        resource = self.resources.setdefault(name, {
+            'resource': {None: {}},
+            'connection': {},
+            'device': {},
+            'peer-device': {},
+        })
+        objects = resource[kind]
+        old = objects.get(key, {})
+
+        if action == 'destroy':
+            objects.pop(key, None)
+            if kind == 'resource':
+                self.resources.pop(name, None)
+            return (kind, name, key, old, {})
+
+        new = dict(old)
+        new.update(attrs)
+        objects[key] = new
+
+        return (kind, name, key, old, new)
+
+    def to_status(self, name):
+        '''
+        Translate the state of a resource to the format of ``status``
+        '''
+        resource = self.resources.get(name)
+        if resource is None:
+            return None
+
+        ret = {
+            "resource name": name,
+            "local role": resource['resource'].get(None, {}).get('role'),
+            "local volumes": [],
+            "peer nodes": [],
+        }
+
+        for volume in sorted(resource['device'], key=six.text_type):
+            device = resource['device'][volume]
+            ret["local volumes"].append({'volume': volume, 'disk': device.get('disk')})
+
+        for node_id in sorted(resource['connection'], key=six.text_type):
+            connection = resource['connection'][node_id]
+            peernode = {"peernode name": connection.get('conn-name', node_id)}
+            peernode["peer volumes"] = []
+            if connection.get('connection') == 'Connected':
+                peernode['role'] = connection.get('role')
+            else:
+                # Like drbdadm status, no peer volumes when not connected
+                peernode['connection'] = connection.get('connection')
+                ret["peer nodes"].append(peernode)
+                continue
+
+            for (peer_id, volume), peer_device in sorted(
+                    resource['peer-device'].items(), key=lambda x: six.text_type(x[0])):
+                if peer_id != node_id:
+                    continue
+                vol = {'volume': volume, 'peer-disk': peer_device.get('peer-disk')}
+                for field in ('replication', 'done', 'resync-suspended'):
+                    if field in peer_device:
+                        vol[field] = peer_device[field]
+                peernode["peer volumes"].append(vol)
+
+            ret["peer nodes"].append(peernode)
+
+        return ret
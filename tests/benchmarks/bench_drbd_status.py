@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: Nick Wang <nwang@suse.com>
+
+Benchmarks of the drbd parsers on synthetic output of ``drbdadm status``,
+``drbdsetup status --json``, ``drbdadm dump-xml`` and ``drbd-overview``.
+
+Each parser is timed (best of --repeat runs) and its peak memory is
+measured with tracemalloc (python3 only). Use --json for machine readable
+results, to compare a change against its base.
+
+eg:
+  python3 -m tests.benchmarks.bench_drbd_status --resources 1000 --peers 3 --volumes 4
+  python3 -m tests.benchmarks.bench_drbd_status --only status status-json --json
+'''
+
+# Import Python libs
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import json
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+# Import Salt Testing Libs
+from tests.support.mock import patch
+
+# Import Salt Libs
+import salt.modules.drbd as drbd
+
+
+def make_status_output(resources=1000, peers=3, volumes=4):
+    '''
+    Generate ``drbdadm status all`` output, half of the peers are syncing
+    '''
+    lines = []
+    for res in range(resources):
+        lines.append('res{} role:Primary'.format(res))
+        for vol in range(volumes):
+            lines.append('  volume:{} disk:UpToDate'.format(vol))
+        for peer in range(peers):
+            lines.append('  node{} role:Secondary'.format(peer))
+            for vol in range(volumes):
+                if peer % 2:
+                    lines.append('    volume:{} replication:SyncSource '
+                                 'peer-disk:Inconsistent done:{}.17'.format(vol, vol * 10))
+                else:
+                    lines.append('    volume:{} peer-disk:UpToDate'.format(vol))
+        lines.append('')
+
+    return '\n'.join(lines)
+
+
+def make_json_status_output(resources=1000, peers=3, volumes=4):
+    '''
+    Generate ``drbdsetup status --statistics --json all`` output, half of
+    the peers are syncing
+    '''
+    result = []
+    for res in range(resources):
+        resource = {
+            'name': 'res{}'.format(res), 'node-id': 0, 'role': 'Primary',
+            'suspended': False, 'write-ordering': 'flush',
+            'devices': [], 'connections': [],
+        }
+        for vol in range(volumes):
+            resource['devices'].append({
+                'volume': vol, 'minor': res * volumes + vol, 'disk-state': 'UpToDate',
+                'client': False, 'quorum': True, 'size': 1048508, 'read': 1024,
+                'written': 4096, 'al-writes': 12, 'bm-writes': 3, 'upper-pending': 0,
+                'lower-pending': 0, 'al-suspended': False, 'blocked': 'no',
+            })
+        for peer in range(peers):
+            connection = {
+                'peer-node-id': peer + 1, 'name': 'node{}'.format(peer),
+                'connection-state': 'Connected', 'congested': False,
+                'peer-role': 'Secondary', 'ap-in-flight': 0, 'rs-in-flight': 0,
+                'peer_devices': [],
+            }
+            for vol in range(volumes):
+                syncing = peer % 2
+                connection['peer_devices'].append({
+                    'volume': vol,
+                    'replication-state': 'SyncSource' if syncing else 'Established',
+                    'peer-disk-state': 'Inconsistent' if syncing else 'UpToDate',
+                    'peer-client': False, 'resync-suspended': 'no', 'received': 0,
+                    'sent': 4096, 'out-of-sync': 1024 if syncing else 0, 'pending': 0,
+                    'unacked': 0, 'has-sync-details': False,
+                    'has-online-verify-details': False,
+                    'percent-in-sync': vol * 10 + 0.17 if syncing else 100.0,
+                })
+            resource['connections'].append(connection)
+        result.append(resource)
+
+    return json.dumps(result, indent=2)
+
+
+def make_dump_xml_output(resources=1000, peers=3, volumes=4):
+    '''
+    Generate ``drbdadm dump-xml all`` output, node0 is the local host
+    '''
+    lines = ['<config file="/etc/drbd.conf">', '   <common>', '   </common>']
+    for res in range(resources):
+        lines.append('   <resource name="res{0}" conf-file-line="/etc/drbd.d/res{0}.res:1">'
+                     .format(res))
+        for node in range(peers + 1):
+            lines.append('      <host name="node{}">'.format(node))
+            lines.append('         <node-id>{}</node-id>'.format(node))
+            for vol in range(volumes):
+                minor = res * volumes + vol
+                lines.extend([
+                    '         <volume vnr="{}">'.format(vol),
+                    '            <device minor="{0}">/dev/drbd{0}</device>'.format(minor),
+                    '            <disk>/dev/vg{}/res{}_{}</disk>'.format(node, res, vol),
+                    '            <meta-disk>internal</meta-disk>',
+                    '         </volume>',
+                ])
+            lines.append('         <address family="ipv4" port="{}">10.0.0.{}</address>'.format(
+                7000 + res, node + 1))
+            lines.append('      </host>')
+        lines.append('   </resource>')
+    lines.append('</config>')
+
+    return '\n'.join(lines)
+
+
+def make_overview_output(resources=1000, peers=1, volumes=4):
+    '''
+    Generate ``drbd-overview`` output, two nodes only so peers is unused.
+    Every other resource is syncing, the others are mounted.
+    '''
+    lines = []
+    for res in range(resources):
+        for vol in range(volumes):
+            minor = res * volumes + vol
+            if res % 2:
+                lines.append('{:>3}:res{}/{}  SyncSource Primary/Secondary '
+                             'UpToDate/Inconsistent'.format(minor, res, vol))
+                lines.append("\t[==>.................] sync'ed: 15.2% (1738/2044)M")
+            else:
+                lines.append('{:>3}:res{}/{}  Connected Primary/Secondary UpToDate/UpToDate '
+                             '/mnt/res{}_{} ext4 2.0G 6.1M 1.9G 1%'.format(
+                                 minor, res, vol, res, vol))
+
+    return '\n'.join(lines)
+
+
+def _json_status(text):
+    return [drbd._json_to_status(res) for res in json.loads(text)]
+
+
+def _setup_status(text):
+    '''
+    drbd.setup_status with text as the output of drbdsetup
+    '''
+    run_all = {'cmd.run_all': lambda cmd: {'retcode': 0, 'stdout': text, 'stderr': ''}}
+    with patch.object(drbd, '__salt__', run_all, create=True), \
+            patch.object(drbd, '__context__', {}, create=True):
+        return drbd.setup_status()
+
+
+def benchmarks(resources=1000, peers=3, volumes=4):
+    '''
+    Get the benchmarks as name: (input, parser, expected result length)
+    '''
+    status = make_status_output(resources, peers, volumes)
+    json_status = make_json_status_output(resources, peers, volumes)
+    dump_xml = make_dump_xml_output(resources, peers, volumes)
+    overview = make_overview_output(resources, peers, volumes)
+
+    status_lines = status.splitlines()
+    overview_lines = overview.splitlines()
+    json_resources = json.loads(json_status)
+
+    return {
+        'status': (status, lambda: drbd._StatusParser().parse(status_lines), resources),
+        'status-json': (json_status, lambda: _json_status(json_status), resources),
+        'status-index': (status,
+                         lambda: drbd._index_status(drbd._StatusParser().parse(status_lines)),
+                         resources),
+        'setup_status': (json_status, lambda: _setup_status(json_status), resources),
+        'statistics': (json_status, lambda: drbd._statistics_records(json_resources),
+                       resources * (volumes + peers + peers * volumes)),
+        'prometheus': (json_status, lambda: drbd._prometheus_lines(json_resources), None),
+        'dump-xml': (dump_xml,
+                     lambda: drbd._parse_config_index(dump_xml, 'node0')['resources'],
+                     resources),
+        'overview': (overview,
+                     lambda: [device for device in map(drbd._parse_overview_line,
+                                                       overview_lines) if device],
+                     resources * volumes),
+        'overview-json': (json_status,
+                          lambda: drbd._overview_from_status(_json_status(json_status)),
+                          resources * volumes),
+    }
+
+
+def _peak_memory(func):
+    '''
+    Peak memory in bytes allocated while running func once
+    '''
+    if tracemalloc is None:  # pragma: no cover
+        return None
+
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(names=None, resources=1000, peers=3, volumes=4, repeat=5):
+    '''
+    Run the benchmarks, return one result dict per benchmark
+    '''
+    suite = benchmarks(resources, peers, volumes)
+    results = []
+
+    for name in names or sorted(suite):
+        text, func, expected = suite[name]
+
+        parsed = func()
+        if expected is not None:
+            assert len(parsed) == expected, '{}: {} != {}'.format(name, len(parsed), expected)
+
+        best = min(timeit.repeat(func, repeat=repeat, number=1))
+        results.append({
+            'benchmark': name,
+            'resources': resources,
+            'peers': peers,
+            'volumes': volumes,
+            'input lines': text.count('\n') + 1,
+            'input bytes': len(text),
+            'repeat': repeat,
+            'best seconds': best,
+            'peak bytes': _peak_memory(func),
+        })
+
+    return results
+
+
+def main():
+    '''
+    Parse the synthetic output several times and report the best run
+    '''
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resources', type=int, default=1000)
+    parser.add_argument('--peers', type=int, default=3)
+    parser.add_argument('--volumes', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', metavar='BENCHMARK',
+                        choices=sorted(benchmarks(1, 1, 1)),
+                        help='Benchmarks to run, default all')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as json')
+    args = parser.parse_args()
+
+    results = run(args.only, args.resources, args.peers, args.volumes, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    print('{} resources, {} peers, {} volumes, best of {}'.format(
+        args.resources, args.peers, args.volumes, args.repeat))
+    for result in results:
+        peak = result['peak bytes']
+        print('{:<14} {:>9} lines {:>9.4f}s {:>12.0f} lines/s {:>10} KiB peak'.format(
+            result['benchmark'], result['input lines'], result['best seconds'],
+            result['input lines'] / result['best seconds'],
+            peak // 1024 if peak is not None else '-'))
+
+
+if __name__ == '__main__':
+    main()
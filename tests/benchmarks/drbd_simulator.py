@@ -0,0 +1,545 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: Nick Wang <nwang@suse.com>
+
+Simulated drbd-utils, to run the drbd module and states end to end
+without a DRBD cluster.
+
+``init`` creates a simulated cluster in a state file and installs
+``drbdadm`` and ``drbdsetup`` wrappers in a bin directory. Once the bin
+directory is first in PATH, every call runs this script, which reads and
+updates the state file. The local node is this host, the peers are
+simulated: they connect on ``up`` and follow the local node.
+
+Supported commands:
+
+  drbdadm --version | status | dump | dump-xml | create-md | get-gi | up |
+          down | primary [--force] | secondary | adjust | -d adjust |
+          new-current-uuid [--clear-bitmap]
+  drbdsetup status --json [--statistics] | events2
+
+``-d adjust`` plans the commands bringing up the down resources with
+metadata, the configuration of running resources never differs.
+
+Resync runs at --rate percent per second, after ``primary --force`` or
+``adjust`` of an UpToDate resource with Inconsistent peers. Every call is
+counted, ``stats`` shows the counts.
+
+eg:
+  python3 -m tests.benchmarks.drbd_simulator init --resources 1000 --preset created
+  export PATH=/tmp/drbd-simulator/bin:$PATH
+  salt-call --local state.apply drbd-provision
+  python3 -m tests.benchmarks.drbd_simulator stats
+'''
+
+# Import Python libs
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import platform
+import stat
+import sys
+import time
+
+DEFAULT_DIR = '/tmp/drbd-simulator'
+STATE_ENV = 'DRBD_SIMULATOR_STATE'
+
+VERSION = '''DRBDADM_BUILDTAG=GIT-hash:\\ simulator
+DRBDADM_API_VERSION=2
+DRBD_KERNEL_VERSION_CODE=0x090111
+DRBD_KERNEL_VERSION=9.1.17
+DRBDADM_VERSION_CODE=0x091a00
+DRBDADM_VERSION=9.26.0'''
+
+# Size of every simulated volume in KiB
+VOLUME_SIZE = 1048508
+
+
+def _state_path():
+    return os.environ.get(STATE_ENV, os.path.join(DEFAULT_DIR, 'state.json'))
+
+
+@contextlib.contextmanager
+def _model(write=True):
+    '''
+    Load the model under the state file lock, save it back when done.
+    A failing command is saved too, like drbdadm the targets before the
+    failure are applied and the call is counted.
+    '''
+    path = _state_path()
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+        with open(path) as state:
+            model = json.load(state)
+
+        _settle(model, time.time())
+        failure = None
+        try:
+            yield model
+        except _Failure as err:
+            failure = err
+
+        if write:
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as state:
+                json.dump(model, state)
+            os.rename(tmp, path)
+
+        if failure is not None:
+            raise failure
+
+
+def _new_model(resources, peers, volumes, nodename, rate, preset):
+    model = {'nodename': nodename, 'rate': rate, 'calls': {}, 'resources': {}}
+
+    for res in range(resources):
+        name = 'res{}'.format(res)
+        synced = preset == 'synced'
+        model['resources'][name] = {
+            'peers': ['{}-peer{}'.format(nodename, peer + 1) for peer in range(peers)],
+            'volumes': [{
+                'minor': res * volumes + vol,
+                'disk': '/dev/drbdsim/{}_{}'.format(name, vol),
+                'md': preset != 'new',
+                'uuid': '{:016X}'.format((res * volumes + vol + 1) * 0x9E3779B97F4A7C15 %
+                                         (1 << 64)) if preset != 'new' else None,
+                'disk-state': 'UpToDate' if synced else 'Inconsistent',
+                'peer-disk': 'UpToDate' if synced else 'Inconsistent',
+                'sync': None,
+            } for vol in range(volumes)],
+            'up': preset in ('up', 'synced'),
+            'up since': time.time(),
+            'role': 'Secondary',
+        }
+
+    return model
+
+
+def _settle(model, now):
+    '''
+    Finish the resyncs done by now
+    '''
+    for res in model['resources'].values():
+        for vol in res['volumes']:
+            if vol['sync'] and _done(model, vol, now) >= 100:
+                vol['sync'] = None
+                vol['peer-disk'] = 'UpToDate'
+
+
+def _done(model, vol, now):
+    return min(100.0, vol['sync'][1] + model['rate'] * (now - vol['sync'][0]))
+
+
+def _start_sync(res, now):
+    for vol in res['volumes']:
+        if vol['disk-state'] == 'UpToDate' and vol['peer-disk'] == 'Inconsistent' and \
+                res['peers'] and not vol['sync']:
+            vol['sync'] = [now, 0.0]
+
+
+def _targets(model, arg):
+    '''
+    Resolve 'all', 'res' or 'res/vnr' to (name, resource, volumes)
+    '''
+    if arg == 'all':
+        return [(name, res, res['volumes']) for name, res in sorted(model['resources'].items())]
+
+    name, _, vnr = arg.partition('/')
+    res = model['resources'].get(name)
+    if res is None:
+        raise _Failure(10, "'{}' not defined in your config (for this host).".format(name))
+    if vnr:
+        return [(name, res, [res['volumes'][int(vnr)]])]
+    return [(name, res, res['volumes'])]
+
+
+class _Failure(Exception):
+    def __init__(self, code, message):
+        super(_Failure, self).__init__(message)
+        self.code = code
+
+
+def _status_text(model, name, res, now):
+    lines = ['{} role:{}'.format(name, res['role'])]
+    single = len(res['volumes']) == 1
+
+    for vnr, vol in enumerate(res['volumes']):
+        lines.append('  {}disk:{}'.format('' if single else 'volume:{} '.format(vnr),
+                                          vol['disk-state']))
+    for peer in res['peers']:
+        lines.append('  {} role:Secondary'.format(peer))
+        for vnr, vol in enumerate(res['volumes']):
+            fields = [] if single else ['volume:{}'.format(vnr)]
+            if vol['sync']:
+                fields.append('replication:SyncSource')
+            fields.append('peer-disk:{}'.format(vol['peer-disk']))
+            if vol['sync']:
+                fields.append('done:{:.2f}'.format(_done(model, vol, now)))
+            lines.append('    ' + ' '.join(fields))
+    lines.append('')
+
+    return lines
+
+
+def _status_json(model, name, res, now, statistics):
+    elapsed = now - res['up since']
+    resource = {
+        'name': name, 'node-id': 0, 'role': res['role'], 'suspended': False,
+        'write-ordering': 'flush', 'devices': [], 'connections': [],
+    }
+
+    for vnr, vol in enumerate(res['volumes']):
+        device = {'volume': vnr, 'minor': vol['minor'], 'disk-state': vol['disk-state'],
+                  'client': False, 'quorum': True}
+        if statistics:
+            device.update({'size': VOLUME_SIZE, 'read': 0, 'written': int(elapsed) * 64,
+                           'al-writes': int(elapsed), 'bm-writes': 0, 'upper-pending': 0,
+                           'lower-pending': 0, 'al-suspended': False, 'blocked': 'no'})
+        resource['devices'].append(device)
+
+    for peer_id, peer in enumerate(res['peers'], 1):
+        connection = {'peer-node-id': peer_id, 'name': peer, 'connection-state': 'Connected',
+                      'congested': False, 'peer-role': 'Secondary', 'peer_devices': []}
+        if statistics:
+            connection.update({'ap-in-flight': 0, 'rs-in-flight': 0})
+        for vnr, vol in enumerate(res['volumes']):
+            done = _done(model, vol, now) if vol['sync'] else (
+                100.0 if vol['peer-disk'] == 'UpToDate' else 0.0)
+            peer_device = {
+                'volume': vnr,
+                'replication-state': 'SyncSource' if vol['sync'] else 'Established',
+                'peer-disk-state': vol['peer-disk'], 'peer-client': False,
+                'resync-suspended': 'no', 'percent-in-sync': round(done, 2),
+            }
+            if statistics:
+                peer_device.update({
+                    'received': 0, 'sent': int(VOLUME_SIZE * done / 100), 'pending': 0,
+                    'unacked': 0, 'out-of-sync': int(VOLUME_SIZE * (100 - done) / 100),
+                    'has-sync-details': bool(vol['sync']),
+                    'has-online-verify-details': False,
+                })
+            connection['peer_devices'].append(peer_device)
+        resource['connections'].append(connection)
+
+    return resource
+
+
+def _dump_xml(model):
+    lines = ['<config file="/etc/drbd.conf">', '   <common>', '   </common>']
+
+    for name, res in sorted(model['resources'].items()):
+        lines.append('   <resource name="{0}" conf-file-line="/etc/drbd.d/{0}.res:1">'.format(
+            name))
+        for node_id, host in enumerate([model['nodename']] + res['peers']):
+            lines.append('      <host name="{}">'.format(host))
+            lines.append('         <node-id>{}</node-id>'.format(node_id))
+            for vnr, vol in enumerate(res['volumes']):
+                lines.extend([
+                    '         <volume vnr="{}">'.format(vnr),
+                    '            <device minor="{0}">/dev/drbd{0}</device>'.format(vol['minor']),
+                    '            <disk>{}</disk>'.format(vol['disk']),
+                    '            <meta-disk>internal</meta-disk>',
+                    '         </volume>',
+                ])
+            lines.append('         <address family="ipv4" port="7789">10.0.0.{}</address>'.format(
+                node_id + 1))
+            lines.append('      </host>')
+        lines.append('   </resource>')
+    lines.append('</config>')
+
+    return lines
+
+
+def _events_objects(model, now, target='all'):
+    '''
+    Objects of drbdsetup events2 for the target resource, as
+    {(kind, identity): fields}
+    '''
+    objects = {}
+
+    for name, res in model['resources'].items():
+        if not res['up'] or target not in ('all', name):
+            continue
+
+        objects[('resource', ('name:' + name,))] = {'role': res['role'], 'suspended': 'no'}
+        for vnr, vol in enumerate(res['volumes']):
+            objects[('device', ('name:' + name, 'volume:{}'.format(vnr),
+                                'minor:{}'.format(vol['minor'])))] = {
+                                    'disk': vol['disk-state']}
+        for peer_id, peer in enumerate(res['peers'], 1):
+            conn = ('name:' + name, 'peer-node-id:{}'.format(peer_id), 'conn-name:' + peer)
+            objects[('connection', conn)] = {'connection': 'Connected', 'role': 'Secondary'}
+            for vnr, vol in enumerate(res['volumes']):
+                objects[('peer-device', conn + ('volume:{}'.format(vnr),))] = {
+                    'replication': 'SyncSource' if vol['sync'] else 'Established',
+                    'peer-disk': vol['peer-disk'],
+                }
+
+    return objects
+
+
+def _event_line(action, key, fields):
+    kind, identity = key
+    return ' '.join([action, kind] + list(identity) +
+                    ['{}:{}'.format(field, value) for field, value in sorted(fields.items())])
+
+
+def _events2(target='all', interval=0.2):
+    '''
+    Print the current state of the target resource, then the changes
+    until killed
+    '''
+    with _model(write=False) as model:
+        objects = _events_objects(model, time.time(), target)
+
+    for key in sorted(objects):
+        print(_event_line('exists', key, objects[key]))
+    print('exists -')
+    sys.stdout.flush()
+
+    while True:
+        time.sleep(interval)
+        # Read only, the finished resyncs are settled again by every
+        # command loading the model, nothing to save here
+        with _model(write=False) as model:
+            current = _events_objects(model, time.time(), target)
+
+        lines = []
+        for key in sorted(set(objects) | set(current)):
+            if key not in current:
+                lines.append(_event_line('destroy', key, {}))
+            elif key not in objects:
+                lines.append(_event_line('create', key, current[key]))
+            elif current[key] != objects[key]:
+                lines.append(_event_line('change', key, dict(
+                    (field, value) for field, value in current[key].items()
+                    if objects[key].get(field) != value)))
+        objects = current
+
+        if lines:
+            print('\n'.join(lines))
+            sys.stdout.flush()
+
+
+def _adjust_plan(name, res):
+    '''
+    Commands printed by drbdadm -d adjust to bring a down resource up
+    '''
+    lines = ['drbdsetup new-resource {} 0'.format(name)]
+    for vnr, vol in enumerate(res['volumes']):
+        lines.append('drbdsetup new-minor {} {} {}'.format(name, vol['minor'], vnr))
+    for peer_id, peer in enumerate(res['peers'], 1):
+        lines.append('drbdsetup new-peer {} {} --_name={} --protocol=C'.format(
+            name, peer_id, peer))
+        lines.append('drbdsetup new-path {} {} ipv4:10.0.0.1:7789 ipv4:10.0.0.{}:7789'.format(
+            name, peer_id, peer_id + 1))
+    for vol in res['volumes']:
+        lines.append('drbdmeta {0} v09 {1} internal apply-al'.format(vol['minor'], vol['disk']))
+        lines.append('drbdsetup attach {0} {1} {1} internal'.format(vol['minor'], vol['disk']))
+    for peer_id, _ in enumerate(res['peers'], 1):
+        lines.append('drbdsetup connect {} {}'.format(name, peer_id))
+
+    return lines
+
+
+def drbdadm(args):
+    '''
+    Run a simulated drbdadm command, return (retcode, stdout lines)
+    '''
+    options = [arg for arg in args if arg.startswith('-')]
+    args = [arg for arg in args if not arg.startswith('-')]
+
+    if '--version' in options:
+        return 0, VERSION.splitlines()
+
+    command, targets = args[0], args[1:] or ['all']
+    out = []
+    now = time.time()
+
+    with _model() as model:
+        model['calls']['drbdadm ' + command] = model['calls'].get('drbdadm ' + command, 0) + 1
+
+        if command == 'dump-xml':
+            return 0, _dump_xml(model)
+
+        for target in targets:
+            for name, res, volumes in _targets(model, target):
+                if command == 'status':
+                    if not res['up']:
+                        if target == 'all':
+                            continue
+                        raise _Failure(10, '{}: No such resource'.format(name))
+                    out.extend(_status_text(model, name, res, now))
+                elif command == 'dump':
+                    out.append('resource {} {{'.format(name))
+                    out.append('}')
+                elif command == 'create-md':
+                    if res['up']:
+                        raise _Failure(20, 'Device is configured!')
+                    for vol in volumes:
+                        vol.update({'md': True, 'disk-state': 'Inconsistent',
+                                    'peer-disk': 'Inconsistent', 'sync': None,
+                                    'uuid': '{:016X}'.format(int(now * 1e6) + vol['minor'])})
+                    out.append('New drbd meta data block successfully created.')
+                elif command == 'get-gi':
+                    for vol in volumes:
+                        if not vol['md']:
+                            raise _Failure(255, 'No valid meta data found')
+                        out.append('{}:0000000000000000:0000000000000000:'
+                                   '0000000000000000:1:1:0:1:0:0:0'.format(vol['uuid']))
+                elif command == 'up':
+                    if not all(vol['md'] for vol in res['volumes']):
+                        raise _Failure(10, 'No valid meta data found')
+                    if not res['up']:
+                        res.update({'up': True, 'up since': now})
+                        _start_sync(res, now)
+                elif command == 'down':
+                    res.update({'up': False, 'role': 'Secondary'})
+                    for vol in res['volumes']:
+                        vol['sync'] = None
+                elif command == 'primary':
+                    if not res['up']:
+                        raise _Failure(10, '{}: No such resource'.format(name))
+                    if any(vol['disk-state'] != 'UpToDate' for vol in res['volumes']):
+                        if '--force' not in options:
+                            raise _Failure(17, 'State change failed: (-2) Need access to '
+                                               'UpToDate data')
+                        for vol in res['volumes']:
+                            vol['disk-state'] = 'UpToDate'
+                    res['role'] = 'Primary'
+                    _start_sync(res, now)
+                elif command == 'secondary':
+                    res['role'] = 'Secondary'
+                elif command == 'adjust':
+                    if '-d' in options:
+                        # Dry run, only a down resource differs from its configuration
+                        if not res['up'] and all(vol['md'] for vol in res['volumes']):
+                            out.extend(_adjust_plan(name, res))
+                        continue
+                    if not res['up'] and all(vol['md'] for vol in res['volumes']):
+                        res.update({'up': True, 'up since': now})
+                    _start_sync(res, now)
+                elif command == 'new-current-uuid':
+                    for vol in volumes:
+                        vol['uuid'] = '{:016X}'.format(int(now * 1e6) + vol['minor'])
+                        if '--clear-bitmap' in options and res['up'] and \
+                                vol['disk-state'] == vol['peer-disk'] == 'Inconsistent':
+                            vol['disk-state'] = vol['peer-disk'] = 'UpToDate'
+                else:
+                    raise _Failure(20, 'Unknown command {}'.format(command))
+
+    return 0, out
+
+
+def drbdsetup(args):
+    '''
+    Run a simulated drbdsetup command, return (retcode, stdout lines)
+    '''
+    options = [arg for arg in args if arg.startswith('-')]
+    args = [arg for arg in args if not arg.startswith('-')]
+    command, target = args[0], (args[1:] or ['all'])[0]
+
+    with _model() as model:
+        model['calls']['drbdsetup ' + command] = \
+            model['calls'].get('drbdsetup ' + command, 0) + 1
+
+        if command == 'status' and '--json' in options:
+            # Unlike drbdadm, drbdsetup only knows the running resources
+            res = model['resources'].get(target)
+            if target != 'all' and (res is None or not res['up']):
+                raise _Failure(10, '{}: No such resource'.format(target))
+
+            now = time.time()
+            resources = [_status_json(model, name, res, now, '--statistics' in options)
+                         for name, res, _ in _targets(model, target) if res['up']]
+            return 0, json.dumps(resources, indent=2).splitlines()
+
+    if command == 'events2':
+        _events2(target)
+
+    raise _Failure(20, 'Unsupported drbdsetup command {} {}'.format(command, options))
+
+
+def init(args):
+    '''
+    Create the simulated cluster and install the wrappers
+    '''
+    bindir = os.path.join(args.dir, 'bin')
+    if not os.path.isdir(bindir):
+        os.makedirs(bindir)
+
+    state = os.path.join(args.dir, 'state.json')
+    with open(state, 'w') as model:
+        json.dump(_new_model(args.resources, args.peers, args.volumes, args.nodename,
+                             args.rate, args.preset), model)
+
+    for tool in ('drbdadm', 'drbdsetup'):
+        wrapper = os.path.join(bindir, tool)
+        with open(wrapper, 'w') as script:
+            script.write('#!/bin/sh\n{}={} exec {} {} {} "$@"\n'.format(
+                STATE_ENV, state, sys.executable, os.path.abspath(__file__), tool))
+        os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR | stat.S_IXGRP |
+                 stat.S_IXOTH)
+
+    print('{} resources simulated in {}, run:'.format(args.resources, state))
+    print('  export PATH={}:$PATH'.format(bindir))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv and argv[0] in ('drbdadm', 'drbdsetup'):
+        try:
+            code, out = (drbdadm if argv[0] == 'drbdadm' else drbdsetup)(argv[1:])
+        except _Failure as err:
+            sys.stderr.write('{}\n'.format(err))
+            return err.code
+        if out:
+            print('\n'.join(out))
+        return code
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+
+    parser_init = commands.add_parser('init', help='Create the simulated cluster')
+    parser_init.add_argument('--dir', default=DEFAULT_DIR)
+    parser_init.add_argument('--resources', type=int, default=1000)
+    parser_init.add_argument('--peers', type=int, default=1)
+    parser_init.add_argument('--volumes', type=int, default=1)
+    parser_init.add_argument('--nodename', default=platform.node())
+    parser_init.add_argument('--rate', type=float, default=10.0,
+                             help='Resync speed in percent per second')
+    parser_init.add_argument('--preset', default='new',
+                             choices=('new', 'created', 'up', 'synced'),
+                             help='new: no metadata, created: metadata created, '
+                                  'up: resources up but not synced, synced: all UpToDate')
+
+    parser_stats = commands.add_parser('stats', help='Show the number of calls per command')
+    parser_stats.add_argument('--dir', default=None,
+                              help='Default ${} or {}'.format(STATE_ENV, DEFAULT_DIR))
+    parser_stats.add_argument('--reset', action='store_true',
+                              help='Reset the counts once shown')
+
+    args = parser.parse_args(argv)
+    if args.command == 'init':
+        init(args)
+    elif args.command == 'stats':
+        if args.dir:
+            os.environ[STATE_ENV] = os.path.join(args.dir, 'state.json')
+        with _model(write=args.reset) as model:
+            print(json.dumps(model['calls'], indent=2, sort_keys=True))
+            if args.reset:
+                model['calls'] = {}
+    else:
+        parser.print_help()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: Nick Wang <nwang@suse.com>
+
+Smoke test of the simulated drbd-utils
+'''
+
+# Import Python libs
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+# Import Salt Testing Libs
+from tests.support.unit import TestCase
+from tests.support.mock import patch
+
+# Import simulator
+import tests.benchmarks.drbd_simulator as simulator
+
+
+class DrbdSimulatorTestCase(TestCase):
+    '''
+    Test cases for tests.benchmarks.drbd_simulator
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.state = os.path.join(self.tmpdir, 'state.json')
+        with patch('sys.stdout'):
+            simulator.main(['init', '--dir', self.tmpdir, '--resources', '2',
+                            '--nodename', 'node1', '--preset', 'created', '--rate', '100'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, *args):
+        proc = subprocess.Popen([os.path.join(self.tmpdir, 'bin', args[0])] + list(args[1:]),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        return proc.returncode, out.decode(), err.decode()
+
+    def test_commands(self):
+        '''
+        Test the wrappers run the simulated commands against the state file
+        '''
+        assert self._run('drbdadm', 'status') == (0, '', '')
+        assert self._run('drbdadm', 'up', 'res0')[0] == 0
+
+        retcode, out, _ = self._run('drbdadm', 'status', 'res0')
+        assert retcode == 0
+        assert out.startswith('res0 role:Secondary')
+
+        retcode, out, _ = self._run('drbdsetup', 'status', '--json')
+        assert retcode == 0
+        assert [res['name'] for res in json.loads(out)] == ['res0']
+
+        retcode, out, _ = self._run('drbdsetup', 'status', '--json', 'res0')
+        assert retcode == 0
+        assert json.loads(out)[0]['name'] == 'res0'
+
+        # Like drbdsetup, down and unknown resources are errors
+        assert self._run('drbdsetup', 'status', '--json', 'res1') == (
+            10, '', 'res1: No such resource\n')
+        assert self._run('drbdsetup', 'status', '--json', 'wuhan')[0] == 10
+        assert self._run('drbdadm', 'status', 'res1')[0] == 10
+
+        with patch.dict(os.environ, {simulator.STATE_ENV: self.state}):
+            with simulator._model(write=False) as model:
+                assert model['calls'] == {'drbdadm status': 3, 'drbdadm up': 1,
+                                          'drbdsetup status': 4}
+
+    def test_events2(self):
+        '''
+        Test events2 only prints the requested resource and never saves
+        the state file while following
+        '''
+        assert self._run('drbdadm', 'up', 'res0', 'res1')[0] == 0
+
+        proc = subprocess.Popen([os.path.join(self.tmpdir, 'bin', 'drbdsetup'),
+                                 'events2', 'res1'], stdout=subprocess.PIPE)
+        lines = []
+        while not lines or lines[-1] != 'exists -':
+            lines.append(proc.stdout.readline().decode().rstrip('\n'))
+
+        # The call is counted once started, then the model is only read
+        mtime = os.stat(self.state).st_mtime
+        time.sleep(0.5)
+        proc.terminate()
+        proc.communicate()
+        assert os.stat(self.state).st_mtime == mtime
+
+        assert lines[0].startswith('exists connection name:res1 ')
+        assert all('name:res1 ' in line for line in lines[:-1])
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: Nick Wang <nwang@suse.com>
+'''
+
+# Import Python libs
+from __future__ import absolute_import, print_function, unicode_literals
+
+import subprocess
+
+# Import Salt Testing Libs
+from tests.support.mixins import LoaderModuleMockMixin
+from tests.support.unit import TestCase, skipIf
+from tests.support.mock import (
+    MagicMock,
+    patch,
+    NO_MOCK,
+    NO_MOCK_REASON
+)
+
+# Import Salt Libs
+import salt.beacons.drbd as drbd
+import salt.utils.drbd
+
+EVENTS2 = '''exists resource name:beijing role:Secondary suspended:no write-ordering:flush
+exists connection name:beijing peer-node-id:2 conn-name:node2 connection:Connected role:Primary
+exists device name:beijing volume:0 minor:5 disk:Inconsistent client:no quorum:yes
+exists peer-device name:beijing peer-node-id:2 conn-name:node2 volume:0 replication:Established \
+peer-disk:UpToDate peer-client:no resync-suspended:no
+exists connection name:tianjin peer-node-id:2 conn-name:node2 connection:Connected role:Primary
+exists -'''.splitlines()
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class DrbdBeaconTestCase(TestCase, LoaderModuleMockMixin):
+    '''
+    Test cases for salt.beacons.drbd
+    '''
+    def setup_loader_modules(self):
+        return {drbd: {'__context__': {}}}
+
+    def test_validate(self):
+        '''
+        Test the beacon configuration validation
+        '''
+        assert drbd.validate({}) == (False, 'Configuration for drbd beacon must be a list.')
+        assert drbd.validate([{'resources': 'beijing'}]) == (
+            False, 'Resources for drbd beacon must be a list.')
+        assert drbd.validate([{'resources': ['beijing']}]) == (
+            True, 'Valid beacon configuration')
+        assert drbd.validate([]) == (True, 'Valid beacon configuration')
+
+    def test_process_line(self):
+        '''
+        Test only the transitions fire events
+        '''
+        state = salt.utils.drbd.EventsState()
+        for line in EVENTS2:
+            assert drbd._process_line(line, state) == []
+
+        # Sync starts
+        ret = drbd._process_line(
+            'change peer-device name:beijing peer-node-id:2 conn-name:node2 volume:0 '
+            'replication:SyncTarget', state)
+        assert ret == [{'tag': 'beijing/resync', 'resource name': 'beijing',
+                        'peernode name': 'node2', 'volume': '0', 'resync': 'started',
+                        'old': 'Established', 'new': 'SyncTarget'}]
+
+        # No transition
+        assert drbd._process_line(
+            'change peer-device name:beijing peer-node-id:2 conn-name:node2 volume:0 '
+            'resync-suspended:no', state) == []
+
+        # Sync finishes
+        ret = drbd._process_line(
+            'change device name:beijing volume:0 disk:UpToDate', state)
+        assert ret == [{'tag': 'beijing/disk', 'resource name': 'beijing', 'volume': '0',
+                        'old': 'Inconsistent', 'new': 'UpToDate'}]
+        ret = drbd._process_line(
+            'change peer-device name:beijing peer-node-id:2 conn-name:node2 volume:0 '
+            'replication:Established', state)
+        assert ret[0]['resync'] == 'finished'
+
+        # Role change
+        ret = drbd._process_line('change resource name:beijing role:Primary', state)
+        assert ret == [{'tag': 'beijing/role', 'resource name': 'beijing',
+                        'old': 'Secondary', 'new': 'Primary'}]
+
+        # Connection loss
+        line = ('change connection name:tianjin peer-node-id:2 conn-name:node2 '
+                'connection:Connecting role:Unknown')
+        ret = drbd._process_line(line, state)
+        assert ret == [{'tag': 'tianjin/peer-role', 'resource name': 'tianjin',
+                        'peernode name': 'node2', 'old': 'Primary', 'new': 'Unknown'},
+                       {'tag': 'tianjin/connection', 'resource name': 'tianjin',
+                        'peernode name': 'node2', 'old': 'Connected', 'new': 'Connecting'}]
+
+        # Recovery, filtered by resources but still tracked
+        line = ('change connection name:tianjin peer-node-id:2 conn-name:node2 '
+                'connection:Connected role:Primary')
+        assert drbd._process_line(line, state, resources=['beijing']) == []
+        assert state.to_status('tianjin')['peer nodes'][0]['role'] == 'Primary'
+
+        # Online verify, same sync states as the drbd module
+        ret = drbd._process_line(
+            'change peer-device name:beijing peer-node-id:2 conn-name:node2 volume:0 '
+            'replication:VerifyS', state)
+        assert ret[0]['resync'] == 'started'
+
+        # Helper calls are ignored
+        assert drbd._process_line('call helper name:beijing volume:0 '
+                                  'helper:before-resync-target', state) == []
+
+    def test_read_lines(self):
+        '''
+        Test the lines are read without blocking
+        '''
+        proc = subprocess.Popen(['printf', 'a\\nb\\nc'], stdout=subprocess.PIPE)
+        proc.wait()
+        reader = {'proc': proc, 'buffer': b'', 'state': None, 'exited': False}
+
+        assert drbd._read_lines(reader) == ['a', 'b']
+        assert reader['exited']
+        assert reader['buffer'] == b'c'
+        drbd._stop_reader(reader)
+
+    def test_beacon(self):
+        '''
+        Test the reader is kept and restarted after exit
+        '''
+        reader = {'proc': MagicMock(), 'buffer': b'',
+                  'state': salt.utils.drbd.EventsState(), 'exited': False}
+        mock_start = MagicMock(return_value=reader)
+        mock_stop = MagicMock()
+
+        def read_lines(lines, exited=False):
+            def read(reader):
+                reader['exited'] = exited
+                return lines
+            return read
+
+        with patch.object(drbd, '_start_reader', mock_start), \
+                patch.object(drbd, '_stop_reader', mock_stop):
+            with patch.object(drbd, '_read_lines', read_lines(EVENTS2)):
+                assert drbd.beacon([]) == []
+
+            with patch.object(drbd, '_read_lines', read_lines(
+                    ['change resource name:beijing role:Primary'], exited=True)):
+                assert drbd.beacon([{'resources': ['beijing']}]) == [
+                    {'tag': 'beijing/role', 'resource name': 'beijing',
+                     'old': 'Secondary', 'new': 'Primary'}]
+
+            mock_start.assert_called_once_with()
+            mock_stop.assert_called_once_with(reader)
+            assert 'drbd.events2' not in drbd.__context__
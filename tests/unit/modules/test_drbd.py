@@ -7,6 +7,13 @@
 # Import Python libs
 from __future__ import absolute_import, print_function, unicode_literals
 
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
 from salt import exceptions
 
 # Import Salt Testing Libs
@@ -14,6 +21,7 @@ from tests.support.mixins import LoaderModuleMockMixin
 from tests.support.unit import TestCase, skipIf
 from tests.support.mock import (
     MagicMock,
+    call,
     patch,
     NO_MOCK,
     NO_MOCK_REASON
@@ -21,6 +29,54 @@ from tests.support.mock import (
 
 # Import Salt Libs
 import salt.modules.drbd as drbd
+import salt.utils.files
+import salt.utils.json
+
+EVENTS2_SYNCING = '''exists resource name:beijing role:Primary suspended:no write-ordering:flush
+exists connection name:beijing peer-node-id:2 conn-name:node2 connection:Connected role:Secondary
+exists device name:beijing volume:0 minor:5 disk:UpToDate client:no quorum:yes
+exists peer-device name:beijing peer-node-id:2 conn-name:node2 volume:0 replication:SyncSource \
+peer-disk:Inconsistent peer-client:no resync-suspended:no
+exists -'''.splitlines()
+
+DUMP_XML = '''<config file="/etc/drbd.conf">
+   <common>
+   </common>
+   <resource name="beijing" conf-file-line="/etc/drbd.d/beijing.res:1">
+      <host name="node1">
+         <node-id>1</node-id>
+         <volume vnr="0">
+            <device minor="5">/dev/drbd5</device>
+            <disk>/dev/vdb1</disk>
+            <meta-disk>internal</meta-disk>
+         </volume>
+         <volume vnr="1">
+            <device minor="6">/dev/drbd6</device>
+            <disk>/dev/vdb2</disk>
+            <meta-disk>internal</meta-disk>
+         </volume>
+         <address family="ipv4" port="7990">192.168.10.1</address>
+      </host>
+      <host name="node2">
+         <node-id>2</node-id>
+         <volume vnr="0">
+            <device minor="5">/dev/drbd5</device>
+            <disk>/dev/vdc1</disk>
+            <meta-disk>internal</meta-disk>
+         </volume>
+         <address family="ipv4" port="7990">192.168.10.2</address>
+      </host>
+   </resource>
+   <resource name="tianjin" conf-file-line="/etc/drbd.d/tianjin.res:1">
+      <host name="node1">
+         <device minor="7">/dev/drbd7</device>
+         <disk>/dev/vdd1</disk>
+         <address family="ipv4" port="7991">192.168.10.1</address>
+         <meta-disk>internal</meta-disk>
+      </host>
+   </resource>
+</config>
+'''
 
 
 @skipIf(NO_MOCK, NO_MOCK_REASON)
@@ -36,6 +92,11 @@ class DrbdTestCase(TestCase, LoaderModuleMockMixin):
         '''
         Test if it shows status of the DRBD devices
         '''
+        mock_which = MagicMock(return_value='/usr/sbin/drbd-overview')
+        patch_which = patch.object(drbd.salt.utils.path, 'which', mock_which)
+        patch_which.start()
+        self.addCleanup(patch_which.stop)
+
         ret = {'connection state': 'True',
                'device': 'Stack',
                'fs': 'None',
@@ -52,7 +113,7 @@ class DrbdTestCase(TestCase, LoaderModuleMockMixin):
         mock_cmd = MagicMock(return_value='Salt:Stack True master/minion \
         UpToDate/UpToDate True None 50 50 666 888')
         with patch.dict(drbd.__salt__, {'cmd.run': mock_cmd}):
-            assert drbd.overview() == ret
+            assert drbd.overview() == [ret]
 
         ret = {'connection state': 'True',
                'device': 'Stack',
@@ -66,7 +127,7 @@ class DrbdTestCase(TestCase, LoaderModuleMockMixin):
         mock_cmd = MagicMock(return_value='Salt:Stack True master/minion \
         UpToDate/partner syncbar None 50 50')
         with patch.dict(drbd.__salt__, {'cmd.run': mock_cmd}):
-            assert drbd.overview() == ret
+            assert drbd.overview() == [ret]
 
         ret = {'connection state': 'True',
                'device': 'Stack',
@@ -80,7 +141,7 @@ class DrbdTestCase(TestCase, LoaderModuleMockMixin):
         mock_cmd = MagicMock(return_value='Salt:Stack True master(2*) \
         UpToDate/partner syncbar None 60 50')
         with patch.dict(drbd.__salt__, {'cmd.run': mock_cmd}):
-            assert drbd.overview() == ret
+            assert drbd.overview() == [ret]
 
         ret = {'connection state': 'True',
                'device': 'Stack',
@@ -92,7 +153,74 @@ class DrbdTestCase(TestCase, LoaderModuleMockMixin):
         mock_cmd = MagicMock(return_value='Salt:Stack True master/minion \
         UpToDate(2*)')
         with patch.dict(drbd.__salt__, {'cmd.run': mock_cmd}):
+            assert drbd.overview() == [ret]
+
+        # Every device, the sync progress lines belong to the device above
+        mock_cmd = MagicMock(return_value='''\
+  0:beijing/0   Connected  Primary/Secondary UpToDate/UpToDate     /mnt ext4 2.0G 6.1M 1.9G 1%
+  1:tianjin/0   SyncSource Primary/Secondary UpToDate/Inconsistent
+\t[==>.................] sync'ed: 15.2% (1738/2044)M
+\tfinish: 0:00:41 speed: 42,064 (41,240) K/sec
+  2:shanghai/0  SyncTarget Secondary/Primary Inconsistent/UpToDate
+\t[>....................] sync'ed:  1.1% (2024/2044)M
+''')
+        with patch.dict(drbd.__salt__, {'cmd.run': mock_cmd}):
+            ret = drbd.overview()
+            assert [(dev['minor number'], dev['device'], dev['connection state'])
+                    for dev in ret] == [('0', 'beijing/0', 'Connected'),
+                                        ('1', 'tianjin/0', 'SyncSource'),
+                                        ('2', 'shanghai/0', 'SyncTarget')]
+            assert ret[0]['mountpoint'] == '/mnt'
+            assert 'synched' not in ret[0]
+            assert ret[1]['synchronisation: '] == '[==>.................]'
+            assert ret[1]['synched'] == '15.2%(1738/2044)M'
+            assert ret[1]['finish'] == '0:00:41'
+            assert ret[1]['speed'] == '42,064 (41,240) K/sec'
+            assert ret[2]['synched'] == '1.1%(2024/2044)M'
+            mock_cmd.assert_called_once_with('drbd-overview')
+
+    def test_overview_json(self):
+        '''
+        Test if overview is emulated from the json status without drbd-overview
+        '''
+        status = [
+            {'resource name': 'beijing', 'local role': 'Primary',
+             'local volumes': [{'volume': '0', 'minor': 5, 'disk': 'UpToDate'},
+                               {'volume': '1', 'minor': 6, 'disk': 'UpToDate'}],
+             'peer nodes': [{'peernode name': 'node2', 'role': 'Secondary',
+                             'peer volumes': [
+                                 {'volume': '0', 'peer-disk': 'UpToDate'},
+                                 {'volume': '1', 'peer-disk': 'Inconsistent',
+                                  'replication': 'SyncSource', 'done': '42.50'}]}]},
+            {'resource name': 'tianjin', 'local role': 'Secondary',
+             'local volumes': [{'volume': '0', 'minor': 7, 'disk': 'UpToDate'}],
+             'peer nodes': [{'peernode name': 'node2', 'connection': 'Connecting',
+                             'peer volumes': []}]},
+        ]
+        ret = [
+            {'minor number': '5', 'device': 'beijing/0', 'connection state': 'Connected',
+             'local role': 'Primary', 'partner role': 'Secondary',
+             'local disk state': 'UpToDate', 'partner disk state': 'UpToDate'},
+            {'minor number': '6', 'device': 'beijing/1', 'connection state': 'SyncSource',
+             'local role': 'Primary', 'partner role': 'Secondary',
+             'local disk state': 'UpToDate', 'partner disk state': 'Inconsistent',
+             'synchronisation: ': '[========>...........]', 'synched': '42.50%'},
+            {'minor number': '7', 'device': 'tianjin/0', 'connection state': 'Connecting',
+             'local role': 'Secondary', 'partner role': 'Unknown',
+             'local disk state': 'UpToDate', 'partner disk state': 'DUnknown'},
+        ]
+        mock_json_status = MagicMock(return_value=status)
+        mock_cmd = MagicMock()
+
+        with patch.object(drbd.salt.utils.path, 'which', MagicMock(return_value=None)), \
+                patch.object(drbd, '_json_status', mock_json_status), \
+                patch.dict(drbd.__salt__, {'cmd.run': mock_cmd}):
             assert drbd.overview() == ret
+            mock_json_status.assert_called_once_with('all')
+            assert not mock_cmd.called
+
+            mock_json_status.return_value = None
+            assert drbd.overview() == []
 
     def test_status(self):
         '''
@@ -199,6 +327,441 @@ res role:Primary
         with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
             assert drbd.status() == ret
 
+    def test_status_parser(self):
+        '''
+        Test if _StatusParser handles comments and disconnected peers
+        '''
+        ret = [{'local role': 'Secondary',
+                'local volumes': [{'disk': 'Inconsistent', 'volume': '0'}],
+                'peer nodes': [{'peer volumes': [],
+                                'peernode name': 'node2',
+                                'connection': 'Connecting'},
+                               {'peer volumes': [{'done': '10.17',
+                                                  'peer-disk': 'UpToDate',
+                                                  'replication': 'SyncTarget',
+                                                  'volume': '0'}],
+                                'peernode name': 'node3',
+                                'role': 'Primary'}],
+                'resource name': 'beijing'}]
+
+        lines = '''
+# drbdadm status beijing
+beijing role:Secondary
+  volume:0 disk:Inconsistent
+  node2 connection:Connecting
+  node3 role:Primary
+    volume:0 replication:SyncTarget peer-disk:UpToDate done:10.17
+'''.splitlines()
+
+        assert drbd._StatusParser().parse(lines) == ret
+
+        parser = drbd._StatusParser()
+        assert not parser.feed('   volume:0 disk:Inconsistent')
+        assert parser.unknown == '   volume:0 disk:Inconsistent'
+
+    def test_status_json_same_verdict(self):
+        '''
+        Test if both status backends give the same sync verdict for
+        multiple peers, one of them disconnected
+        '''
+        text = '''beijing role:Primary
+  disk:UpToDate
+  node2 role:Secondary
+    peer-disk:UpToDate
+  node3 connection:Connecting
+'''
+        resource = {
+            'name': 'beijing', 'role': 'Primary',
+            'devices': [{'volume': 0, 'disk-state': 'UpToDate'}],
+            'connections': [
+                {'name': 'node2', 'connection-state': 'Connected', 'peer-role': 'Secondary',
+                 'peer_devices': [{'volume': 0, 'replication-state': 'Established',
+                                   'peer-disk-state': 'UpToDate'}]},
+                {'name': 'node3', 'connection-state': 'Connecting', 'peer-role': 'Unknown',
+                 'peer_devices': [{'volume': 0, 'replication-state': 'Off',
+                                   'peer-disk-state': 'DUnknown'}]}],
+        }
+
+        from_text = drbd._StatusParser().parse(text.splitlines())[0]
+        from_json = drbd._json_to_status(resource)
+
+        for peernode in ('all', 'node2', 'node3'):
+            verdicts = [drbd._evaluate_sync('beijing', res, peernode=peernode)
+                        for res in (from_text, from_json)]
+            assert verdicts[0] == verdicts[1]
+        assert drbd._evaluate_sync('beijing', from_json)['synced']
+        assert [node['peer volumes'] for node in from_json['peer nodes']][1] == []
+
+    def test_status_json(self):
+        '''
+        Test if status uses drbdsetup status --json when supported
+        Test data is get from drbd-9.0.16/drbd-utils-9.6.0
+        '''
+        version = {'stdout': '''
+DRBDADM_BUILDTAG=GIT-hash:\\ 1c8e1e0a1a1f0a3c\\ build\\ by\\ abuild@suse
+DRBDADM_API_VERSION=2
+DRBD_KERNEL_VERSION_CODE=0x090010
+DRBD_KERNEL_VERSION=9.0.16
+DRBDADM_VERSION_CODE=0x090600
+DRBDADM_VERSION=9.6.0
+''', 'stderr': '', 'retcode': 0}
+
+        fake = {}
+        fake['stdout'] = '''
+[
+{
+  "name": "beijing",
+  "node-id": 1,
+  "role": "Primary",
+  "devices": [
+    {
+      "volume": 0,
+      "minor": 5,
+      "disk-state": "UpToDate",
+      "size": 307152
+    } ],
+  "connections": [
+    {
+      "peer-node-id": 2,
+      "name": "salt-node3",
+      "connection-state": "Connected",
+      "peer-role": "Secondary",
+      "peer_devices": [
+        {
+          "volume": 0,
+          "replication-state": "SyncSource",
+          "peer-disk-state": "Inconsistent",
+          "resync-suspended": "no",
+          "out-of-sync": 1024,
+          "percent-in-sync": 96.47
+        } ]
+    },
+    {
+      "peer-node-id": 3,
+      "name": "salt-node4",
+      "connection-state": "Connecting",
+      "peer-role": "Unknown",
+      "peer_devices": [
+        {
+          "volume": 0,
+          "replication-state": "Off",
+          "peer-disk-state": "DUnknown",
+          "resync-suspended": "peer",
+          "out-of-sync": 0,
+          "percent-in-sync": 100.00
+        } ]
+    } ]
+}
+]
+'''
+        fake['stderr'] = ""
+        fake['retcode'] = 0
+
+        ret = [{'resource name': 'beijing',
+                'local role': 'Primary',
+                'node-id': 1,
+                'local volumes': [{'volume': '0', 'disk': 'UpToDate',
+                                   'minor': 5, 'size': 307152}],
+                'peer nodes': [{'peernode name': 'salt-node3',
+                                'role': 'Secondary',
+                                'peer-node-id': 2,
+                                'connection-state': 'Connected',
+                                'peer volumes': [{'volume': '0',
+                                                  'peer-disk': 'Inconsistent',
+                                                  'replication': 'SyncSource',
+                                                  'done': '96.47',
+                                                  'out-of-sync': 1024,
+                                                  'percent-in-sync': 96.47}]},
+                               {'peernode name': 'salt-node4',
+                                'connection': 'Connecting',
+                                'peer-node-id': 3,
+                                'connection-state': 'Connecting',
+                                'peer volumes': []}]}]
+
+        # Test 1: Json output is used
+        mock_cmd = MagicMock(side_effect=[version, fake])
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            assert drbd.status('beijing') == ret
+            mock_cmd.assert_called_with('drbdsetup status --json beijing')
+
+        # Test 2: Resource is not running
+        fake1 = {'stdout': '', 'stderr': 'beijing: No such resource', 'retcode': 10}
+        mock_cmd = MagicMock(return_value=fake1)
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            assert drbd.status('beijing') is None
+            mock_cmd.assert_called_once_with('drbdsetup status --json beijing')
+
+        # Test 3: Fall back to drbdadm status when json is broken
+        fake2 = {'stdout': '''[{'1': '2': '3'}]''', 'stderr': '', 'retcode': 0}
+        fake3 = {'stdout': '''
+beijing role:Primary
+  disk:UpToDate
+''', 'stderr': '', 'retcode': 0}
+        mock_cmd = MagicMock(side_effect=[fake2, fake3])
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            assert drbd.status('beijing') == [{'resource name': 'beijing',
+                                               'local role': 'Primary',
+                                               'local volumes': [{'disk': 'UpToDate'}],
+                                               'peer nodes': []}]
+            mock_cmd.assert_called_with('drbdadm status beijing')
+
+    def test_status_index(self):
+        '''
+        Test if status is keyed by resource, peer and volume with index
+        '''
+        output = '''beijing role:Secondary
+  volume:0 disk:Inconsistent
+  volume:1 disk:UpToDate
+  node2 role:Primary
+    volume:0 replication:SyncTarget peer-disk:UpToDate done:10.17
+    volume:1 peer-disk:UpToDate
+  node3 connection:Connecting
+
+tianjin role:Primary
+  disk:UpToDate
+  node2 role:Secondary
+    peer-disk:UpToDate
+'''
+        mock_cmd = MagicMock(return_value={'retcode': 0, 'stdout': output, 'stderr': ''})
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}), \
+                patch.object(drbd, '_utils_version_code', MagicMock(return_value=0)):
+            ret = drbd.status(index=True)
+            assert ret == {
+                'beijing': {
+                    'role': 'Secondary',
+                    'volumes': {'0': {'volume': '0', 'disk': 'Inconsistent'},
+                                '1': {'volume': '1', 'disk': 'UpToDate'}},
+                    'peers': {
+                        'node2': {'role': 'Primary', 'volumes': {
+                            '0': {'volume': '0', 'replication': 'SyncTarget',
+                                  'peer-disk': 'UpToDate', 'done': '10.17'},
+                            '1': {'volume': '1', 'peer-disk': 'UpToDate'}}},
+                        'node3': {'connection': 'Connecting', 'volumes': {}},
+                    },
+                },
+                'tianjin': {
+                    'role': 'Primary',
+                    'volumes': {'0': {'disk': 'UpToDate'}},
+                    'peers': {'node2': {'role': 'Secondary', 'volumes': {
+                        '0': {'peer-disk': 'UpToDate'}}}},
+                },
+            }
+            assert drbd.status(index=True) == ret
+            assert drbd.status(cached=True, index=True) == ret
+
+            mock_cmd.return_value = {'retcode': 10, 'stdout': '', 'stderr': 'no resources'}
+            assert drbd.status(index=True) is None
+
+    def test_status_cached(self):
+        '''
+        Test if status shares one snapshot when cached
+        '''
+        fake = {}
+        fake['stdout'] = '''
+beijing role:Primary
+  disk:UpToDate
+tianjin role:Secondary
+  disk:UpToDate
+'''
+        fake['stderr'] = ""
+        fake['retcode'] = 0
+
+        fake1 = {}
+        fake1['stdout'] = '''
+beijing role:Secondary
+  disk:UpToDate
+'''
+        fake1['stderr'] = ""
+        fake1['retcode'] = 0
+
+        beijing = {'resource name': 'beijing', 'local role': 'Primary',
+                   'local volumes': [{'disk': 'UpToDate'}], 'peer nodes': []}
+
+        mock_cmd = MagicMock(side_effect=[fake, fake, fake1, fake])
+        mock_retcode = MagicMock(return_value=0)
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd,
+                                        'cmd.retcode': mock_retcode}):
+            # Version probe and 'drbdadm status all'
+            assert drbd.status('beijing', cached=True) == [beijing]
+            assert drbd.status('tianjin', cached=True)[0]['local role'] == 'Secondary'
+            assert drbd.status('shanghai', cached=True) is None
+            assert len(drbd.status(cached=True)) == 2
+            assert mock_cmd.call_count == 2
+            mock_cmd.assert_called_with('drbdadm status all')
+
+            # Only the changed resource is queried again
+            drbd.secondary('beijing')
+            assert drbd.status('beijing', cached=True)[0]['local role'] == 'Secondary'
+            assert drbd.status('tianjin', cached=True)[0]['local role'] == 'Secondary'
+            assert mock_cmd.call_count == 3
+            mock_cmd.assert_called_with('drbdadm status beijing')
+
+            # Expired snapshot
+            with patch.object(drbd, 'SNAPSHOT_TTL', 0):
+                drbd.status('beijing', cached=True)
+                assert mock_cmd.call_count == 4
+                mock_cmd.assert_called_with('drbdadm status all')
+
+        # No resource up, cached as well
+        drbd.__context__.pop('drbd.snapshot')
+        mock_cmd = MagicMock(return_value={'stdout': '', 'retcode': 10,
+                                           'stderr': 'No currently configured DRBD found.'})
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            assert drbd.status('beijing', cached=True) is None
+            assert drbd.status('tianjin', cached=True) is None
+            assert drbd.status(cached=True) == []
+            mock_cmd.assert_called_once_with('drbdadm status all')
+
+    def test_resource_exists(self):
+        '''
+        Test if resource_exists works with and without config index
+        '''
+        drbd.__context__.clear()
+        mock_run_all = MagicMock(return_value={'retcode': 0, 'stdout': DUMP_XML, 'stderr': ''})
+        mock_retcode = MagicMock(side_effect=[0, 10])
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all,
+                                        'cmd.retcode': mock_retcode}), \
+                patch.object(drbd.platform, 'node', MagicMock(return_value='node2')):
+            assert drbd.resource_exists('beijing', cached=True)
+            # Defined, but without a section for this host
+            assert not drbd.resource_exists('tianjin', cached=True)
+            assert not drbd.resource_exists('shanghai', cached=True)
+            mock_run_all.assert_called_once_with('drbdadm dump-xml all')
+            assert not mock_retcode.called
+
+            assert drbd.resource_exists('beijing')
+            mock_retcode.assert_called_with('drbdadm dump beijing')
+
+        # Config index not available, fall back to drbdadm dump
+        drbd.__context__.clear()
+        mock_run_all = MagicMock(return_value={'retcode': 10, 'stdout': '',
+                                               'stderr': 'syntax error'})
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all,
+                                        'cmd.retcode': mock_retcode}):
+            assert not drbd.resource_exists('beijing', cached=True)
+            mock_retcode.assert_called_with('drbdadm dump beijing')
+
+    def test_config_index(self):
+        '''
+        Test if the config index is parsed, looked up and rebuilt
+        '''
+        mock_run_all = MagicMock(return_value={'retcode': 0, 'stdout': DUMP_XML, 'stderr': ''})
+        mock_stat = MagicMock(return_value=MagicMock(st_mtime=1))
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all}), \
+                patch.object(drbd.platform, 'node', MagicMock(return_value='node1.example.com')), \
+                patch.object(drbd.os, 'stat', mock_stat):
+            beijing = drbd.config_index('beijing')
+            assert beijing['file'] == '/etc/drbd.d/beijing.res'
+            assert beijing['local host'] == 'node1'
+            assert beijing['volumes'] == {
+                0: {'minor': 5, 'device': '/dev/drbd5', 'disk': '/dev/vdb1',
+                    'meta-disk': 'internal'},
+                1: {'minor': 6, 'device': '/dev/drbd6', 'disk': '/dev/vdb2',
+                    'meta-disk': 'internal'},
+            }
+            assert beijing['hosts']['node2']['node-id'] == '2'
+            assert beijing['hosts']['node2']['address'] == '192.168.10.2'
+            assert beijing['hosts']['node2']['volumes'][0]['disk'] == '/dev/vdc1'
+            assert drbd.config_index('shanghai') is None
+
+            assert drbd.list_resources() == ['beijing', 'tianjin']
+            assert drbd.list_resources(host='node2') == ['beijing']
+
+            # Configuration without volumes
+            assert drbd.find_volume(minor='7') == {
+                'resource name': 'tianjin', 'volume': 0, 'minor': 7,
+                'device': '/dev/drbd7', 'disk': '/dev/vdd1', 'meta-disk': 'internal'}
+            assert drbd.find_volume(device='/dev/drbd6')['volume'] == 1
+            assert drbd.find_volume(disk='/dev/vdb1')['resource name'] == 'beijing'
+            # Only volumes of the local host are indexed
+            assert drbd.find_volume(disk='/dev/vdc1') is None
+            self.assertRaises(exceptions.CommandExecutionError, drbd.find_volume)
+
+            mock_run_all.assert_called_once_with('drbdadm dump-xml all')
+            mock_stat.assert_any_call('/etc/drbd.conf')
+            mock_stat.assert_any_call('/etc/drbd.d')
+            mock_stat.assert_any_call('/etc/drbd.d/tianjin.res')
+
+            # A config file changed
+            mock_stat.return_value = MagicMock(st_mtime=2)
+            assert drbd.list_resources() == ['beijing', 'tianjin']
+            assert mock_run_all.call_count == 2
+
+    def test_metadata_status(self):
+        '''
+        Test if metadata_status probes the superblock and falls back to get-gi
+        '''
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        # Internal v09 meta-data in the last 4KiB block of a 10KiB disk
+        initialized = os.path.join(tmpdir, 'initialized')
+        superblock = struct.pack('>QQ', 0, 0xE2E2B1A9B8F6C3D0) + b'\0' * 44 + \
+            struct.pack('>I', 0x8374026d)
+        with salt.utils.files.fopen(initialized, 'wb') as disk:
+            disk.write(b'\0' * 4096 + superblock + b'\0' * (6144 - len(superblock)))
+
+        empty = os.path.join(tmpdir, 'empty')
+        with salt.utils.files.fopen(empty, 'wb') as disk:
+            disk.write(b'\0' * 10240)
+
+        resource = {'volumes': {
+            0: {'minor': 5, 'device': '/dev/drbd5', 'disk': initialized,
+                'meta-disk': 'internal'},
+            1: {'minor': 6, 'device': '/dev/drbd6', 'disk': empty,
+                'meta-disk': 'internal'},
+            2: {'minor': 7, 'device': '/dev/drbd7', 'disk': 'none'},
+        }}
+        mock_config = MagicMock(return_value=resource)
+        mock_run_all = MagicMock(return_value={'retcode': 255, 'stdout': '',
+                                               'stderr': 'No valid meta data found'})
+
+        ret = {
+            'resource name': 'beijing',
+            'initialized': False,
+            'volumes': [
+                {'volume': 0, 'disk': initialized, 'meta-disk': 'internal',
+                 'present': True, 'version': 'v09', 'current uuid': 'E2E2B1A9B8F6C3D0'},
+                {'volume': 1, 'disk': empty, 'meta-disk': 'internal',
+                 'present': False, 'version': None, 'current uuid': None},
+                {'volume': 2, 'disk': 'none', 'meta-disk': None,
+                 'present': None, 'version': None, 'current uuid': None},
+            ]
+        }
+
+        with patch.object(drbd, 'config_index', mock_config), \
+                patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all,
+                                           'cmd.retcode': MagicMock(return_value=0)}):
+            assert drbd.metadata_status('beijing') == ret
+            mock_run_all.assert_called_once_with('drbdadm get-gi beijing/1')
+
+            # Cached until the meta-data is changed via the module
+            mock_run_all.return_value = {
+                'retcode': 0, 'stdout': '8E5D7F1A2B3C4D5E:0000000000000000:0:0:1:1:0:0:0:0',
+                'stderr': ''}
+            assert drbd.metadata_status('beijing', cached=True) == ret
+            assert mock_run_all.call_count == 1
+
+            drbd.createmd('beijing')
+            ret = drbd.metadata_status('beijing', cached=True)
+            assert ret['initialized']
+            assert ret['volumes'][1]['present']
+            assert ret['volumes'][1]['current uuid'] == '8E5D7F1A2B3C4D5E'
+            assert mock_run_all.call_count == 2
+
+            mock_config.return_value = None
+            self.assertRaises(exceptions.CommandExecutionError,
+                              drbd.metadata_status, 'tianjin')
+
     def test_createmd(self):
         '''
         Test if createmd function work well
@@ -209,6 +772,134 @@ res role:Primary
             assert drbd.createmd()
             mock_cmd.assert_called_once_with('drbdadm create-md all --force')
 
+    def test_createmd_many(self):
+        '''
+        Test if createmd_many creates missing metadata, one worker per device
+        '''
+        def _metadata(name, cached):
+            present = {'beijing': [True, False, False], 'tianjin': [False, None],
+                       'shanghai': [False]}[name]
+            return {'volumes': [{'volume': vnr, 'disk': '/dev/{}{}'.format(name, vnr),
+                                 'present': value} for vnr, value in enumerate(present)]}
+
+        def _device(disk):
+            # beijing volumes share one disk
+            return disk[:-1] if disk.startswith('/dev/beijing') else disk
+
+        lock = threading.Lock()
+        running = set()
+        overlaps = []
+
+        def _create_md(cmd):
+            device = _device('/dev/' + cmd.split()[2].replace('/', ''))
+            with lock:
+                if device in running:
+                    overlaps.append(device)
+                running.add(device)
+            time.sleep(0.01)
+            with lock:
+                running.discard(device)
+            if 'shanghai' in cmd:
+                return {'retcode': 10, 'stderr': 'open(/dev/shanghai0) failed'}
+            return {'retcode': 0, 'stderr': ''}
+
+        mock_list = MagicMock(return_value=['beijing', 'shanghai', 'tianjin'])
+        mock_config = MagicMock(return_value={'volumes': {0: {}}})
+        mock_run_all = MagicMock(side_effect=_create_md)
+
+        with patch.object(drbd, 'metadata_status', MagicMock(side_effect=_metadata)), \
+                patch.object(drbd, 'list_resources', mock_list), \
+                patch.object(drbd, 'config_index', mock_config), \
+                patch.object(drbd, '_backing_device', _device), \
+                patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all}):
+            ret = drbd.createmd_many(['beijing', 't*', 'shanghai'], workers=2)
+
+            assert [(vol['resource name'], vol['volume'], vol['outcome']) for vol in ret] == [
+                ('beijing', 0, 'present'),
+                ('beijing', 1, 'created'),
+                ('beijing', 2, 'created'),
+                ('tianjin', 0, 'created'),
+                ('tianjin', 1, 'diskless'),
+                ('shanghai', 0, 'failed'),
+            ]
+            assert ret[1]['seconds'] > 0
+            assert ret[5]['retcode'] == 10
+            assert ret[5]['comment'] == 'open(/dev/shanghai0) failed'
+            assert mock_run_all.call_count == 4
+            mock_run_all.assert_any_call('drbdadm create-md beijing/1 --force')
+            mock_run_all.assert_any_call('drbdadm create-md tianjin/0 --force')
+            # The present metadata is never overwritten
+            assert call('drbdadm create-md beijing/0 --force') not in \
+                mock_run_all.call_args_list
+            assert not overlaps
+
+            # Only report the missing metadata
+            mock_run_all.reset_mock()
+            ret = drbd.createmd_many('beijing', test=True)
+            assert [vol['outcome'] for vol in ret] == ['present', 'missing', 'missing']
+            assert not mock_run_all.called
+
+            # Any error of a job fails its volume, the others are still created
+            def _broken(cmd):
+                if 'beijing' in cmd:
+                    return {'retcode': 0, 'stderr': ''}
+                # Like the dunders missing in a thread
+                raise TypeError("'NoneType' object is not subscriptable")
+
+            mock_run_all = MagicMock(side_effect=_broken)
+            with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all}):
+                ret = drbd.createmd_many(['beijing', 'tianjin'], workers=2)
+            assert [(vol['resource name'], vol['volume'], vol['outcome']) for vol in ret] == [
+                ('beijing', 0, 'present'),
+                ('beijing', 1, 'created'),
+                ('beijing', 2, 'created'),
+                ('tianjin', 0, 'failed'),
+                ('tianjin', 1, 'diskless'),
+            ]
+            assert 'NoneType' in ret[3]['comment']
+
+    @skipIf(drbd.contextvars is None, 'No contextvars')
+    def test_createmd_many_context(self):
+        '''
+        Test if the workers of createmd_many run in the loader context
+        '''
+        # Stands for the loader context var of the dunders, salt>=3003
+        loader = drbd.contextvars.ContextVar('loader')
+        seen = []
+
+        def _create_md(cmd):
+            seen.append(loader.get(None))
+            return {'retcode': 0, 'stderr': ''}
+
+        mock_metadata = MagicMock(return_value={'volumes': [
+            {'volume': 0, 'disk': '/dev/vdb', 'present': False},
+            {'volume': 1, 'disk': '/dev/vdc', 'present': False}]})
+
+        def _run():
+            loader.set('minion')
+            return drbd.createmd_many('beijing', workers=2)
+
+        with patch.object(drbd, 'metadata_status', mock_metadata), \
+                patch.object(drbd, '_backing_device', lambda disk: disk), \
+                patch.dict(drbd.__salt__, {'cmd.run_all': MagicMock(side_effect=_create_md)}):
+            ret = drbd.contextvars.copy_context().run(_run)
+
+        assert [vol['outcome'] for vol in ret] == ['created', 'created']
+        assert seen == ['minion', 'minion']
+
+    def test_new_current_uuid(self):
+        '''
+        Test if new_current_uuid function work well
+        '''
+        mock_cmd = MagicMock(return_value=0)
+
+        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+            assert not drbd.new_current_uuid()
+            mock_cmd.assert_called_once_with('drbdadm new-current-uuid all')
+
+            assert not drbd.new_current_uuid('beijing', clear_bitmap=True)
+            mock_cmd.assert_called_with('drbdadm new-current-uuid --clear-bitmap beijing')
+
     def test_up(self):
         '''
         Test if up function work well
@@ -219,6 +910,65 @@ res role:Primary
             assert drbd.up()
             mock_cmd.assert_called_once_with('drbdadm up all')
 
+    def test_up_many(self):
+        '''
+        Test if a list of resources is run by one drbdadm
+        '''
+        mock_cmd = MagicMock(return_value=0)
+
+        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+            assert drbd.up(['beijing', 'tianjin', 'beijing']) == {'beijing': 0, 'tianjin': 0}
+            mock_cmd.assert_called_once_with('drbdadm up beijing tianjin')
+
+            mock_cmd.reset_mock()
+            assert drbd.primary(['beijing', 'tianjin'], force=True) == {
+                'beijing': 0, 'tianjin': 0}
+            mock_cmd.assert_called_once_with('drbdadm primary beijing tianjin --force')
+
+            assert drbd.adjust([]) == {}
+
+        # Failure, the resources not started are retried one by one
+        mock_cmd = MagicMock(side_effect=[10, 10, 0])
+        mock_status = MagicMock(return_value=[{'resource name': 'beijing',
+                                               'local role': 'Secondary'}])
+
+        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}), \
+                patch.object(drbd, 'status', mock_status):
+            assert drbd.up(['beijing', 'tianjin', 'shanghai']) == {
+                'beijing': 0, 'tianjin': 10, 'shanghai': 0}
+            assert mock_cmd.call_args_list == [call('drbdadm up beijing tianjin shanghai'),
+                                               call('drbdadm up tianjin'),
+                                               call('drbdadm up shanghai')]
+
+        # Failure without status, all retried
+        mock_cmd = MagicMock(side_effect=[10, 0, 10])
+        mock_status = MagicMock(return_value=None)
+
+        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}), \
+                patch.object(drbd, 'status', mock_status):
+            assert drbd.down(['beijing', 'tianjin']) == {'beijing': 0, 'tianjin': 10}
+            assert mock_cmd.call_count == 3
+
+        # Failed adjust, only the resources still planned are retried
+        mock_cmd = MagicMock(side_effect=[10, 10])
+        mock_plan = MagicMock(return_value={'beijing': [], 'tianjin': [{'command': 'attach'}]})
+
+        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}), \
+                patch.object(drbd, 'adjust_plan', mock_plan):
+            assert drbd.adjust(['beijing', 'tianjin']) == {'beijing': 0, 'tianjin': 10}
+            assert mock_cmd.call_args_list == [call('drbdadm adjust beijing tianjin'),
+                                               call('drbdadm adjust tianjin')]
+            mock_plan.assert_called_once_with(['beijing', 'tianjin'])
+
+        # Without dry run, all retried
+        mock_cmd = MagicMock(side_effect=[10, 0, 10])
+        mock_plan = MagicMock(side_effect=exceptions.CommandExecutionError('dry run error'))
+
+        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}), \
+                patch.object(drbd, 'adjust_plan', mock_plan):
+            assert drbd.adjust(['beijing', 'tianjin']) == {'beijing': 0, 'tianjin': 10}
+            assert mock_cmd.call_count == 3
+
     def test_down(self):
         '''
         Test if down function work well
@@ -267,6 +1017,73 @@ res role:Primary
             assert drbd.adjust()
             mock_cmd.assert_called_once_with('drbdadm adjust all')
 
+    def test_adjust_plan(self):
+        '''
+        Test if the dry run of adjust is parsed per resource
+        '''
+        plan = '''drbdsetup net-options beijing 2 --protocol=A --max-buffers=8000
+drbdsetup disk-options 6 --set-defaults --resync-rate=100M
+drbdmeta 5 v09 /dev/vdb1 internal apply-al
+drbdsetup-84 net-options ipv4:192.168.10.1:7991 ipv4:192.168.10.9:7991 --protocol=C
+drbdsetup resize 99 --size=10G
+drbdsetup disk-options guangzhou --resync-rate=100M
+'''
+
+        def run_all(cmd):
+            if cmd.endswith('dump-xml all'):
+                return {'retcode': 0, 'stdout': DUMP_XML, 'stderr': ''}
+            if cmd == 'drbdadm -d adjust beijing':
+                return {'retcode': 0, 'stdout': plan.splitlines()[0], 'stderr': ''}
+            if cmd == 'drbdadm -d adjust all':
+                return {'retcode': 0, 'stdout': plan, 'stderr': ''}
+            if cmd == 'drbdadm -d adjust beijing tianjin':
+                return {'retcode': 0, 'stdout': '', 'stderr': ''}
+            return {'retcode': 10, 'stdout': '', 'stderr': 'shanghai: no resources defined!'}
+
+        net_options = {'command': 'net-options', 'args': ['beijing', '2'], 'peer': 'node2',
+                       'volume': None, 'options': {'protocol': 'A', 'max-buffers': '8000'}}
+        ret = {
+            'beijing': [
+                net_options,
+                {'command': 'disk-options', 'args': ['6'], 'peer': None, 'volume': 1,
+                 'options': {'set-defaults': True, 'resync-rate': '100M'}},
+                {'command': 'drbdmeta apply-al',
+                 'args': ['5', 'v09', '/dev/vdb1', 'internal', 'apply-al'],
+                 'peer': None, 'volume': 0, 'options': {}},
+            ],
+            'tianjin': [
+                {'command': 'net-options',
+                 'args': ['ipv4:192.168.10.1:7991', 'ipv4:192.168.10.9:7991'],
+                 'peer': 'ipv4:192.168.10.9:7991', 'volume': None,
+                 'options': {'protocol': 'C'}},
+            ],
+        }
+
+        drbd.__context__.pop('drbd.config', None)
+        mock_run_all = MagicMock(side_effect=run_all)
+        mock_retcode = MagicMock(return_value=0)
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all,
+                                        'cmd.retcode': mock_retcode}), \
+                patch.object(drbd.platform, 'node', MagicMock(return_value='node1')), \
+                patch.object(drbd.os, 'stat', MagicMock(return_value=MagicMock(st_mtime=1))):
+            # Unknown minor and resource are not in the plan
+            assert drbd.adjust_plan() == ret
+            assert drbd.adjust_plan(['beijing', 'tianjin']) == {'beijing': [], 'tianjin': []}
+
+            # Only the changed resources are adjusted
+            assert drbd.adjust_changed(['beijing', 'tianjin'], test=True) == {}
+            assert drbd.adjust_changed('beijing', test=True) == {
+                'beijing': {'plan': [net_options], 'retcode': None}}
+            mock_retcode.assert_not_called()
+
+            assert drbd.adjust_changed() == {
+                'beijing': {'plan': ret['beijing'], 'retcode': 0},
+                'tianjin': {'plan': ret['tianjin'], 'retcode': 0}}
+            mock_retcode.assert_called_once_with('drbdadm adjust beijing tianjin')
+
+            self.assertRaises(exceptions.CommandExecutionError, drbd.adjust_plan, 'shanghai')
+
     def test_setup_show(self):
         '''
         Test if setup_show function work well
@@ -495,6 +1312,246 @@ res role:Primary
         with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
             self.assertRaises(exceptions.CommandExecutionError, drbd.setup_status)
 
+    def test_statistics(self):
+        '''
+        Test if statistics are flattened and reported since last sample
+        '''
+        def _sample(written, sent):
+            return salt.utils.json.dumps([{
+                'name': 'beijing', 'node-id': 1, 'role': 'Primary', 'suspended': False,
+                'devices': [{'volume': 0, 'minor': 5, 'disk-state': 'UpToDate',
+                             'client': False, 'size': 1048508, 'read': 100,
+                             'written': written, 'al-writes': 3, 'bm-writes': 0,
+                             'upper-pending': 0, 'lower-pending': 1}],
+                'connections': [{'peer-node-id': 2, 'name': 'node2',
+                                 'connection-state': 'Connected', 'congested': False,
+                                 'ap-in-flight': 8, 'rs-in-flight': 0,
+                                 'peer_devices': [{'volume': 0, 'sent': sent,
+                                                   'received': 0, 'out-of-sync': 4,
+                                                   'pending': 0, 'unacked': 2,
+                                                   'percent-in-sync': 99.5}]}],
+            }])
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        mock_run_all = MagicMock(return_value={'retcode': 0, 'stdout': _sample(1000, 500),
+                                               'stderr': ''})
+        mock_time = MagicMock(return_value=100)
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all}), \
+                patch.dict(drbd.__opts__, {'cachedir': tmpdir}), \
+                patch.object(drbd.time, 'time', mock_time):
+            assert drbd.statistics() == [
+                {'type': 'device', 'resource name': 'beijing', 'peernode name': None,
+                 'volume': 0, 'minor': 5, 'size': 1048508, 'read': 100, 'written': 1000,
+                 'al-writes': 3, 'bm-writes': 0, 'upper-pending': 0, 'lower-pending': 1},
+                {'type': 'connection', 'resource name': 'beijing', 'peernode name': 'node2',
+                 'volume': None, 'minor': None, 'ap-in-flight': 8, 'rs-in-flight': 0},
+                {'type': 'peer-device', 'resource name': 'beijing', 'peernode name': 'node2',
+                 'volume': 0, 'minor': None, 'sent': 500, 'received': 0, 'out-of-sync': 4,
+                 'pending': 0, 'unacked': 2, 'percent-in-sync': 99.5},
+            ]
+            mock_run_all.assert_called_once_with('drbdsetup status --statistics --json all')
+            assert not os.path.exists(os.path.join(tmpdir, 'drbd'))
+
+            # No previous sample
+            ret = drbd.statistics(name='beijing', since_last=True)
+            assert ret[0]['written'] is None
+            assert ret[0]['upper-pending'] == 0
+            assert ret[0]['seconds'] is None
+            assert ret[2]['sent'] is None
+            assert ret[2]['out-of-sync'] == 4
+
+            mock_run_all.return_value['stdout'] = _sample(3000, 1500)
+            mock_time.return_value = 110
+            ret = drbd.statistics(name='beijing', since_last=True)
+            assert ret[0]['written'] == 200
+            assert ret[0]['read'] == 0
+            assert ret[0]['seconds'] == 10
+            assert ret[2]['sent'] == 100
+
+            # Counters reset, e.g. after down/up
+            mock_run_all.return_value['stdout'] = _sample(10, 1600)
+            mock_time.return_value = 120
+            ret = drbd.statistics(name='beijing', since_last=True)
+            assert ret[0]['written'] is None
+            assert ret[2]['sent'] == 10
+
+        mock_run_all = MagicMock(return_value={'retcode': 10, 'stdout': '',
+                                               'stderr': 'beijing: No such resource'})
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all}):
+            self.assertRaises(exceptions.CommandExecutionError, drbd.statistics, 'beijing')
+
+    def test_replication_health(self):
+        '''
+        Test if replication_health summarizes the samples per peer
+        '''
+        def _sample(ap_in_flight, sent, state='Established', congested=False):
+            return {'retcode': 0, 'stderr': '', 'stdout': salt.utils.json.dumps([{
+                'name': 'beijing', 'role': 'Primary',
+                'connections': [
+                    {'name': 'node2', 'connection-state': 'Connected',
+                     'congested': congested, 'ap-in-flight': ap_in_flight, 'rs-in-flight': 0,
+                     'peer_devices': [
+                         {'volume': 0, 'replication-state': state, 'sent': sent,
+                          'pending': 1, 'unacked': 2, 'out-of-sync': 0},
+                         {'volume': 1, 'replication-state': 'Established', 'sent': 0,
+                          'pending': 0, 'unacked': 1, 'out-of-sync': 16}]},
+                    {'name': 'node3', 'connection-state': 'Connecting',
+                     'congested': False, 'peer_devices': []}]}])}
+
+        mock_run_all = MagicMock(side_effect=[
+            _sample(100, 1000), _sample(300, 2000, 'Ahead', True), _sample(200, 4000)])
+        mock_time = MagicMock(side_effect=[10, 11, 12])
+        mock_sleep = MagicMock()
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all}), \
+                patch.object(drbd.time, 'time', mock_time), \
+                patch.object(drbd.time, 'sleep', mock_sleep):
+            ret = drbd.replication_health('beijing', interval=0.5)
+
+            assert ret['resource name'] == 'beijing'
+            assert ret['peer nodes']['node2'] == {
+                'connection': 'Connected',
+                'congested': True,
+                'ahead/behind': 'Ahead',
+                'ap-in-flight': {'max': 300, 'avg': 200.0},
+                'rs-in-flight': {'max': 0, 'avg': 0.0},
+                'pending': {'max': 1, 'avg': 1.0},
+                'unacked': {'max': 3, 'avg': 3.0},
+                'out-of-sync': 16,
+                'send rate': 1500.0,
+                'lag': 200.0 / 1500,
+            }
+            assert ret['peer nodes']['node3']['connection'] == 'Connecting'
+            assert ret['peer nodes']['node3']['lag'] == 0.0
+            assert mock_sleep.call_count == 2
+            mock_sleep.assert_called_with(0.5)
+            mock_run_all.assert_called_with('drbdsetup status --statistics --json beijing')
+
+        # Single sample, peer filter
+        mock_run_all = MagicMock(return_value=_sample(100, 1000))
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all}):
+            ret = drbd.replication_health('beijing', samples=1, peernode='node2')
+            assert list(ret['peer nodes']) == ['node2']
+            assert ret['peer nodes']['node2']['send rate'] is None
+            assert ret['peer nodes']['node2']['lag'] is None
+
+    def test_prometheus_metrics(self):
+        '''
+        Test if prometheus_metrics renders the exposition format
+        '''
+        sample = salt.utils.json.dumps([{
+            'name': 'bei"jing', 'role': 'Primary', 'suspended': False,
+            'devices': [{'volume': 0, 'minor': 5, 'disk-state': 'UpToDate',
+                         'written': 1000, 'upper-pending': 0}],
+            'connections': [{'name': 'node2', 'connection-state': 'Connected',
+                             'peer-role': 'Secondary', 'ap-in-flight': 8,
+                             'peer_devices': [{'volume': 0, 'replication-state': 'SyncSource',
+                                               'peer-disk-state': 'Inconsistent',
+                                               'sent': 500, 'percent-in-sync': 42.5}]}],
+        }])
+        ret = '''# HELP drbd_connection_ap_in_flight DRBD connection ap in flight \
+from drbdsetup status --statistics.
+# TYPE drbd_connection_ap_in_flight gauge
+drbd_connection_ap_in_flight{resource="bei\\"jing",peer="node2"} 8
+# HELP drbd_connection_peer_role DRBD connection peer role from drbdsetup status --statistics.
+# TYPE drbd_connection_peer_role gauge
+drbd_connection_peer_role{resource="bei\\"jing",peer="node2",role="Secondary"} 1
+# HELP drbd_connection_state DRBD connection state from drbdsetup status --statistics.
+# TYPE drbd_connection_state gauge
+drbd_connection_state{resource="bei\\"jing",peer="node2",state="Connected"} 1
+# HELP drbd_device_disk_state DRBD device disk state from drbdsetup status --statistics.
+# TYPE drbd_device_disk_state gauge
+drbd_device_disk_state{resource="bei\\"jing",volume="0",minor="5",state="UpToDate"} 1
+# HELP drbd_device_upper_pending DRBD device upper pending from drbdsetup status --statistics.
+# TYPE drbd_device_upper_pending gauge
+drbd_device_upper_pending{resource="bei\\"jing",volume="0",minor="5"} 0
+# HELP drbd_device_written_total DRBD device written total from drbdsetup status --statistics.
+# TYPE drbd_device_written_total counter
+drbd_device_written_total{resource="bei\\"jing",volume="0",minor="5"} 1000
+# HELP drbd_peer_device_peer_disk_state DRBD peer device peer disk state \
+from drbdsetup status --statistics.
+# TYPE drbd_peer_device_peer_disk_state gauge
+drbd_peer_device_peer_disk_state{resource="bei\\"jing",peer="node2",volume="0",\
+state="Inconsistent"} 1
+# HELP drbd_peer_device_percent_in_sync DRBD peer device percent in sync \
+from drbdsetup status --statistics.
+# TYPE drbd_peer_device_percent_in_sync gauge
+drbd_peer_device_percent_in_sync{resource="bei\\"jing",peer="node2",volume="0"} 42.5
+# HELP drbd_peer_device_replication_state DRBD peer device replication state \
+from drbdsetup status --statistics.
+# TYPE drbd_peer_device_replication_state gauge
+drbd_peer_device_replication_state{resource="bei\\"jing",peer="node2",volume="0",\
+state="SyncSource"} 1
+# HELP drbd_peer_device_sent_total DRBD peer device sent total from drbdsetup status --statistics.
+# TYPE drbd_peer_device_sent_total counter
+drbd_peer_device_sent_total{resource="bei\\"jing",peer="node2",volume="0"} 500
+# HELP drbd_resource_role DRBD resource role from drbdsetup status --statistics.
+# TYPE drbd_resource_role gauge
+drbd_resource_role{resource="bei\\"jing",role="Primary"} 1
+'''
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        mock_run_all = MagicMock(return_value={'retcode': 0, 'stdout': sample, 'stderr': ''})
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all}):
+            assert drbd.prometheus_metrics() == ret
+            mock_run_all.assert_called_once_with('drbdsetup status --statistics --json all')
+
+            path = drbd.prometheus_metrics(textfile_dir=tmpdir)
+            assert path == os.path.join(tmpdir, 'drbd.prom')
+            with salt.utils.files.fopen(path, 'r') as prom:
+                assert prom.read() == ret
+            assert os.listdir(tmpdir) == ['drbd.prom']
+
+    def test_perf_stats(self):
+        '''
+        Test if perf_stats aggregates the commands run by the module
+        '''
+        drbd.__context__.clear()
+        drbd.__context__['drbd.version_code'] = 0
+
+        mock_run_all = MagicMock(return_value={'retcode': 0, 'stdout': 'beijing role:Primary',
+                                               'stderr': ''})
+        mock_retcode = MagicMock(side_effect=[0, 10])
+        mock_timer = MagicMock(side_effect=[1.0, 1.5, 2.0, 2.25, 3.0, 3.75, 4.0, 5.0])
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_run_all,
+                                        'cmd.retcode': mock_retcode}), \
+                patch.object(drbd.timeit, 'default_timer', mock_timer):
+            drbd.status('beijing')
+            drbd.status('beijing')
+            drbd.up('beijing')
+            drbd.up('tianjin')
+
+        ret = drbd.perf_stats(reset=True)
+        assert ret['calls'] == 4
+        assert ret['failures'] == 1
+        assert ret['seconds'] == 2.5
+        assert ret['commands'] == {
+            'drbdadm status': {'calls': 2, 'failures': 0, 'seconds': 0.75,
+                               'max seconds': 0.5, 'avg seconds': 0.375,
+                               'output bytes': 40},
+            'drbdadm up': {'calls': 2, 'failures': 1, 'seconds': 1.75,
+                           'max seconds': 1.0, 'avg seconds': 0.875,
+                           'output bytes': 0},
+        }
+        assert ret['history'][-1] == {'command': 'drbdadm up tianjin', 'seconds': 1.0,
+                                      'retcode': 10, 'output bytes': 0}
+
+        # Reset and the aggregation key of lists and options
+        assert drbd.perf_stats()['calls'] == 0
+        assert drbd._command_key(['drbdsetup', 'events2', 'all']) == 'drbdsetup events2'
+        assert drbd._command_key('drbdadm -d adjust beijing') == 'drbdadm -d adjust'
+        assert drbd._command_key('drbdadm create-md --force beijing') == 'drbdadm create-md'
+        assert drbd._command_key('/usr/sbin/drbd-overview') == 'drbd-overview'
+        assert drbd._command_key('drbdadm --version') == 'drbdadm --version'
+
     def test_check_sync_status(self):
         '''
         Test if check_sync_status function work well
@@ -603,7 +1660,7 @@ beijing role:Primary
         with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
             assert not drbd.check_sync_status('beijing')
 
-        # Test 4.2: Test status return Error
+        # Test 4.2: Test only one status sample is evaluated
         fake = {}
         fake['stdout'] = '''
 beijing role:Primary
@@ -627,4 +1684,297 @@ beijing role:Primary
         mock_cmd = MagicMock(side_effect=[fake, fake1])
 
         with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
-            assert not drbd.check_sync_status('beijing')
+            assert drbd.check_sync_status('beijing')
+            mock_cmd.assert_called_once_with('drbdadm status beijing')
+
+    def test_sync_status(self):
+        '''
+        Test if sync_status reports the lagging volumes of one sample
+        '''
+        fake = {}
+        fake['stdout'] = '''
+beijing role:Secondary
+  volume:0 disk:UpToDate
+  volume:1 disk:Inconsistent
+  node2 role:Primary
+    volume:0 peer-disk:UpToDate
+    volume:1 replication:SyncTarget peer-disk:UpToDate done:74.08
+  node3 role:Secondary
+    volume:0 peer-disk:UpToDate
+    volume:1 peer-disk:Inconsistent resync-suspended:peer
+
+'''
+        fake['stderr'] = ""
+        fake['retcode'] = 0
+
+        ret = {'resource name': 'beijing',
+               'synced': False,
+               'lagging local volumes': [{'volume': '1', 'disk': 'Inconsistent',
+                                          'done': 74.08}],
+               'lagging peer volumes': {
+                   'node3': [{'volume': '1', 'peer-disk': 'Inconsistent',
+                              'resync-suspended': 'peer', 'done': None}]}}
+
+        mock_cmd = MagicMock(return_value=fake)
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            assert drbd.sync_status('beijing') == ret
+            assert drbd.sync_status('beijing', peernode='node2')['lagging peer volumes'] == {}
+
+        # Resource is not running
+        fake = {'stdout': '', 'stderr': 'beijing: No such resource', 'retcode': 10}
+        mock_cmd = MagicMock(return_value=fake)
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            assert drbd.sync_status('beijing') == {'resource name': 'beijing',
+                                                   'synced': False,
+                                                   'lagging local volumes': [],
+                                                   'lagging peer volumes': {}}
+
+    def test_stream_lines(self):
+        '''
+        Test if _stream_lines yields the lines of a command
+        '''
+        lines = drbd._stream_lines(['printf', 'a\\nb\\nc'], timeout=10)
+        assert list(lines) == ['a', 'b', 'c']
+
+        lines = drbd._stream_lines(['sleep', '10'], timeout=0.1)
+        assert list(lines) == []
+
+        lines = drbd._stream_lines(['sh', '-c', 'echo a; echo failed >&2; exit 3'])
+        assert next(lines) == 'a'
+        try:
+            next(lines)
+        except exceptions.CommandExecutionError as err:
+            assert 'code 3: failed' in str(err)
+        else:
+            assert False, 'CommandExecutionError not raised'
+
+    def test_iter_status(self):
+        '''
+        Test if iter_status yields resources one by one and stops early
+        '''
+        output = '''beijing role:Primary
+  disk:UpToDate
+  node2 role:Secondary
+    peer-disk:UpToDate
+
+tianjin role:Secondary
+  disk:UpToDate
+
+shanghai role:Secondary
+  disk:Inconsistent
+'''.splitlines()
+        streams = []
+
+        def _stream_lines(args, timeout=None):
+            stream = {'args': args, 'read': 0, 'closed': False}
+            streams.append(stream)
+            try:
+                for line in output:
+                    stream['read'] += 1
+                    yield line
+            finally:
+                stream['closed'] = True
+
+        mock_which = MagicMock(return_value='/usr/sbin/drbdadm')
+
+        with patch.object(drbd, '_stream_lines', _stream_lines), \
+                patch.object(drbd.salt.utils.path, 'which', mock_which):
+            ret = drbd.iter_status()
+            assert next(ret)['resource name'] == 'beijing'
+            # Only complete resources are yielded
+            assert streams[0]['read'] == 6
+            assert [res['resource name'] for res in ret] == ['tianjin', 'shanghai']
+            assert streams[0]['args'] == ['drbdadm', 'status', 'all']
+            assert streams[0]['closed']
+
+            # Stop once all requested resources are seen
+            ret = list(drbd.iter_status(['beijing', 'tianjin', 'wuhan']))
+            assert [res['resource name'] for res in ret] == ['beijing', 'tianjin']
+            assert streams[1]['read'] == len(output)
+
+            ret = list(drbd.iter_status(['tianjin', 'beijing']))
+            assert [res['resource name'] for res in ret] == ['beijing', 'tianjin']
+            assert streams[2]['read'] == 9
+            assert streams[2]['closed']
+
+            ret = list(drbd.iter_status('tianjin'))
+            assert ret == [{'resource name': 'tianjin', 'local role': 'Secondary',
+                            'local volumes': [{'disk': 'UpToDate'}], 'peer nodes': []}]
+            assert streams[3]['args'] == ['drbdadm', 'status', 'tianjin']
+
+            output.append('  unknown')
+            self.assertRaises(exceptions.CommandExecutionError, list, drbd.iter_status())
+
+        # The error of drbdadm is not swallowed
+        mock_stream = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'drbdadm status wuhan exited with code 10: wuhan: No such resource'))
+        with patch.object(drbd, '_stream_lines', mock_stream), \
+                patch.object(drbd.salt.utils.path, 'which', mock_which):
+            self.assertRaises(exceptions.CommandExecutionError, list, drbd.iter_status('wuhan'))
+
+    def test_sync_progress(self):
+        '''
+        Test if sync_progress reports the rate and ETA of lagging volumes
+        '''
+        def sample(done0, done1):
+            return {'stdout': '''
+beijing role:Secondary
+  volume:0 disk:Inconsistent
+  volume:1 disk:UpToDate
+  node2 role:Primary
+    volume:0 replication:SyncTarget peer-disk:UpToDate done:{}
+    volume:1 peer-disk:UpToDate
+  node3 role:Secondary
+    volume:0 peer-disk:Inconsistent resync-suspended:peer
+    volume:1 replication:SyncSource peer-disk:Inconsistent done:{}
+'''.format(done0, done1), 'stderr': '', 'retcode': 0}
+
+        # Test 1: Sample twice
+        mock_cmd = MagicMock(side_effect=[sample('10.00', '50.00'),
+                                          sample('10.00', '50.00'),
+                                          sample('20.00', '55.00')])
+        mock_time = MagicMock(side_effect=[100.0, 102.0])
+        mock_sleep = MagicMock()
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            with patch.object(drbd.time, 'time', mock_time), \
+                    patch.object(drbd.time, 'sleep', mock_sleep):
+                ret = drbd.sync_progress('beijing', interval=2)
+                mock_sleep.assert_called_once_with(2)
+
+        assert not ret['synced']
+        assert ret['lagging local volumes'] == [{'volume': '0', 'disk': 'Inconsistent',
+                                                 'done': 20.0, 'rate': 5.0, 'eta': 16.0}]
+        assert ret['lagging peer volumes']['node3'] == [
+            {'volume': '0', 'peer-disk': 'Inconsistent', 'resync-suspended': 'peer',
+             'done': None, 'rate': None, 'eta': None},
+            {'volume': '1', 'peer-disk': 'Inconsistent', 'replication': 'SyncSource',
+             'done': 55.0, 'rate': 2.5, 'eta': 18.0}]
+        # Suspended volume has no ETA
+        assert ret['eta'] is None
+
+        # Test 2: Use the previous sample of __context__
+        mock_cmd = MagicMock(return_value=sample('30.00', '60.00'))
+        mock_time = MagicMock(return_value=104.0)
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            with patch.object(drbd.time, 'time', mock_time), \
+                    patch.object(drbd.time, 'sleep', mock_sleep):
+                ret = drbd.sync_progress('beijing', peernode='node2')
+                mock_sleep.assert_called_once_with(2)
+                mock_cmd.assert_called_once_with('drbdadm status beijing')
+
+        assert ret['lagging local volumes'][0]['eta'] == 14.0
+        assert ret['lagging peer volumes'] == {}
+        assert ret['eta'] == 14.0
+
+    def test_wait_sync_events(self):
+        '''
+        Test if wait_sync_events returns once synced
+        '''
+        def fake_stream(lines):
+            def stream(args, timeout=None):
+                for line in lines:
+                    yield line
+            return stream
+
+        synced = EVENTS2_SYNCING + [
+            'change peer-device name:beijing peer-node-id:2 conn-name:node2 volume:0 '
+            'replication:Established peer-disk:UpToDate',
+            'change resource name:beijing role:Secondary']
+
+        # Test 1: Synced
+        with patch('salt.utils.path.which', MagicMock(return_value='/sbin/drbdsetup')):
+            with patch.object(drbd, '_stream_lines', fake_stream(synced)):
+                ret = drbd.wait_sync_events('beijing', timeout=10)
+                assert ret['synced']
+                assert ret['lagging peer volumes'] == {}
+
+        # Test 2: events2 exits too early
+        with patch('salt.utils.path.which', MagicMock(return_value='/sbin/drbdsetup')):
+            with patch.object(drbd, '_stream_lines', fake_stream(EVENTS2_SYNCING)):
+                self.assertRaises(exceptions.CommandExecutionError,
+                                  drbd.wait_sync_events, 'beijing', timeout=10)
+
+        # Test 3: Timeout
+        mock_time = MagicMock(side_effect=[100, 111])
+        with patch('salt.utils.path.which', MagicMock(return_value='/sbin/drbdsetup')):
+            with patch.object(drbd, '_stream_lines', fake_stream(EVENTS2_SYNCING)):
+                with patch.object(drbd.time, 'time', mock_time):
+                    ret = drbd.wait_sync_events('beijing', timeout=10)
+                    assert not ret['synced']
+                    assert ret['lagging peer volumes']['node2'][0]['peer-disk'] == 'Inconsistent'
+
+        # Test 4: No drbdsetup
+        with patch('salt.utils.path.which', MagicMock(return_value=None)):
+            self.assertRaises(exceptions.CommandExecutionError,
+                              drbd.wait_sync_events, 'beijing')
+
+    def test_sync_status_all(self):
+        '''
+        Test if sync_status_all evaluates all resources from one sample
+        '''
+        fake = {}
+        fake['stdout'] = '''
+res-beijing role:Primary
+  disk:UpToDate
+  node2 role:Secondary
+    peer-disk:UpToDate
+res-tianjin role:Primary
+  disk:UpToDate
+  node2 role:Secondary
+    replication:SyncSource peer-disk:Inconsistent done:50.00
+shanghai role:Primary
+  disk:UpToDate
+'''
+        fake['stderr'] = ""
+        fake['retcode'] = 0
+
+        mock_cmd = MagicMock(return_value=fake)
+
+        with patch.dict(drbd.__salt__, {'cmd.run_all': mock_cmd}):
+            ret = drbd.sync_status_all(['res-*', 'res-tianjin', 'guangzhou'])
+            mock_cmd.assert_called_with('drbdadm status all')
+
+        assert sorted(ret) == ['guangzhou', 'res-beijing', 'res-tianjin']
+        assert ret['res-beijing']['synced']
+        assert not ret['res-tianjin']['synced']
+        assert ret['res-tianjin']['lagging peer volumes']['node2'][0]['done'] == 50.0
+        # Not running
+        assert not ret['guangzhou']['synced']
+
+    def test_wait_sync_events_all(self):
+        '''
+        Test if wait_sync_events_all follows one events2 for all resources
+        '''
+        lines = EVENTS2_SYNCING + [
+            'exists resource name:tianjin role:Primary suspended:no',
+            'exists connection name:tianjin peer-node-id:2 conn-name:node2 '
+            'connection:Connected role:Secondary',
+            'exists device name:tianjin volume:0 minor:6 disk:UpToDate client:no',
+            'exists peer-device name:tianjin peer-node-id:2 conn-name:node2 volume:0 '
+            'replication:Established peer-disk:UpToDate',
+        ]
+        # Move 'exists -' to the end of the initial state
+        lines.remove('exists -')
+        lines.append('exists -')
+        lines.append('change peer-device name:beijing peer-node-id:2 conn-name:node2 '
+                     'volume:0 replication:Established peer-disk:UpToDate')
+
+        mock_stream = MagicMock()
+
+        def stream(args, timeout=None):
+            mock_stream(args, timeout=timeout)
+            for line in lines:
+                yield line
+
+        with patch('salt.utils.path.which', MagicMock(return_value='/sbin/drbdsetup')):
+            with patch.object(drbd, '_stream_lines', stream):
+                ret = drbd.wait_sync_events_all(['beijing', 'tianjin'], timeout=10)
+
+        mock_stream.assert_called_once_with(['drbdsetup', 'events2', 'all'], timeout=10)
+        assert ret['beijing']['synced']
+        assert ret['tianjin']['synced']
+        assert ret['tianjin']['seconds'] <= ret['beijing']['seconds']
@@ -13,6 +13,7 @@ from tests.support.mixins import LoaderModuleMockMixin
 from tests.support.unit import TestCase, skipIf
 from tests.support.mock import (
     MagicMock,
+    call,
     patch,
     NO_MOCK,
     NO_MOCK_REASON
@@ -31,7 +32,8 @@ class DrbdStatesTestCase(TestCase, LoaderModuleMockMixin):
     Test cases for salt.states.drbd
     '''
     def setup_loader_modules(self):
-        return {drbd: {'__opts__': {'test': False}}}
+        return {drbd: {'__opts__': {'test': False},
+                       '__salt__': {'drbd.resource_exists': MagicMock(return_value=True)}}}
 
     def test_initialized(self):
         '''
@@ -45,11 +47,11 @@ class DrbdStatesTestCase(TestCase, LoaderModuleMockMixin):
             'comment': 'Resource {} not defined in your config.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(return_value=1)
+        mock_exists = MagicMock(return_value=False)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
             assert drbd.initialized(RES_NAME) == ret
-            mock_cmd.assert_called_once_with('drbdadm dump {}'.format(RES_NAME))
+            mock_exists.assert_called_once_with(name=RES_NAME, cached=True)
 
         # SubTest 2: Resource have already initialized
         ret = {
@@ -59,23 +61,41 @@ class DrbdStatesTestCase(TestCase, LoaderModuleMockMixin):
             'comment': 'Resource {} has already initialized.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(side_effect=[0, 0])
+        mock_metadata = MagicMock(return_value={'initialized': True})
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+        with patch.dict(drbd.__salt__, {'drbd.metadata_status': mock_metadata}):
             assert drbd.initialized(RES_NAME) == ret
+            mock_metadata.assert_called_once_with(name=RES_NAME, cached=True)
 
-        # SubTest 3: The test option
+        # SubTest 2.1: Volumes not configured on this host
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'No volume of resource {} configured on this host.'.format(RES_NAME),
+        }
+
+        mock_metadata = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'No volume of resource {} configured on this host.'.format(RES_NAME)))
+
+        with patch.dict(drbd.__salt__, {'drbd.metadata_status': mock_metadata}):
+            assert drbd.initialized(RES_NAME) == ret
+
+        # SubTest 3: The test option, only the missing volume
         ret = {
             'name': RES_NAME,
             'result': None,
-            'changes': {'name': RES_NAME},
+            'changes': {'name': RES_NAME, 'volumes': [1]},
             'comment': 'Resource {} would be initialized.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
+        metadata = {'initialized': False,
+                    'volumes': [{'volume': 0, 'present': True},
+                                {'volume': 1, 'present': False}]}
+        mock_metadata = MagicMock(return_value=metadata)
 
         with patch.dict(drbd.__opts__, {'test': True}):
-            with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+            with patch.dict(drbd.__salt__, {'drbd.metadata_status': mock_metadata}):
                 assert drbd.initialized(RES_NAME) == ret
 
         # SubTest 4: Error in initialize
@@ -83,32 +103,50 @@ class DrbdStatesTestCase(TestCase, LoaderModuleMockMixin):
             'name': RES_NAME,
             'result': False,
             'changes': {},
-            'comment': 'Error in initialize {}.'.format(RES_NAME),
+            'comment': 'Error in initialize {}/1: no disk.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
-        mock_createmd = MagicMock(return_value=1)
+        mock_createmd = MagicMock(return_value=[
+            {'resource name': RES_NAME, 'volume': 0, 'outcome': 'present', 'comment': ''},
+            {'resource name': RES_NAME, 'volume': 1, 'outcome': 'failed',
+             'comment': 'no disk'}])
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.createmd': mock_createmd}):
+        with patch.dict(drbd.__salt__, {'drbd.metadata_status': mock_metadata,
+                                        'drbd.createmd_many': mock_createmd}):
             assert drbd.initialized(RES_NAME, force=True) == ret
-            mock_createmd.assert_called_once_with(force=True, name=RES_NAME)
+            mock_createmd.assert_called_once_with(resources=[RES_NAME], force=True)
 
-        # SubTest 5: Succeed in initialize
+        # SubTest 5: Succeed in initialize, the present volume is kept
         ret = {
             'name': RES_NAME,
             'result': True,
-            'changes': {'name': RES_NAME},
+            'changes': {'name': RES_NAME, 'volumes': [1]},
             'comment': 'Resource {} metadata initialized.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
-        mock_createmd = MagicMock(return_value=0)
+        mock_createmd = MagicMock(return_value=[
+            {'resource name': RES_NAME, 'volume': 0, 'outcome': 'present', 'comment': ''},
+            {'resource name': RES_NAME, 'volume': 1, 'outcome': 'created', 'comment': ''}])
+
+        with patch.dict(drbd.__salt__, {'drbd.metadata_status': mock_metadata,
+                                        'drbd.createmd_many': mock_createmd}):
+            assert drbd.initialized(RES_NAME, force=True) == ret
+            mock_createmd.assert_called_once_with(resources=[RES_NAME], force=True)
+
+        # SubTest 5.1: Volume without outcome, not created
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Error in initialize {}/1: no outcome.'.format(RES_NAME),
+        }
+
+        mock_createmd = MagicMock(return_value=[
+            {'resource name': RES_NAME, 'volume': 0, 'outcome': 'present', 'comment': ''}])
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.createmd': mock_createmd}):
+        with patch.dict(drbd.__salt__, {'drbd.metadata_status': mock_metadata,
+                                        'drbd.createmd_many': mock_createmd}):
             assert drbd.initialized(RES_NAME, force=True) == ret
-            mock_createmd.assert_called_once_with(force=True, name=RES_NAME)
 
         # SubTest 6: Command error
         ret = {
@@ -118,14 +156,13 @@ class DrbdStatesTestCase(TestCase, LoaderModuleMockMixin):
             'comment': 'drdbadm createmd {} error.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_createmd = MagicMock(side_effect=exceptions.CommandExecutionError(
             'drdbadm createmd {} error.'.format(RES_NAME)))
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.createmd': mock_createmd}):
+        with patch.dict(drbd.__salt__, {'drbd.metadata_status': mock_metadata,
+                                        'drbd.createmd_many': mock_createmd}):
             assert drbd.initialized(RES_NAME, force=True) == ret
-            mock_createmd.assert_called_once_with(force=True, name=RES_NAME)
+            mock_createmd.assert_called_once_with(resources=[RES_NAME], force=True)
 
     def test_status(self):
         '''
@@ -139,11 +176,9 @@ class DrbdStatesTestCase(TestCase, LoaderModuleMockMixin):
             'comment': 'Resource {} is already stopped.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(side_effect=exceptions.CommandExecutionError)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.stopped(RES_NAME) == ret
 
         # Test 2: drbd status return empty []
@@ -154,36 +189,325 @@ class DrbdStatesTestCase(TestCase, LoaderModuleMockMixin):
             'comment': 'Resource {} is already stopped.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=[{'resource name': 'not_the_same'}])
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.stopped(RES_NAME) == ret
 
-    def test_get_resource_list(self):
+    def test_all_initialized(self):
         '''
-        Test drbd status(_get_res_status) return none.
+        Test to initialize multiple drbd resources together.
         '''
-        ret = ['beijing', 'tianjin', 'shanghai']
+        def _vol(name, vnr, outcome, **kwargs):
+            vol = {'resource name': name, 'volume': vnr, 'outcome': outcome,
+                   'seconds': 0, 'retcode': None, 'comment': ''}
+            vol.update(kwargs)
+            return vol
 
-        dump_info = '''
-common {
-}
+        # SubTest 1: No resource matched
+        ret = {
+            'name': 'init',
+            'result': False,
+            'changes': {},
+            'comment': 'No resource matches res-*.',
+        }
 
-resource beijing {
-}
+        mock_createmd = MagicMock(return_value=[])
 
-resource tianjin {
-}
+        with patch.dict(drbd.__salt__, {'drbd.createmd_many': mock_createmd}):
+            assert drbd.all_initialized('init', resources='res-*') == ret
+            mock_createmd.assert_called_once_with(resources='res-*', force=True,
+                                                  workers=4, test=True)
 
-resource shanghai {
-}
-'''
-        mock_cmd = MagicMock(return_value=dump_info)
+        # SubTest 2: Already initialized
+        ret = {
+            'name': 'init',
+            'result': True,
+            'changes': {},
+            'comment': 'Resources beijing, tianjin have already initialized.',
+        }
+
+        mock_createmd = MagicMock(return_value=[
+            _vol('beijing', 0, 'present'), _vol('tianjin', 0, 'diskless')])
+
+        with patch.dict(drbd.__salt__, {'drbd.createmd_many': mock_createmd}):
+            assert drbd.all_initialized('init', resources=['beijing', 'tianjin']) == ret
+
+        # SubTest 3: The test option
+        ret = {
+            'name': 'init',
+            'result': None,
+            'changes': {'tianjin': {0: {'initialized': None}}},
+            'comment': 'Resources tianjin would be initialized.',
+        }
+
+        mock_createmd = MagicMock(return_value=[
+            _vol('beijing', 0, 'present'), _vol('tianjin', 0, 'missing')])
+
+        with patch.dict(drbd.__opts__, {'test': True}):
+            with patch.dict(drbd.__salt__, {'drbd.createmd_many': mock_createmd}):
+                assert drbd.all_initialized('init', resources=['beijing', 'tianjin']) == ret
+                mock_createmd.assert_called_once_with(resources=['beijing', 'tianjin'],
+                                                      force=True, workers=4, test=True)
+
+        # SubTest 4: Error in initialize
+        ret = {
+            'name': 'init',
+            'result': False,
+            'changes': {'beijing': {1: {'initialized': True, 'seconds': 3}}},
+            'comment': 'Error in initialize tianjin/0: open(/dev/vdc1) failed.',
+        }
+
+        plan = [_vol('beijing', 0, 'present'), _vol('beijing', 1, 'missing'),
+                _vol('tianjin', 0, 'missing'), _vol('shanghai', 0, 'present')]
+        mock_createmd = MagicMock(side_effect=[plan, [
+            _vol('beijing', 0, 'present'),
+            _vol('beijing', 1, 'created', seconds=3, retcode=0),
+            _vol('tianjin', 0, 'failed', seconds=1, retcode=10,
+                 comment='open(/dev/vdc1) failed')]])
+
+        with patch.dict(drbd.__salt__, {'drbd.createmd_many': mock_createmd}):
+            assert drbd.all_initialized('init', resources=['beijing', 'tianjin', 'shanghai'],
+                                        workers=8) == ret
+            # Only the resources missing metadata are run
+            assert mock_createmd.call_args_list == [
+                call(resources=['beijing', 'tianjin', 'shanghai'], force=True, workers=8,
+                     test=True),
+                call(resources=['beijing', 'tianjin'], force=True, workers=8)]
+
+        # SubTest 5: Succeed in initialize
+        ret = {
+            'name': 'init',
+            'result': True,
+            'changes': {'beijing': {1: {'initialized': True, 'seconds': 3}},
+                        'tianjin': {0: {'initialized': True, 'seconds': 2}}},
+            'comment': 'Resources beijing, tianjin metadata initialized.',
+        }
+
+        plan = [_vol('beijing', 0, 'present'), _vol('beijing', 1, 'missing'),
+                _vol('tianjin', 0, 'missing')]
+        mock_createmd = MagicMock(side_effect=[plan, [
+            _vol('beijing', 0, 'present'),
+            _vol('beijing', 1, 'created', seconds=3, retcode=0),
+            _vol('tianjin', 0, 'created', seconds=2, retcode=0)]])
+
+        with patch.dict(drbd.__salt__, {'drbd.createmd_many': mock_createmd}):
+            assert drbd.all_initialized('init', resources=['beijing', 'tianjin']) == ret
+
+        # SubTest 5.1: Volumes without outcome are not initialized
+        ret = {
+            'name': 'init',
+            'result': False,
+            'changes': {'beijing': {1: {'initialized': True, 'seconds': 3}}},
+            'comment': 'Error in initialize tianjin/0: no outcome.',
+        }
+
+        mock_createmd = MagicMock(side_effect=[plan, [
+            _vol('beijing', 0, 'present'),
+            _vol('beijing', 1, 'created', seconds=3, retcode=0)]])
+
+        with patch.dict(drbd.__salt__, {'drbd.createmd_many': mock_createmd}):
+            assert drbd.all_initialized('init', resources=['beijing', 'tianjin']) == ret
+
+        ret['changes'] = {}
+        ret['comment'] = 'Error in initialize beijing/1: no outcome, tianjin/0: no outcome.'
+        mock_createmd = MagicMock(side_effect=[plan, []])
+
+        with patch.dict(drbd.__salt__, {'drbd.createmd_many': mock_createmd}):
+            assert drbd.all_initialized('init', resources=['beijing', 'tianjin']) == ret
+
+        # SubTest 6: Command error
+        ret = {
+            'name': 'init',
+            'result': False,
+            'changes': {},
+            'comment': 'No volume of resource beijing configured on this host.',
+        }
+
+        mock_createmd = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'No volume of resource beijing configured on this host.'))
+
+        with patch.dict(drbd.__salt__, {'drbd.createmd_many': mock_createmd}):
+            assert drbd.all_initialized('init', resources=['beijing']) == ret
+
+    def test_initialized_synced(self):
+        '''
+        Test to skip the initial sync of a new drbd resource.
+        '''
+        def _res(local, peer):
+            peernode = {'peernode name': 'node2', 'peer volumes': []}
+            if peer is None:
+                peernode['connection'] = 'Connecting'
+            else:
+                peernode['role'] = 'Secondary'
+                peernode['peer volumes'].append({'volume': '0', 'peer-disk': peer})
+            return {'resource name': RES_NAME, 'local role': 'Secondary',
+                    'local volumes': [{'volume': '0', 'disk': local}],
+                    'peer nodes': [peernode]}
+
+        mock_time_sleep = MagicMock()
+
+        # SubTest 1: Already synced
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {},
+            'comment': 'Resource {} has already been synced.'.format(RES_NAME),
+        }
+
+        mock_status = MagicMock(return_value=[_res('UpToDate', 'UpToDate')])
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
+            assert drbd.initialized_synced(RES_NAME) == ret
+            mock_status.assert_called_once_with(name=RES_NAME, cached=True)
+
+        # SubTest 2: Holding data
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} already holds data, '
+                       'would not skip the initial sync.'.format(RES_NAME),
+        }
+
+        mock_status = MagicMock(return_value=[_res('Inconsistent', 'UpToDate')])
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
+            assert drbd.initialized_synced(RES_NAME) == ret
+
+        # SubTest 3: The test option
+        ret = {
+            'name': RES_NAME,
+            'result': None,
+            'changes': {'name': RES_NAME},
+            'comment': 'Resource {} would be synced without initial sync.'.format(RES_NAME),
+        }
+
+        mock_status = MagicMock(return_value=None)
+
+        with patch.dict(drbd.__opts__, {'test': True}):
+            with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
+                assert drbd.initialized_synced(RES_NAME) == ret
+
+        # SubTest 4: Create metadata, start, wait the peer and clear the bitmap
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {'name': RES_NAME},
+            'comment': 'Resource {} is synced without initial sync.'.format(RES_NAME),
+        }
+
+        mock_status = MagicMock(side_effect=[
+            None,
+            [_res('Inconsistent', None)],
+            [_res('Inconsistent', 'DUnknown')],
+            [_res('Inconsistent', 'Inconsistent')],
+            [_res('UpToDate', 'UpToDate')],
+        ])
+        mock_metadata = MagicMock(return_value={'volumes': [{'volume': 0, 'present': False}]})
+        mock_createmd = MagicMock(return_value=[
+            {'resource name': RES_NAME, 'volume': 0, 'outcome': 'created'}])
+        mock_up = MagicMock(return_value=0)
+        mock_new_uuid = MagicMock(return_value=0)
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.metadata_status': mock_metadata,
+                                        'drbd.createmd_many': mock_createmd,
+                                        'drbd.up': mock_up,
+                                        'drbd.new_current_uuid': mock_new_uuid}):
+            with patch.object(time, 'sleep', mock_time_sleep):
+                assert drbd.initialized_synced(RES_NAME, interval=1) == ret
+                mock_createmd.assert_called_once_with(resources=[RES_NAME], force=True)
+                mock_up.assert_called_once_with(name=RES_NAME)
+                mock_new_uuid.assert_called_once_with(name=RES_NAME, clear_bitmap=True)
+                mock_status.assert_called_with(name=RES_NAME)
+                assert mock_time_sleep.call_count == 2
+
+        # SubTest 4.1: Volume without outcome, not started
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Error in initialize {}/0: no outcome.'.format(RES_NAME),
+        }
+
+        mock_status = MagicMock(return_value=None)
+        mock_createmd = MagicMock(return_value=[])
+        mock_up = MagicMock(return_value=0)
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.metadata_status': mock_metadata,
+                                        'drbd.createmd_many': mock_createmd,
+                                        'drbd.up': mock_up}):
+            assert drbd.initialized_synced(RES_NAME) == ret
+            assert not mock_up.called
+
+        # SubTest 5: Peer not connected
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Peers of resource {} are not connected within 10s.'.format(RES_NAME),
+        }
 
-        with patch.dict(drbd.__salt__, {'cmd.run': mock_cmd}):
+        mock_status = MagicMock(return_value=[_res('Inconsistent', None)])
+        mock_new_uuid = MagicMock(return_value=0)
+        mock_time = MagicMock(side_effect=[0, 5, 11])
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.new_current_uuid': mock_new_uuid}):
+            with patch.object(time, 'sleep', mock_time_sleep), \
+                    patch.object(time, 'time', mock_time):
+                assert drbd.initialized_synced(RES_NAME, timeout=10) == ret
+                assert not mock_new_uuid.called
+
+        # SubTest 6: Error in clearing the bitmap
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Error in clearing the bitmap of {}.'.format(RES_NAME),
+        }
+
+        mock_status = MagicMock(return_value=[_res('Inconsistent', 'Inconsistent')])
+        mock_new_uuid = MagicMock(return_value=10)
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.new_current_uuid': mock_new_uuid}):
+            assert drbd.initialized_synced(RES_NAME) == ret
+
+        # SubTest 7: Command error
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'drdbadm up {} error.'.format(RES_NAME),
+        }
+
+        mock_status = MagicMock(return_value=None)
+        mock_metadata = MagicMock(return_value={'volumes': [{'volume': 0, 'present': True}]})
+        mock_createmd = MagicMock(return_value=[
+            {'resource name': RES_NAME, 'volume': 0, 'outcome': 'present'}])
+        mock_up = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'drdbadm up {} error.'.format(RES_NAME)))
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.metadata_status': mock_metadata,
+                                        'drbd.createmd_many': mock_createmd,
+                                        'drbd.up': mock_up}):
+            assert drbd.initialized_synced(RES_NAME) == ret
+
+    def test_get_resource_list(self):
+        '''
+        Test resource list comes from the config index.
+        '''
+        ret = ['beijing', 'shanghai', 'tianjin']
+
+        mock_list = MagicMock(return_value=ret)
+
+        with patch.dict(drbd.__salt__, {'drbd.list_resources': mock_list}):
             assert drbd._get_resource_list() == ret
+            mock_list.assert_called_once_with()
 
     def test_started(self):
         '''
@@ -197,11 +521,11 @@ resource shanghai {
             'comment': 'Resource {} not defined in your config.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(return_value=1)
+        mock_exists = MagicMock(return_value=False)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
             assert drbd.started(RES_NAME) == ret
-            mock_cmd.assert_called_once_with('drbdadm dump {}'.format(RES_NAME))
+            mock_exists.assert_called_once_with(name=RES_NAME, cached=True)
 
         # SubTest 2: Resource is already started
         ret = {
@@ -224,12 +548,11 @@ resource shanghai {
         #              ]
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.started(RES_NAME) == ret
+            mock_status.assert_called_once_with(name=RES_NAME, cached=True)
 
         # SubTest 3: The test option
         ret = {
@@ -241,12 +564,10 @@ resource shanghai {
 
         res_status = None
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
         with patch.dict(drbd.__opts__, {'test': True}):
-            with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                            'drbd.status': mock_status}):
+            with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
                 assert drbd.started(RES_NAME) == ret
 
         # SubTest 4: Error in start
@@ -259,12 +580,10 @@ resource shanghai {
 
         res_status = None
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_up = MagicMock(return_value=1)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.up': mock_up}):
             assert drbd.started(RES_NAME) == ret
             mock_up.assert_called_once_with(name=RES_NAME)
@@ -279,12 +598,10 @@ resource shanghai {
 
         res_status = None
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_up = MagicMock(return_value=0)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.up': mock_up}):
             assert drbd.started(RES_NAME) == ret
             mock_up.assert_called_once_with(name=RES_NAME)
@@ -299,13 +616,11 @@ resource shanghai {
 
         res_status = None
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_up = MagicMock(side_effect=exceptions.CommandExecutionError(
             'drdbadm up {} error.'.format(RES_NAME)))
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.up': mock_up}):
             assert drbd.started(RES_NAME) == ret
             mock_up.assert_called_once_with(name=RES_NAME)
@@ -322,11 +637,11 @@ resource shanghai {
             'comment': 'Resource {} not defined in your config.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(return_value=1)
+        mock_exists = MagicMock(return_value=False)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
             assert drbd.stopped(RES_NAME) == ret
-            mock_cmd.assert_called_once_with('drbdadm dump {}'.format(RES_NAME))
+            mock_exists.assert_called_once_with(name=RES_NAME, cached=True)
 
         # SubTest 2: Resource is already stopped
         ret = {
@@ -349,11 +664,9 @@ resource shanghai {
         #              ]
         res_status = None
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.stopped(RES_NAME) == ret
 
         # SubTest 3: The test option
@@ -366,12 +679,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
         with patch.dict(drbd.__opts__, {'test': True}):
-            with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                            'drbd.status': mock_status}):
+            with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
                 assert drbd.stopped(RES_NAME) == ret
 
         # SubTest 4: Error in stop
@@ -384,12 +695,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_down = MagicMock(return_value=1)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.down': mock_down}):
             assert drbd.stopped(RES_NAME) == ret
             mock_down.assert_called_once_with(name=RES_NAME)
@@ -404,12 +713,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_down = MagicMock(return_value=0)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.down': mock_down}):
             assert drbd.stopped(RES_NAME) == ret
             mock_down.assert_called_once_with(name=RES_NAME)
@@ -424,13 +731,11 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_down = MagicMock(side_effect=exceptions.CommandExecutionError(
             'drdbadm down {} error.'.format(RES_NAME)))
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.down': mock_down}):
             assert drbd.stopped(RES_NAME) == ret
             mock_down.assert_called_once_with(name=RES_NAME)
@@ -447,11 +752,11 @@ resource shanghai {
             'comment': 'Resource {} not defined in your config.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(return_value=1)
+        mock_exists = MagicMock(return_value=False)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
             assert drbd.promoted(RES_NAME) == ret
-            mock_cmd.assert_called_once_with('drbdadm dump {}'.format(RES_NAME))
+            mock_exists.assert_called_once_with(name=RES_NAME, cached=True)
 
         # SubTest 2.1: Resource have already promoted
         ret = {
@@ -474,11 +779,9 @@ resource shanghai {
         #              ]
         res_status = [{'resource name': RES_NAME, 'local role': 'Primary'}]
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.promoted(RES_NAME) == ret
 
         # SubTest 2.2: Resource is stopped
@@ -502,11 +805,9 @@ resource shanghai {
         #              ]
         res_status = None
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.promoted(RES_NAME) == ret
 
         # SubTest 3: The test option
@@ -519,12 +820,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME, 'local role': 'Secondary'}]
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
         with patch.dict(drbd.__opts__, {'test': True}):
-            with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                            'drbd.status': mock_status}):
+            with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
                 assert drbd.promoted(RES_NAME) == ret
 
         # SubTest 4: Error in promotion
@@ -537,12 +836,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME, 'local role': 'Secondary'}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_primary = MagicMock(return_value=1)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.primary': mock_primary}):
             assert drbd.promoted(RES_NAME) == ret
             mock_primary.assert_called_once_with(force=False, name=RES_NAME)
@@ -557,12 +854,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME, 'local role': 'Secondary'}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_primary = MagicMock(return_value=0)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.primary': mock_primary}):
             assert drbd.promoted(RES_NAME) == ret
             mock_primary.assert_called_once_with(force=False, name=RES_NAME)
@@ -577,13 +872,11 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME, 'local role': 'Secondary'}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_primary = MagicMock(side_effect=exceptions.CommandExecutionError(
             'drdbadm primary {} error.'.format(RES_NAME)))
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.primary': mock_primary}):
             assert drbd.promoted(RES_NAME) == ret
             mock_primary.assert_called_once_with(force=False, name=RES_NAME)
@@ -600,11 +893,11 @@ resource shanghai {
             'comment': 'Resource {} not defined in your config.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(return_value=1)
+        mock_exists = MagicMock(return_value=False)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
             assert drbd.demoted(RES_NAME) == ret
-            mock_cmd.assert_called_once_with('drbdadm dump {}'.format(RES_NAME))
+            mock_exists.assert_called_once_with(name=RES_NAME, cached=True)
 
         # SubTest 2.1: Resource have already demoted
         ret = {
@@ -627,11 +920,9 @@ resource shanghai {
         #              ]
         res_status = [{'resource name': RES_NAME, 'local role': 'Secondary'}]
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.demoted(RES_NAME) == ret
 
         # SubTest 2.2: Resource is stopped
@@ -655,11 +946,9 @@ resource shanghai {
         #              ]
         res_status = None
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.demoted(RES_NAME) == ret
 
         # SubTest 3: The test option
@@ -672,12 +961,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME, 'local role': 'Primary'}]
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
         with patch.dict(drbd.__opts__, {'test': True}):
-            with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                            'drbd.status': mock_status}):
+            with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
                 assert drbd.demoted(RES_NAME) == ret
 
         # SubTest 4: Error in demotion
@@ -690,12 +977,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME, 'local role': 'Primary'}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_secondary = MagicMock(return_value=1)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.secondary': mock_secondary}):
             assert drbd.demoted(RES_NAME) == ret
             mock_secondary.assert_called_once_with(name=RES_NAME)
@@ -710,12 +995,10 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME, 'local role': 'Primary'}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_secondary = MagicMock(return_value=0)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.secondary': mock_secondary}):
             assert drbd.demoted(RES_NAME) == ret
             mock_secondary.assert_called_once_with(name=RES_NAME)
@@ -730,13 +1013,11 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME, 'local role': 'Primary'}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
         mock_secondary = MagicMock(side_effect=exceptions.CommandExecutionError(
             'drdbadm secondary {} error.'.format(RES_NAME)))
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
                                         'drbd.secondary': mock_secondary}):
             assert drbd.demoted(RES_NAME) == ret
             mock_secondary.assert_called_once_with(name=RES_NAME)
@@ -753,11 +1034,11 @@ resource shanghai {
             'comment': 'Resource {} not defined in your config.'.format(RES_NAME),
         }
 
-        mock_cmd = MagicMock(return_value=1)
+        mock_exists = MagicMock(return_value=False)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd}):
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
             assert drbd.wait_for_successful_synced(RES_NAME) == ret
-            mock_cmd.assert_called_once_with('drbdadm dump {}'.format(RES_NAME))
+            mock_exists.assert_called_once_with(name=RES_NAME, cached=True)
 
         # SubTest 2.1: Resource have already been synced
         ret = {
@@ -780,13 +1061,11 @@ resource shanghai {
         #              ]
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
-        mock_sync_status = MagicMock(return_value=1)
+        mock_sync_status = MagicMock(return_value={'synced': True})
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
-                                        'drbd.check_sync_status': mock_sync_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status}):
             assert drbd.wait_for_successful_synced(RES_NAME) == ret
 
         # SubTest 2.2: Resource is stopped
@@ -810,11 +1089,9 @@ resource shanghai {
         #              ]
         res_status = None
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
             assert drbd.wait_for_successful_synced(RES_NAME) == ret
 
         # SubTest 3: The test option
@@ -825,17 +1102,15 @@ resource shanghai {
             'comment': 'Check {} whether be synced within {}.'.format(RES_NAME, 600),
         }
 
-        # Fake res is enough, since mock drbd.check_sync_status
+        # Fake res is enough, since mock drbd.sync_status
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(return_value=0)
         mock_status = MagicMock(return_value=res_status)
-        mock_sync_status = MagicMock(return_value=0)
+        mock_sync_status = MagicMock(return_value={'synced': False})
 
         with patch.dict(drbd.__opts__, {'test': True}):
-            with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                            'drbd.status': mock_status,
-                                            'drbd.check_sync_status': mock_sync_status}):
+            with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                            'drbd.sync_status': mock_sync_status}):
                 assert drbd.wait_for_successful_synced(RES_NAME) == ret
                 mock_sync_status.assert_called_once_with(name=RES_NAME)
 
@@ -855,9 +1130,8 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
-        mock_sync_status = MagicMock(return_value=0)
+        mock_sync_status = MagicMock(return_value={'synced': False})
 
         # mock the time, being used in SubTest 4,5,6
         # fail to use deepcopy of MagicMock() in python2
@@ -870,14 +1144,48 @@ resource shanghai {
                                                 1557121668.89029,
                                                 1557121669.19029])
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
-                                        'drbd.check_sync_status': mock_sync_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_status}):
             with patch.object(time, 'time', mock_time_time):
                 with patch.object(time, 'sleep', mock_time_sleep):
                     assert drbd.wait_for_successful_synced(RES_NAME, interval=0.3, timeout=1) == ret
                     # Should call 5 times, when timeout is 1, interval is 0.3
-                    mock_sync_status.assert_called_with(name=RES_NAME)
+                    mock_sync_status.assert_called_with(name=RES_NAME, interval=0)
+
+        # SubTest 4.1: Not finish sync in time, report the lagging volumes
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} is not synced within {}s. Lagging: '
+                       'local volume 0 is Inconsistent (74.08% done), '
+                       'volume 1 of node3 is Inconsistent.'.format(RES_NAME, 1),
+        }
+
+        verdict = {'synced': False,
+                   'lagging local volumes': [{'volume': '0', 'disk': 'Inconsistent',
+                                              'done': 74.08}],
+                   'lagging peer volumes': {'node3': [{'volume': '1',
+                                                       'peer-disk': 'Inconsistent',
+                                                       'done': None}]}}
+
+        mock_status = MagicMock(return_value=res_status)
+        mock_sync_status = MagicMock(return_value=verdict)
+
+        mock_time_time = MagicMock(side_effect=[1557121667.98029,
+                                                1557121667.99029,
+                                                1557121668.29029,
+                                                1557121668.59029,
+                                                1557121668.89029,
+                                                1557121669.19029])
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_status}):
+            with patch.object(time, 'time', mock_time_time):
+                with patch.object(time, 'sleep', mock_time_sleep):
+                    assert drbd.wait_for_successful_synced(RES_NAME, interval=0.3, timeout=1) == ret
 
         # SubTest 5: Succeed in syncing in time
         ret = {
@@ -889,9 +1197,11 @@ resource shanghai {
 
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
-        mock_sync_status = MagicMock(side_effect=[0, 0, 0, 1])
+        mock_sync_status = MagicMock(side_effect=[{'synced': False},
+                                                  {'synced': False},
+                                                  {'synced': False},
+                                                  {'synced': True}])
 
         mock_time_time = MagicMock(side_effect=[1557121667.98029,
                                                 1557121667.99029,
@@ -900,29 +1210,32 @@ resource shanghai {
                                                 1557121668.89029,
                                                 1557121669.19029])
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
-                                        'drbd.check_sync_status': mock_sync_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_status}):
             with patch.object(time, 'time', mock_time_time):
                 with patch.object(time, 'sleep', mock_time_sleep):
                     assert drbd.wait_for_successful_synced(RES_NAME, interval=0.3, timeout=1) == ret
-                    mock_sync_status.assert_called_with(name=RES_NAME)
+                    mock_sync_status.assert_called_with(name=RES_NAME, interval=0)
 
         # SubTest 6: Command error
         ret = {
             'name': RES_NAME,
             'result': False,
             'changes': {},
-            'comment': 'drbd.check_sync_status: (drdbadm status {}) error.'.format(
+            'comment': 'drbd.sync_progress: (drdbadm status {}) error.'.format(
                        RES_NAME),
         }
 
         res_status = [{'resource name': RES_NAME}]
 
-        mock_cmd = MagicMock(side_effect=[0, 1])
         mock_status = MagicMock(return_value=res_status)
-        mock_sync_status = MagicMock(side_effect=[0, 0, 0, exceptions.CommandExecutionError(
-            'drbd.check_sync_status: (drdbadm status {}) error.'.format(RES_NAME))])
+        mock_sync_status = MagicMock(side_effect=[
+            {'synced': False},
+            {'synced': False},
+            {'synced': False},
+            exceptions.CommandExecutionError(
+                'drbd.sync_progress: (drdbadm status {}) error.'.format(RES_NAME))])
 
         mock_time_time = MagicMock(side_effect=[1557121667.98029,
                                                 1557121667.99029,
@@ -931,10 +1244,718 @@ resource shanghai {
                                                 1557121668.89029,
                                                 1557121669.19029])
 
-        with patch.dict(drbd.__salt__, {'cmd.retcode': mock_cmd,
-                                        'drbd.status': mock_status,
-                                        'drbd.check_sync_status': mock_sync_status}):
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_status}):
             with patch.object(time, 'time', mock_time_time):
                 with patch.object(time, 'sleep', mock_time_sleep):
                     assert drbd.wait_for_successful_synced(RES_NAME, interval=0.3, timeout=1) == ret
-                    mock_sync_status.assert_called_with(name=RES_NAME)
+                    mock_sync_status.assert_called_with(name=RES_NAME, interval=0)
+
+    def test_wait_for_successful_synced_eta(self):
+        '''
+        Test to fail early when the sync could not finish before timeout.
+        '''
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} will not be synced within {}s, ETA 900s. '
+                       'Lagging: volume 0 of node2 is Inconsistent '
+                       '(10.0% done, 0.10%/s, ETA 900s).'.format(RES_NAME, 60),
+        }
+
+        verdict = {'synced': False,
+                   'eta': 900.0,
+                   'lagging local volumes': [],
+                   'lagging peer volumes': {'node2': [{'volume': '0',
+                                                       'peer-disk': 'Inconsistent',
+                                                       'done': 10.0,
+                                                       'rate': 0.1,
+                                                       'eta': 900.0}]}}
+
+        res_status = [{'resource name': RES_NAME}]
+        mock_status = MagicMock(return_value=res_status)
+        mock_sync_status = MagicMock(return_value={'synced': False})
+        mock_sync_progress = MagicMock(side_effect=[dict(verdict, eta=None), verdict])
+        mock_time_time = MagicMock(side_effect=[1557121667.0,
+                                                1557121667.0,
+                                                1557121677.0])
+        mock_time_sleep = MagicMock()
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_progress}):
+            with patch.object(time, 'time', mock_time_time):
+                with patch.object(time, 'sleep', mock_time_sleep):
+                    assert drbd.wait_for_successful_synced(
+                        RES_NAME, interval=10, timeout=60, eta_margin=1.5) == ret
+                    assert mock_sync_progress.call_count == 2
+
+        # Off by default, wait until synced
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {'name': RES_NAME},
+            'comment': 'Resource {} is synced.'.format(RES_NAME),
+        }
+
+        mock_sync_progress = MagicMock(side_effect=[dict(verdict, eta=None), verdict,
+                                                    dict(verdict, synced=True)])
+        mock_time_time = MagicMock(side_effect=[1557121667.0,
+                                                1557121667.0,
+                                                1557121677.0,
+                                                1557121687.0])
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_progress}):
+            with patch.object(time, 'time', mock_time_time):
+                with patch.object(time, 'sleep', mock_time_sleep):
+                    assert drbd.wait_for_successful_synced(
+                        RES_NAME, interval=10, timeout=60) == ret
+                    assert mock_sync_progress.call_count == 3
+
+    def test_wait_for_successful_synced_backoff(self):
+        '''
+        Test the polls start short and follow the ETA, within interval and timeout.
+        '''
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {'name': RES_NAME},
+            'comment': 'Resource {} is synced.'.format(RES_NAME),
+        }
+
+        res_status = [{'resource name': RES_NAME}]
+        mock_status = MagicMock(return_value=res_status)
+        mock_sync_status = MagicMock(return_value={'synced': False})
+        mock_sync_progress = MagicMock(side_effect=[
+            {'synced': False, 'eta': None},
+            {'synced': False, 'eta': None},
+            {'synced': False, 'eta': 300.0},
+            {'synced': False, 'eta': 4.5},
+            {'synced': False, 'eta': 0.2},
+            {'synced': True}])
+        mock_time_time = MagicMock(side_effect=[0, 0, 1, 3, 7, 37, 41.5])
+        mock_time_sleep = MagicMock()
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_progress}):
+            with patch.object(time, 'time', mock_time_time):
+                with patch.object(time, 'sleep', mock_time_sleep):
+                    assert drbd.wait_for_successful_synced(
+                        RES_NAME, timeout=600, eta_margin=0) == ret
+                    assert [call[0][0] for call in mock_time_sleep.call_args_list] == \
+                        [1, 2, 4, 30, 4.5, 1]
+
+        # Never sleep past the timeout
+        mock_sync_progress = MagicMock(return_value={'synced': False, 'eta': None})
+        mock_time_time = MagicMock(side_effect=[0, 0, 1, 3, 7, 10, 10.5])
+        mock_time_sleep = MagicMock()
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_progress}):
+            with patch.object(time, 'time', mock_time_time):
+                with patch.object(time, 'sleep', mock_time_sleep):
+                    assert not drbd.wait_for_successful_synced(
+                        RES_NAME, interval=5, timeout=10)['result']
+                    assert [call[0][0] for call in mock_time_sleep.call_args_list] == \
+                        [1, 2, 4, 3, 0]
+
+    def test_wait_for_successful_synced_stall(self):
+        '''
+        Test to fail once the sync is not progressing.
+        '''
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} sync stalled for {}s: volume 1 of node3 is '
+                       'Inconsistent (replication: PausedSyncS, '
+                       'resync-suspended: peer, 40.0% done).'.format(RES_NAME, 20),
+        }
+
+        def verdict(done0, done1):
+            return {'synced': False,
+                    'lagging local volumes': [],
+                    'lagging peer volumes': {
+                        'node2': [{'volume': '0', 'peer-disk': 'Inconsistent',
+                                   'replication': 'SyncSource', 'done': done0}],
+                        'node3': [{'volume': '1', 'peer-disk': 'Inconsistent',
+                                   'replication': 'PausedSyncS',
+                                   'resync-suspended': 'peer', 'done': done1}]}}
+
+        res_status = [{'resource name': RES_NAME}]
+        mock_status = MagicMock(return_value=res_status)
+        mock_sync_status = MagicMock(return_value={'synced': False})
+        mock_sync_progress = MagicMock(side_effect=[verdict(10.0, 40.0),
+                                                    verdict(20.0, 40.0),
+                                                    verdict(30.0, 40.0),
+                                                    verdict(40.0, 40.0)])
+        mock_time_time = MagicMock(side_effect=[1557121600.0,
+                                                1557121600.0,
+                                                1557121610.0,
+                                                1557121620.0,
+                                                1557121630.0])
+        mock_time_sleep = MagicMock()
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_progress}):
+            with patch.object(time, 'time', mock_time_time):
+                with patch.object(time, 'sleep', mock_time_sleep):
+                    assert drbd.wait_for_successful_synced(
+                        RES_NAME, interval=10, timeout=600, stall_timeout=20) == ret
+                    assert mock_sync_progress.call_count == 3
+
+    def test_wait_for_successful_synced_events(self):
+        '''
+        Test to wait for a drbd resource being synced via events2.
+        '''
+        res_status = [{'resource name': RES_NAME}]
+        mock_status = MagicMock(return_value=res_status)
+        mock_time_sleep = MagicMock()
+
+        # SubTest 1: Synced via events
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {'name': RES_NAME},
+            'comment': 'Resource {} is synced.'.format(RES_NAME),
+        }
+
+        mock_sync_status = MagicMock(return_value={'synced': False})
+        mock_events = MagicMock(return_value={'synced': True})
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.wait_sync_events': mock_events}):
+            with patch.object(time, 'sleep', mock_time_sleep):
+                assert drbd.wait_for_successful_synced(
+                    RES_NAME, timeout=60, events=True, peernode='node2') == ret
+                mock_events.assert_called_once_with(name=RES_NAME, timeout=60,
+                                                    peernode='node2')
+                mock_sync_status.assert_called_once_with(name=RES_NAME, peernode='node2')
+                assert not mock_time_sleep.called
+
+        # SubTest 2: Not synced via events within timeout
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} is not synced within {}s. '
+                       'Lagging: volume 0 of node2 is Inconsistent.'.format(RES_NAME, 1),
+        }
+
+        verdict = {'synced': False,
+                   'lagging local volumes': [],
+                   'lagging peer volumes': {'node2': [{'volume': '0',
+                                                       'peer-disk': 'Inconsistent',
+                                                       'done': None}]}}
+        mock_events = MagicMock(return_value=verdict)
+        mock_time_time = MagicMock(side_effect=[1557121667.98029,
+                                                1557121669.19029])
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.wait_sync_events': mock_events}):
+            with patch.object(time, 'time', mock_time_time):
+                assert drbd.wait_for_successful_synced(
+                    RES_NAME, interval=0.3, timeout=1, events=True) == ret
+
+        # SubTest 3: Fall back to polling
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {'name': RES_NAME},
+            'comment': 'Resource {} is synced.'.format(RES_NAME),
+        }
+
+        mock_sync_status = MagicMock(side_effect=[{'synced': False},
+                                                  {'synced': True}])
+        mock_events = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'The drbdsetup binary is not available.'))
+        mock_time_time = MagicMock(return_value=1557121667.98029)
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status': mock_sync_status,
+                                        'drbd.sync_progress': mock_sync_status,
+                                        'drbd.wait_sync_events': mock_events}):
+            with patch.object(time, 'time', mock_time_time):
+                with patch.object(time, 'sleep', mock_time_sleep):
+                    assert drbd.wait_for_successful_synced(
+                        RES_NAME, interval=0.3, timeout=1, events=True) == ret
+
+    def test_replication_healthy(self):
+        '''
+        Test to check the replication against thresholds.
+        '''
+        def _peer(**kwargs):
+            peer = {'connection': 'Connected', 'congested': False, 'ahead/behind': None,
+                    'ap-in-flight': {'max': 300, 'avg': 200.0},
+                    'rs-in-flight': {'max': 0, 'avg': 0.0},
+                    'pending': {'max': 1, 'avg': 1.0},
+                    'unacked': {'max': 3, 'avg': 3.0},
+                    'out-of-sync': 0, 'send rate': 1000.0, 'lag': 0.2}
+            peer.update(kwargs)
+            return peer
+
+        # SubTest 1: Resource not exist
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} not defined in your config.'.format(RES_NAME),
+        }
+
+        mock_exists = MagicMock(return_value=False)
+
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
+            assert drbd.replication_healthy(RES_NAME) == ret
+
+        # SubTest 2: Healthy
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {},
+            'comment': 'Resource {} replication is healthy.'.format(RES_NAME),
+        }
+
+        mock_health = MagicMock(return_value={'resource name': RES_NAME,
+                                              'peer nodes': {'node2': _peer(congested=True)}})
+
+        with patch.dict(drbd.__salt__, {'drbd.replication_health': mock_health}):
+            assert drbd.replication_healthy(RES_NAME, max_lag=1, max_ap_in_flight=300,
+                                            max_unacked=3, peernode='node2') == ret
+            mock_health.assert_called_once_with(name=RES_NAME, samples=3, interval=1,
+                                                peernode='node2')
+
+        # SubTest 3: Over thresholds
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} replication is unhealthy: node2 went Ahead, '
+                       'node2 congested, node2 ap-in-flight 300 > 256, node2 lag 0.20s > 0.1s, '
+                       'node3 is Connecting, node4 lag unknown, nothing sent.'.format(RES_NAME),
+        }
+
+        mock_health = MagicMock(return_value={'resource name': RES_NAME, 'peer nodes': {
+            'node2': _peer(congested=True, **{'ahead/behind': 'Ahead'}),
+            'node3': _peer(connection='Connecting'),
+            'node4': _peer(lag=None, **{'ap-in-flight': {'max': 8, 'avg': 8.0}})}})
+
+        with patch.dict(drbd.__salt__, {'drbd.replication_health': mock_health}):
+            assert drbd.replication_healthy(RES_NAME, max_lag=0.1, max_ap_in_flight=256,
+                                            allow_congested=False) == ret
+
+        # SubTest 4: No peer
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} has no peer node to replicate.'.format(RES_NAME),
+        }
+
+        mock_health = MagicMock(return_value={'resource name': RES_NAME, 'peer nodes': {}})
+
+        with patch.dict(drbd.__salt__, {'drbd.replication_health': mock_health}):
+            assert drbd.replication_healthy(RES_NAME) == ret
+
+        # SubTest 5: Command error
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Error(10) happened when get statistics via drbdsetup.',
+        }
+
+        mock_health = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'Error(10) happened when get statistics via drbdsetup.'))
+
+        with patch.dict(drbd.__salt__, {'drbd.replication_health': mock_health}):
+            assert drbd.replication_healthy(RES_NAME) == ret
+
+    def test_all_synced(self):
+        '''
+        Test to wait for multiple drbd resources being synced together.
+        '''
+        synced = {'synced': True}
+        unsynced = {'synced': False}
+        mock_time_sleep = MagicMock()
+        mock_status = MagicMock(return_value=[{'resource name': 'beijing'},
+                                              {'resource name': 'tianjin'}])
+
+        # SubTest 1: No resource matched
+        ret = {
+            'name': 'sync',
+            'result': False,
+            'changes': {},
+            'comment': 'No resource matches res-*.',
+        }
+
+        mock_sync_status = MagicMock(return_value={})
+
+        with patch.dict(drbd.__salt__, {'drbd.sync_status_all': mock_sync_status}):
+            assert drbd.all_synced('sync', resources='res-*') == ret
+            mock_sync_status.assert_called_once_with(resources=['res-*'])
+
+        # SubTest 1.1: Named resource not exist
+        ret = {
+            'name': 'sync',
+            'result': False,
+            'changes': {},
+            'comment': 'Resources shanghai not defined in your config.',
+        }
+
+        mock_exists = MagicMock(side_effect=lambda name, cached: name != 'shanghai')
+
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists,
+                                        'drbd.sync_status_all': mock_sync_status}):
+            assert drbd.all_synced('sync', resources=['beijing', 'shanghai', 'res-*']) == ret
+            mock_sync_status.assert_called_once_with(resources=['res-*'])
+
+        # SubTest 1.2: Named resource not running, fail without waiting
+        ret = {
+            'name': 'sync',
+            'result': False,
+            'changes': {},
+            'comment': 'Resources shanghai are currently stop.',
+        }
+
+        mock_sync_status = MagicMock()
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status_all': mock_sync_status}):
+            assert drbd.all_synced('sync', resources=['beijing', 'shanghai']) == ret
+            mock_status.assert_called_once_with(name='all', cached=True)
+            mock_sync_status.assert_not_called()
+
+        # SubTest 2: Already synced
+        ret = {
+            'name': 'sync',
+            'result': True,
+            'changes': {},
+            'comment': 'Resources beijing, tianjin have already been synced.',
+        }
+
+        mock_sync_status = MagicMock(return_value={'beijing': synced, 'tianjin': synced})
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.sync_status_all': mock_sync_status}):
+            assert drbd.all_synced('sync', resources=['beijing', 'tianjin']) == ret
+
+        # SubTest 3: The test option
+        ret = {
+            'name': 'sync',
+            'result': None,
+            'changes': {'tianjin': {'synced': None}},
+            'comment': 'Check tianjin whether be synced within 600.',
+        }
+
+        mock_sync_status = MagicMock(return_value={'beijing': synced, 'tianjin': unsynced})
+
+        with patch.dict(drbd.__opts__, {'test': True}):
+            with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                            'drbd.sync_status_all': mock_sync_status}):
+                assert drbd.all_synced('sync', resources=['beijing', 'tianjin']) == ret
+
+        # SubTest 4: Synced by polling, one status sample per poll
+        ret = {
+            'name': 'sync',
+            'result': True,
+            'changes': {'tianjin': {'synced': True, 'seconds': 3.5},
+                        'shanghai': {'synced': True, 'seconds': 1.25}},
+            'comment': 'Resources beijing, shanghai, tianjin are synced.',
+        }
+
+        mock_sync_status = MagicMock(side_effect=[
+            {'beijing': synced, 'tianjin': unsynced, 'shanghai': unsynced},
+            {'tianjin': unsynced, 'shanghai': synced},
+            {'tianjin': synced}])
+        # The seconds are read from the clock after each sample
+        mock_time_time = MagicMock(side_effect=[1557121600.0,
+                                                1557121600.0,
+                                                1557121601.25,
+                                                1557121601.25,
+                                                1557121603.5])
+
+        with patch.dict(drbd.__salt__, {'drbd.sync_status_all': mock_sync_status}):
+            with patch.object(time, 'time', mock_time_time):
+                with patch.object(time, 'sleep', mock_time_sleep):
+                    assert drbd.all_synced('sync', interval=10) == ret
+                    mock_sync_status.assert_called_with(resources=['tianjin'])
+                    assert mock_sync_status.call_count == 3
+                    # Back off from 1s instead of a fixed interval
+                    assert mock_time_sleep.call_args_list == [call(1), call(2)]
+
+        # SubTest 5: Not synced in time via events
+        ret = {
+            'name': 'sync',
+            'result': False,
+            'changes': {'shanghai': {'synced': True, 'seconds': 3.5}},
+            'comment': 'Resources tianjin are not synced within 60s.',
+        }
+
+        mock_sync_status = MagicMock(return_value={'tianjin': unsynced,
+                                                   'shanghai': unsynced})
+        mock_events = MagicMock(return_value={
+            'tianjin': {'synced': False, 'seconds': None},
+            'shanghai': {'synced': True, 'seconds': 3.5}})
+        mock_time_time = MagicMock(side_effect=[1557121600.0,
+                                                1557121661.0])
+
+        with patch.dict(drbd.__salt__, {'drbd.sync_status_all': mock_sync_status,
+                                        'drbd.wait_sync_events_all': mock_events}):
+            with patch.object(time, 'time', mock_time_time):
+                assert drbd.all_synced('sync', timeout=60, events=True) == ret
+                mock_events.assert_called_once_with(names=['shanghai', 'tianjin'],
+                                                    timeout=60)
+
+        # SubTest 6: Command error
+        ret = {
+            'name': 'sync',
+            'result': False,
+            'changes': {},
+            'comment': 'drbdadm status error.',
+        }
+
+        mock_sync_status = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'drbdadm status error.'))
+
+        with patch.dict(drbd.__salt__, {'drbd.sync_status_all': mock_sync_status}):
+            assert drbd.all_synced('sync') == ret
+
+    def test_started_resources(self):
+        '''
+        Test to check a list of drbd resources is started by one drbdadm.
+        '''
+        status = [{'resource name': 'beijing', 'local role': 'Primary'},
+                  {'resource name': 'tianjin', 'local role': 'Secondary'}]
+
+        # SubTest 1: Resource not exist
+        ret = {
+            'name': 'up',
+            'result': False,
+            'changes': {},
+            'comment': 'Resources shanghai not defined in your config.',
+        }
+
+        mock_exists = MagicMock(side_effect=lambda name, cached: name != 'shanghai')
+
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
+            assert drbd.started('up', resources=['beijing', 'shanghai']) == ret
+
+        # SubTest 2: Already started
+        ret = {
+            'name': 'up',
+            'result': True,
+            'changes': {},
+            'comment': 'Resources beijing, tianjin are already started.',
+        }
+
+        mock_status = MagicMock(return_value=status)
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
+            assert drbd.started('up', resources=['beijing', 'tianjin']) == ret
+            mock_status.assert_called_once_with(name='all', cached=True)
+
+        # SubTest 3: The test option
+        ret = {
+            'name': 'up',
+            'result': None,
+            'changes': {'shanghai': {'started': None}, 'guangzhou': {'started': None}},
+            'comment': 'Resources shanghai, guangzhou would be started.',
+        }
+
+        with patch.dict(drbd.__opts__, {'test': True}):
+            with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
+                assert drbd.started(
+                    'up', resources=['beijing', 'shanghai', 'guangzhou']) == ret
+
+        # SubTest 4: Started except one
+        ret = {
+            'name': 'up',
+            'result': False,
+            'changes': {'shanghai': {'started': True}},
+            'comment': 'Error in start guangzhou.',
+        }
+
+        mock_up = MagicMock(return_value={'shanghai': 0, 'guangzhou': 10})
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.up': mock_up}):
+            assert drbd.started('up', resources=['beijing', 'shanghai', 'guangzhou']) == ret
+            mock_up.assert_called_once_with(name=['shanghai', 'guangzhou'])
+
+        # SubTest 5: Promoted
+        ret = {
+            'name': 'primary',
+            'result': True,
+            'changes': {'tianjin': {'promoted': True}},
+            'comment': 'Resources tianjin are promoted.',
+        }
+
+        mock_primary = MagicMock(return_value={'tianjin': 0})
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status,
+                                        'drbd.primary': mock_primary}):
+            assert drbd.promoted('primary', force=True, resources=['beijing', 'tianjin']) == ret
+            mock_primary.assert_called_once_with(name=['tianjin'], force=True)
+
+        # SubTest 6: Not demoted when stopped
+        ret = {
+            'name': 'secondary',
+            'result': False,
+            'changes': {},
+            'comment': 'Resources shanghai are currently stop.',
+        }
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
+            assert drbd.demoted('secondary', resources=['beijing', 'shanghai']) == ret
+
+        # SubTest 7: Stopped, status error
+        ret = {
+            'name': 'down',
+            'result': False,
+            'changes': {},
+            'comment': 'drbdadm status error.',
+        }
+
+        mock_status = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'drbdadm status error.'))
+
+        with patch.dict(drbd.__salt__, {'drbd.status': mock_status}):
+            assert drbd.stopped('down', resources=['beijing']) == ret
+
+    def test_adjusted(self):
+        '''
+        Test to check drbd resources are adjusted only when changed.
+        '''
+        plan = [{'command': 'net-options', 'args': [RES_NAME, '2'], 'peer': 'node2',
+                 'volume': None, 'options': {'protocol': 'A'}}]
+
+        # SubTest 1: Resource not exist
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'Resource {} not defined in your config.'.format(RES_NAME),
+        }
+
+        mock_exists = MagicMock(return_value=False)
+
+        with patch.dict(drbd.__salt__, {'drbd.resource_exists': mock_exists}):
+            assert drbd.adjusted(RES_NAME) == ret
+
+        # SubTest 2: Nothing planned
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {},
+            'comment': 'Resource {} is already adjusted.'.format(RES_NAME),
+        }
+
+        mock_adjust = MagicMock(return_value={})
+
+        with patch.dict(drbd.__salt__, {'drbd.adjust_changed': mock_adjust}):
+            assert drbd.adjusted(RES_NAME) == ret
+            mock_adjust.assert_called_once_with(name=[RES_NAME], test=False)
+
+        # SubTest 3: The test option
+        ret = {
+            'name': 'adjust',
+            'result': None,
+            'changes': {RES_NAME: {'plan': plan}},
+            'comment': 'Resources {} would be adjusted.'.format(RES_NAME),
+        }
+
+        mock_adjust = MagicMock(return_value={RES_NAME: {'plan': plan, 'retcode': None}})
+
+        with patch.dict(drbd.__opts__, {'test': True}):
+            with patch.dict(drbd.__salt__, {'drbd.adjust_changed': mock_adjust}):
+                assert drbd.adjusted('adjust', resources=[RES_NAME, 'tianjin']) == ret
+                mock_adjust.assert_called_once_with(name=[RES_NAME, 'tianjin'], test=True)
+
+        # SubTest 4: Adjusted except one
+        ret = {
+            'name': 'adjust',
+            'result': False,
+            'changes': {RES_NAME: {'plan': plan}},
+            'comment': 'Error in adjust tianjin.',
+        }
+
+        mock_adjust = MagicMock(return_value={RES_NAME: {'plan': plan, 'retcode': 0},
+                                              'tianjin': {'plan': plan, 'retcode': 10}})
+
+        with patch.dict(drbd.__salt__, {'drbd.adjust_changed': mock_adjust}):
+            assert drbd.adjusted('adjust', resources=[RES_NAME, 'tianjin']) == ret
+
+        # SubTest 5: Adjusted
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {RES_NAME: {'plan': plan}},
+            'comment': 'Resources {} are adjusted.'.format(RES_NAME),
+        }
+
+        mock_adjust = MagicMock(return_value={RES_NAME: {'plan': plan, 'retcode': 0}})
+
+        with patch.dict(drbd.__salt__, {'drbd.adjust_changed': mock_adjust}):
+            assert drbd.adjusted(RES_NAME) == ret
+
+        # SubTest 6: Error in dry run
+        ret = {
+            'name': RES_NAME,
+            'result': False,
+            'changes': {},
+            'comment': 'drbdadm dry run error.',
+        }
+
+        mock_adjust = MagicMock(side_effect=exceptions.CommandExecutionError(
+            'drbdadm dry run error.'))
+
+        with patch.dict(drbd.__salt__, {'drbd.adjust_changed': mock_adjust}):
+            assert drbd.adjusted(RES_NAME) == ret
+
+    def test_perf_summary(self):
+        '''
+        Test if states add the drbd commands to their comment when asked
+        '''
+        before = {'calls': 3, 'seconds': 0.5,
+                  'commands': {'drbdadm status': {'calls': 3, 'seconds': 0.5}}}
+        after = {'calls': 5, 'seconds': 0.875,
+                 'commands': {'drbdadm status': {'calls': 4, 'seconds': 0.625},
+                              'drbdadm up': {'calls': 1, 'seconds': 0.25}}}
+        ret = {
+            'name': RES_NAME,
+            'result': True,
+            'changes': {'name': RES_NAME},
+            'comment': 'Resource {} is started.\n'
+                       'drbd commands: 2 in 0.375s '
+                       '(drbdadm status x1 0.125s, drbdadm up x1 0.250s)'.format(RES_NAME),
+        }
+
+        mock_perf = MagicMock(side_effect=[before, after])
+        mock_status = MagicMock(return_value=None)
+        mock_up = MagicMock(return_value=0)
+
+        with patch.dict(drbd.__opts__, {'drbd.perf_stats': True}):
+            with patch.dict(drbd.__salt__, {'drbd.perf_stats': mock_perf,
+                                            'drbd.status': mock_status,
+                                            'drbd.up': mock_up}):
+                assert drbd.started(RES_NAME) == ret
+                assert mock_perf.call_count == 2
+
+        # Disabled by default
+        mock_perf = MagicMock()
+        ret['comment'] = 'Resource {} is started.'.format(RES_NAME)
+
+        with patch.dict(drbd.__salt__, {'drbd.perf_stats': mock_perf,
+                                        'drbd.status': mock_status,
+                                        'drbd.up': mock_up}):
+            assert drbd.started(RES_NAME) == ret
+            mock_perf.assert_not_called()
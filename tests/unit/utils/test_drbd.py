@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: Nick Wang <nwang@suse.com>
+'''
+
+# Import Python libs
+from __future__ import absolute_import, print_function, unicode_literals
+
+# Import Salt Testing Libs
+from tests.support.unit import TestCase
+
+# Import Salt Libs
+import salt.utils.drbd as drbd
+
+EVENTS2_SYNCING = '''exists resource name:beijing role:Primary suspended:no write-ordering:flush
+exists connection name:beijing peer-node-id:2 conn-name:node2 connection:Connected role:Secondary
+exists device name:beijing volume:0 minor:5 disk:UpToDate client:no quorum:yes
+exists peer-device name:beijing peer-node-id:2 conn-name:node2 volume:0 replication:SyncSource \
+peer-disk:Inconsistent peer-client:no resync-suspended:no
+exists -'''.splitlines()
+
+
+class DrbdUtilsTestCase(TestCase):
+    '''
+    Test cases for salt.utils.drbd
+    '''
+    def test_sync_states(self):
+        '''
+        Test the online verify is a sync state
+        '''
+        assert 'VerifyS' in drbd.SYNC_STATES
+        assert 'VerifyT' in drbd.SYNC_STATES
+
+    def test_events_state(self):
+        '''
+        Test if EventsState rebuilds the status from events2 lines
+        '''
+        state = drbd.EventsState()
+        for line in EVENTS2_SYNCING[:-1]:
+            state.feed(line)
+        assert not state.complete
+
+        state.feed(EVENTS2_SYNCING[-1])
+        assert state.complete
+
+        assert state.to_status('beijing') == {
+            'resource name': 'beijing',
+            'local role': 'Primary',
+            'local volumes': [{'volume': '0', 'disk': 'UpToDate'}],
+            'peer nodes': [{'peernode name': 'node2',
+                            'role': 'Secondary',
+                            'peer volumes': [{'volume': '0',
+                                              'peer-disk': 'Inconsistent',
+                                              'replication': 'SyncSource',
+                                              'resync-suspended': 'no'}]}]}
+
+        changed = state.feed('change peer-device name:beijing peer-node-id:2 '
+                             'conn-name:node2 volume:0 replication:Established '
+                             'peer-disk:UpToDate')
+        assert changed[0] == 'peer-device'
+        assert changed[3]['peer-disk'] == 'Inconsistent'
+        assert changed[4]['peer-disk'] == 'UpToDate'
+
+        assert state.feed('call helper name:beijing helper:before-resync-target') is None
+
+        # No peer volumes once disconnected, like drbdadm status
+        state.feed('change connection name:beijing peer-node-id:2 conn-name:node2 '
+                   'connection:Connecting')
+        assert state.to_status('beijing')['peer nodes'] == [
+            {'peernode name': 'node2', 'connection': 'Connecting', 'peer volumes': []}]
+
+        state.feed('destroy connection name:beijing peer-node-id:2 conn-name:node2')
+        assert state.to_status('beijing')['peer nodes'] == []
+        assert state.to_status('tianjin') is None